@@ -0,0 +1,92 @@
+import hashlib
+import hmac
+
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.core.cache import cache
+
+from django_redis import get_redis_connection
+
+from common.models import User
+from crazyarms import constants
+
+CREDENTIALS_CACHE_TIMEOUT = 60 * 5
+FAILURES_WINDOW = 60 * 5
+MAX_FAILURES_PER_USERNAME = 10
+MAX_FAILURES_PER_IP = 30
+MAX_FAILURES_WITHOUT_IP = 100
+
+
+def failure_keys(username, ip=None):
+    # With an IP, only lock out a username from that IP, so anyone else can't lock a user out. Liquidsoap's DJ auth
+    # doesn't send one, so then it's the username, plus a count shared by all requests without one, so a flood of
+    # random usernames doesn't get a password hashed for every attempt.
+    prefix, username = constants.REDIS_KEY_API_AUTH_FAILURES_PREFIX, username.lower()
+    if ip:
+        return {
+            f"{prefix}username:{username}:ip:{ip}": MAX_FAILURES_PER_USERNAME,
+            f"{prefix}ip:{ip}": MAX_FAILURES_PER_IP,
+        }
+    return {
+        f"{prefix}username:{username}": MAX_FAILURES_PER_USERNAME,
+        f"{prefix}no-ip": MAX_FAILURES_WITHOUT_IP,
+    }
+
+
+def is_throttled(username, ip=None):
+    keys = failure_keys(username, ip)
+    failures = get_redis_connection().mget(keys.keys())
+    return any(int(num or 0) >= max_failures for num, max_failures in zip(failures, keys.values()))
+
+
+def record_failure(username, ip=None):
+    redis = get_redis_connection()
+    keys = failure_keys(username, ip)
+    pipe = redis.pipeline()
+    for key in keys:
+        pipe.incr(key)
+    # Window starts at the first failure
+    for key, num in zip(keys, pipe.execute()):
+        if num == 1:
+            redis.expire(key, FAILURES_WINDOW)
+
+
+def clear_failures(username, ip=None):
+    # Only the username's count, an IP's is left to run out
+    username_key = next(iter(failure_keys(username, ip)))
+    get_redis_connection().delete(username_key)
+
+
+def credentials_cache_key(username, password):
+    digest = hmac.new(
+        settings.SECRET_KEY.encode(), f"{username.lower()}\0{password}".encode(), hashlib.sha256
+    ).hexdigest()
+    return f"{constants.CACHE_KEY_API_AUTH_CREDENTIALS_PREFIX}{digest}"
+
+
+def get_cached_user(username, password):
+    """Returns the user for credentials that recently succeeded, skipping the (slow) password hash. Cache entries are
+    only valid for a user whose password hash hasn't changed since, and who is still active. Checked before throttling,
+    so a user with cached credentials can't be locked out by someone else's failures."""
+    cache_key = credentials_cache_key(username, password)
+    cached = cache.get(cache_key)
+    if cached:
+        user_id, password_hash_digest = cached
+        user = User.objects.filter(id=user_id, is_active=True).first()
+        if user and hmac.compare_digest(hashlib.sha256(user.password.encode()).hexdigest(), password_hash_digest):
+            return user
+        cache.delete(cache_key)
+    return None
+
+
+def authenticate_and_cache(username, password):
+    """authenticate(), caching successful credentials for get_cached_user()"""
+    user = authenticate(username=username, password=password)
+    if user:
+        password_hash_digest = hashlib.sha256(user.password.encode()).hexdigest()
+        cache.set(
+            credentials_cache_key(username, password),
+            (user.id, password_hash_digest),
+            timeout=CREDENTIALS_CACHE_TIMEOUT,
+        )
+    return user
@@ -0,0 +1,99 @@
+from concurrent.futures import ThreadPoolExecutor
+import statistics
+import threading
+import time
+
+import requests
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure internal API latency (next track and DJ auth) while the admin/webui is under load, comparing the "
+        "dedicated API service against the API served by the app workers"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--hosts",
+            nargs="+",
+            default=["http://api:8000", "http://app:8000"],
+            help="Base URLs to benchmark the API on (default: http://api:8000 http://app:8000)",
+        )
+        parser.add_argument(
+            "--admin-url",
+            default="http://app:8000/admin/login/",
+            help="URL used to generate admin/webui load (default: http://app:8000/admin/login/)",
+        )
+        parser.add_argument(
+            "-u",
+            "--username",
+            help="Username of a DJ to include DJ auth requests (bad credentials would get throttled)",
+        )
+        parser.add_argument("-p", "--password", help="Password of the DJ given by --username")
+        parser.add_argument(
+            "-n", "--requests", type=int, default=500, help="Number of API requests per host (default: 500)"
+        )
+        parser.add_argument("-c", "--concurrency", type=int, default=20, help="Concurrent API requests (default: 20)")
+        parser.add_argument(
+            "-l", "--load-concurrency", type=int, default=10, help="Concurrent admin/webui requests (default: 10)"
+        )
+
+    def generate_load(self, url, stop_event):
+        session = requests.Session()
+        while not stop_event.is_set():
+            try:
+                session.get(url, timeout=30)
+            except requests.RequestException:
+                time.sleep(0.1)
+
+    def timed_request(self, session, url, data):
+        start = time.monotonic()
+        try:
+            response = session.post(url, json=data, headers={"X-Crazyarms-Secret-Key": settings.SECRET_KEY}, timeout=30)
+            ok = response.status_code == 200
+        except requests.RequestException:
+            ok = False
+        return time.monotonic() - start, ok
+
+    def benchmark_host(self, host, endpoints, num_requests, concurrency):
+        sessions = threading.local()
+
+        def run(num):
+            if not hasattr(sessions, "session"):
+                sessions.session = requests.Session()
+            endpoint, data = endpoints[num % len(endpoints)]
+            return self.timed_request(sessions.session, f"{host}/api/{endpoint}", data)
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return list(executor.map(run, range(num_requests)))
+
+    def handle(self, *args, **options):
+        endpoints = [("next-track/", None)]
+        if options["username"]:
+            endpoints.append(("dj-auth/", {"username": options["username"], "password": options["password"] or ""}))
+
+        stop_event = threading.Event()
+        load_threads = [
+            threading.Thread(target=self.generate_load, args=(options["admin_url"], stop_event), daemon=True)
+            for _ in range(options["load_concurrency"])
+        ]
+        for thread in load_threads:
+            thread.start()
+
+        self.stdout.write(f"Generating admin/webui load with {len(load_threads)} clients on {options['admin_url']}")
+
+        try:
+            for host in options["hosts"]:
+                results = self.benchmark_host(host, endpoints, options["requests"], options["concurrency"])
+                latencies = sorted(latency * 1000 for latency, _ in results)
+                failures = sum(1 for _, ok in results if not ok)
+                p50, p95, p99 = (statistics.quantiles(latencies, n=100)[p - 1] for p in (50, 95, 99))
+                self.stdout.write(
+                    f"{host}: {len(results)} requests, {failures} failed, p50={p50:.1f}ms p95={p95:.1f}ms"
+                    f" p99={p99:.1f}ms max={latencies[-1]:.1f}ms"
+                )
+        finally:
+            stop_event.set()
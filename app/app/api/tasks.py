@@ -1,19 +1,24 @@
+from collections import defaultdict
 import logging
 import os
 import re
 
 from django.conf import settings
-from django.core.exceptions import ValidationError
-from django.core.files import File
 
+from django_redis import get_redis_connection
 from huey.contrib import djhuey
 
 from autodj.models import AudioAsset, Playlist, RotatorAsset
 from broadcast.models import BroadcastAsset
 from common.models import User
+from common.tasks import import_asset_files
+from crazyarms import constants
 
 logger = logging.getLogger(f"crazyarms.{__name__}")
 
+SFTP_UPLOADS_BATCH_SIZE = 500
+SFTP_UPLOADS_DEBOUNCE_SECONDS = 5
+SFTP_UPLOADS_MAX_ATTEMPTS = 5
 SFTP_PATH_ASSET_CLASSES = {
     "audio-assets": AudioAsset,
     "scheduled-broadcast-assets": BroadcastAsset,
@@ -26,53 +31,114 @@ SFTP_PATH_RE = re.compile(
 )
 
 
-@djhuey.task(priority=1)
-def process_sftp_upload(sftp_path):
-    logger.info(f"processing sftp upload: {sftp_path}")
+def queue_sftp_uploads(sftp_paths):
+    redis = get_redis_connection()
+    redis.rpush(constants.REDIS_KEY_SFTP_UPLOADS, *sftp_paths)
+    # Debounce, only schedule a batch if one isn't already waiting to run
+    if redis.set(constants.REDIS_KEY_SFTP_UPLOADS_SCHEDULED, 1, nx=True, ex=SFTP_UPLOADS_DEBOUNCE_SECONDS * 10):
+        process_sftp_uploads.schedule(delay=SFTP_UPLOADS_DEBOUNCE_SECONDS)
 
-    if os.path.isfile(sftp_path) and not os.path.islink(sftp_path):
+
+def drain_sftp_uploads():
+    redis = get_redis_connection()
+    # Anything queued after this will schedule a new batch
+    redis.delete(constants.REDIS_KEY_SFTP_UPLOADS_SCHEDULED)
+
+    while True:
+        pipe = redis.pipeline()
+        pipe.lrange(constants.REDIS_KEY_SFTP_UPLOADS, 0, SFTP_UPLOADS_BATCH_SIZE - 1)
+        pipe.ltrim(constants.REDIS_KEY_SFTP_UPLOADS, SFTP_UPLOADS_BATCH_SIZE, -1)
+        sftp_paths, _ = pipe.execute()
+        if not sftp_paths:
+            break
+        yield [sftp_path.decode() for sftp_path in sftp_paths]
+
+
+def record_failed_sftp_uploads(sftp_paths):
+    """Count a failed attempt at processing each path, returning the ones to retry. Paths that have failed
+    SFTP_UPLOADS_MAX_ATTEMPTS times are given up on, and moved to a list of failed uploads."""
+    redis = get_redis_connection()
+    pipe = redis.pipeline()
+    for sftp_path in sftp_paths:
+        pipe.hincrby(constants.REDIS_KEY_SFTP_UPLOADS_ATTEMPTS, sftp_path, 1)
+    attempts = pipe.execute()
+
+    retry = [sftp_path for sftp_path, num in zip(sftp_paths, attempts) if num < SFTP_UPLOADS_MAX_ATTEMPTS]
+    failed = [sftp_path for sftp_path, num in zip(sftp_paths, attempts) if num >= SFTP_UPLOADS_MAX_ATTEMPTS]
+    if failed:
+        pipe.hdel(constants.REDIS_KEY_SFTP_UPLOADS_ATTEMPTS, *failed)
+        pipe.rpush(constants.REDIS_KEY_SFTP_UPLOADS_FAILED, *failed)
+        pipe.execute()
+        logger.error(
+            f"giving up on {len(failed)} sftp uploads after {SFTP_UPLOADS_MAX_ATTEMPTS} attempts (kept in redis list "
+            f"{constants.REDIS_KEY_SFTP_UPLOADS_FAILED}): {failed}"
+        )
+    return retry
+
+
+@djhuey.db_task(priority=1)
+def process_sftp_uploads():
+    for sftp_paths in drain_sftp_uploads():
         try:
-            match = SFTP_PATH_RE.search(sftp_path)
-            if match:
-                match = match.groupdict()
-
-                uploader = User.objects.get(id=match["user_id"])
-                asset_cls = SFTP_PATH_ASSET_CLASSES.get(match["asset_type"]) or AudioAsset
-                asset = asset_cls(uploader=uploader, file_basename=os.path.basename(sftp_path))
-                asset.file.save(
-                    f"uploads/{asset.file_basename}",
-                    File(open(sftp_path, "rb")),
-                    save=False,
-                )
-
-                type_name = asset_cls._meta.verbose_name
-                try:
-                    asset.clean()
-                except ValidationError as e:
-                    logger.warning(f"sftp upload skipped {type_name} by {uploader} {sftp_path}: validation error: {e}")
-                else:
-                    asset.save()
-                    logger.info(f"sftp upload of {type_name} by {uploader} successfully processed: {sftp_path}")
-
-                # Create a playlist if that's what a user wants (only for AudioAssets)
-                if isinstance(asset, AudioAsset) and uploader.sftp_playlists_by_folder:
-                    folder = match["first_folder_name"]
-                    if folder:
-                        playlist_name = " ".join(folder.strip().split())  # normalize whitespace
-                        playlist = Playlist.objects.filter(name__iexact=playlist_name).first()
-                        if playlist:
-                            logger.info(f"sftp upload by {uploader} used playlist {playlist.name}")
-                        else:
-                            logger.info(
-                                f"sftp upload by {uploader} used playlist folder, creating playlist {playlist_name}"
-                            )
-                            playlist = Playlist.objects.create(name=playlist_name)
-
-                        asset.playlists.add(playlist)
-            else:
-                logger.warning(f"sftp upload can't process, regular expression failed to match: {sftp_path}")
+            process_sftp_uploads_batch(sftp_paths)
+        except Exception:
+            # Paths are already off the queue, but files are removed once they're processed, so put back what's left
+            unprocessed = [sftp_path for sftp_path in dict.fromkeys(sftp_paths) if os.path.isfile(sftp_path)]
+            logger.exception(f"error processing batch of sftp uploads, {len(unprocessed)} unprocessed")
+            retry = record_failed_sftp_uploads(unprocessed)
+            if retry:
+                queue_sftp_uploads(retry)
+            raise
+        else:
+            get_redis_connection().hdel(constants.REDIS_KEY_SFTP_UPLOADS_ATTEMPTS, *sftp_paths)
 
-        finally:
+
+def process_sftp_uploads_batch(sftp_paths):
+    logger.info(f"processing batch of {len(sftp_paths)} sftp uploads")
+    groups = defaultdict(list)
+
+    for sftp_path in dict.fromkeys(sftp_paths):  # De-duplicate, preserving order
+        if not os.path.isfile(sftp_path) or os.path.islink(sftp_path):
+            logger.error(f"sftp update can't process, path doesn't exist / isn't a file: {sftp_path}")
+            continue
+
+        match = SFTP_PATH_RE.search(sftp_path)
+        if match:
+            match = match.groupdict()
+            asset_cls = SFTP_PATH_ASSET_CLASSES.get(match["asset_type"]) or AudioAsset
+            groups[(match["user_id"], asset_cls, match["first_folder_name"])].append(sftp_path)
+        else:
+            logger.warning(f"sftp upload can't process, regular expression failed to match: {sftp_path}")
             os.remove(sftp_path)
-    else:
-        logger.error(f"sftp update can't process, path doesn't exist / isn't a file: {sftp_path}")
+
+    uploaders = {str(user.id): user for user in User.objects.filter(id__in={key[0] for key in groups})}
+    playlists = {}
+
+    for (user_id, asset_cls, folder), group_paths in groups.items():
+        uploader = uploaders.get(user_id)
+        if uploader is None:
+            logger.warning(f"sftp upload can't process, user id {user_id} doesn't exist: {len(group_paths)} files")
+            for sftp_path in group_paths:
+                os.remove(sftp_path)
+            continue
+
+        # Create a playlist if that's what a user wants (only for AudioAssets)
+        playlist = None
+        if asset_cls is AudioAsset and uploader.sftp_playlists_by_folder and folder:
+            playlist = playlists.get(folder)
+            if playlist is None:
+                playlist, created = Playlist.get_or_create_for_folder(folder)
+                if created:
+                    logger.info(f"sftp upload by {uploader} used playlist folder, creating playlist {playlist.name}")
+                else:
+                    logger.info(f"sftp upload by {uploader} used playlist {playlist.name}")
+                playlists[folder] = playlist
+
+        type_name = asset_cls._meta.verbose_name
+        for sftp_path, asset, error in import_asset_files(
+            group_paths, asset_cls, upload_dir="uploads", uploader=uploader, playlist=playlist, delete=True
+        ):
+            if error:
+                logger.warning(f"sftp upload skipped {type_name} by {uploader} {sftp_path}: {error}")
+            else:
+                logger.info(f"sftp upload of {type_name} by {uploader} successfully processed: {sftp_path}")
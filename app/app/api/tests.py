@@ -0,0 +1,372 @@
+import asyncio
+import base64
+import datetime
+import math
+import os
+import time
+from unittest.mock import patch
+
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.core.cache import cache
+from django.db.utils import OperationalError
+from django.test import TestCase, TransactionTestCase
+from django.urls import resolve, reverse
+from django.utils import timezone
+
+from constance.test import override_config
+from django_redis import get_redis_connection
+
+from autodj.models import AudioAsset, Playlist, RotatorAsset
+from common import metrics
+from common.models import User
+from crazyarms import constants
+from gcal.models import GCalShow
+from services.liquidsoap import get_harbor_status
+
+
+def api_post(client, url_name, data):
+    return client.post(
+        reverse(url_name), data, content_type="application/json", HTTP_X_CRAZYARMS_SECRET_KEY=settings.SECRET_KEY
+    )
+
+
+class AsyncAPITests(TestCase):
+    def test_views_are_async(self):
+        for url_name in ("dj_auth", "log_events", "next_track", "sftp_auth", "fstp_upload", "validate_stream_key"):
+            self.assertTrue(asyncio.iscoroutinefunction(resolve(reverse(url_name)).func), url_name)
+
+    async def test_served_under_asgi(self):
+        response = await self.async_client.get(reverse("next_track"))
+        self.assertEqual(response.status_code, 403)
+        response = await self.async_client.get(reverse("validate_stream_key"))
+        self.assertEqual(response.status_code, 405)
+
+    @patch("api.views.set_harbor_status", side_effect=lambda status: time.sleep(0.5))
+    async def test_sync_handlers_run_concurrently(self, set_harbor_status):
+        async def post():
+            return await self.async_client.post(
+                reverse("harbor_status"),
+                {},
+                content_type="application/json",
+                **{"X-Crazyarms-Secret-Key": settings.SECRET_KEY},
+            )
+
+        start = time.monotonic()
+        responses = await asyncio.gather(post(), post())
+        self.assertEqual([response.status_code for response in responses], [200, 200])
+        self.assertEqual(set_harbor_status.call_count, 2)
+        self.assertLess(time.monotonic() - start, 0.9)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        metrics.clear_metrics()
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = metrics.Histogram("test_seconds", "Test histogram", buckets=(0.1, 1.0, math.inf))
+        try:
+            for value in (0.05, 0.5, 0.7, 5):
+                histogram.observe(value, name='with "quotes"')
+            self.assertEqual(
+                histogram.render().splitlines()[2:],
+                [
+                    r'crazyarms_test_seconds_bucket{name="with \"quotes\"",le="0.1"} 1',
+                    r'crazyarms_test_seconds_bucket{name="with \"quotes\"",le="1"} 3',
+                    r'crazyarms_test_seconds_bucket{name="with \"quotes\"",le="+Inf"} 4',
+                    r'crazyarms_test_seconds_sum{name="with \"quotes\""} 6.25',
+                    r'crazyarms_test_seconds_count{name="with \"quotes\""} 4',
+                ],
+            )
+        finally:
+            metrics.clear_metrics()
+            del metrics.REGISTRY[histogram.name]
+
+    @override_config(AUTODJ_ENABLED=True, AUTODJ_STOPSETS_ENABLED=False)
+    def test_metrics_endpoint(self):
+        self.client.get(reverse("next_track"), HTTP_X_CRAZYARMS_SECRET_KEY=settings.SECRET_KEY)
+        for headers in (
+            {},
+            {"HTTP_AUTHORIZATION": settings.SECRET_KEY},
+            {"HTTP_AUTHORIZATION": f"Basic {settings.SECRET_KEY}"},
+            {"HTTP_X_CRAZYARMS_SECRET_KEY": "wrong"},
+        ):
+            self.assertEqual(self.client.get(reverse("metrics"), **headers).status_code, 403)
+        self.assertEqual(
+            self.client.get(reverse("metrics"), HTTP_X_CRAZYARMS_SECRET_KEY=settings.SECRET_KEY).status_code, 200
+        )
+        with patch("services.playout_log.get_queue_length", return_value=2):
+            response = self.client.get(reverse("metrics"), HTTP_AUTHORIZATION=f"Bearer {settings.SECRET_KEY}")
+        self.assertEqual(response.status_code, 200)
+        lines = response.content.decode().splitlines()
+        self.assertIn('crazyarms_api_request_seconds_count{endpoint="next_track"} 1', lines)
+        self.assertIn("crazyarms_autodj_pick_seconds_count 1", lines)
+        self.assertIn('crazyarms_autodj_picks_total{tier="none"} 1', lines)
+        self.assertIn("crazyarms_playout_log_queue_length 2", lines)
+        self.assertIn('crazyarms_huey_queue_depth{state="pending"} 0', lines)
+
+
+class HarborStatusTests(TestCase):
+    def setUp(self):
+        cache.delete(constants.CACHE_KEY_HARBOR_STATUS)
+
+    @patch("services.liquidsoap.harbor.execute")
+    def test_pushed_status_served_without_telnet(self, execute):
+        status = {"current_source_id": "autodj", "skippable_sources": ["autodj"]}
+        self.assertEqual(api_post(self.client, "harbor_status", status).status_code, 200)
+        self.assertEqual(get_harbor_status(), status)
+        execute.assert_not_called()
+
+    @patch("services.liquidsoap.harbor.execute", return_value={"current_source_id": "failsafe"})
+    def test_stale_status_falls_back_to_telnet(self, execute):
+        cache.set(constants.CACHE_KEY_HARBOR_STATUS, (time.time() - 60, {"current_source_id": "autodj"}))
+        self.assertEqual(get_harbor_status(), {"current_source_id": "failsafe"})
+        self.assertEqual(get_harbor_status(), {"current_source_id": "failsafe"})
+        execute.assert_called_once_with(command="status", arg=None, safe=True, as_dict=True)
+
+
+class DJAuthTests(TransactionTestCase):
+    # Not a TestCase, since API handlers that use the database run on pool threads (as in production), whose
+    # connections wouldn't see the test's transaction
+    def setUp(self):
+        get_redis_connection().flushdb()
+        self.user = User.objects.create_user("dj", "dj@example.com", "password")
+
+    def dj_auth(self, username="dj", password="password"):
+        return api_post(self.client, "dj_auth", {"username": username, "password": password}).json()["authorized"]
+
+    @patch("api.auth.authenticate", wraps=authenticate)
+    def test_successful_credentials_cached(self, authenticate_mock):
+        self.assertTrue(self.dj_auth())
+        self.assertTrue(self.dj_auth())
+        self.assertEqual(authenticate_mock.call_count, 1)
+
+        # Changing the password invalidates the cache
+        self.user.set_password("new password")
+        self.user.save()
+        self.assertFalse(self.dj_auth())
+        self.assertTrue(self.dj_auth(password="new password"))
+
+    @patch("api.auth.authenticate", wraps=authenticate)
+    def test_failures_throttled_before_hashing(self, authenticate_mock):
+        for _ in range(10):
+            self.assertFalse(self.dj_auth(password="wrong"))
+        authenticate_mock.reset_mock()
+
+        self.assertFalse(self.dj_auth())
+        authenticate_mock.assert_not_called()
+
+    @patch("api.auth.MAX_FAILURES_WITHOUT_IP", 3)
+    @patch("api.auth.authenticate", wraps=authenticate)
+    def test_random_usernames_throttled_without_ip(self, authenticate_mock):
+        self.assertTrue(self.dj_auth())
+        for num in range(3):
+            self.assertFalse(self.dj_auth(username=f"random{num}", password="wrong"))
+        authenticate_mock.reset_mock()
+
+        self.assertFalse(self.dj_auth(username="random3", password="wrong"))
+        authenticate_mock.assert_not_called()
+        # Still let in with recently used credentials
+        self.assertTrue(self.dj_auth())
+
+    @patch("api.auth.authenticate", wraps=authenticate)
+    def test_cached_credentials_not_throttled(self, authenticate_mock):
+        self.assertTrue(self.dj_auth())
+        for _ in range(10):
+            self.assertFalse(self.dj_auth(password="wrong"))
+        authenticate_mock.reset_mock()
+
+        self.assertTrue(self.dj_auth())
+        authenticate_mock.assert_not_called()
+
+
+def make_ssh_key():
+    blob = b"\x00\x00\x00\x0bssh-ed25519\x00\x00\x00\x20" + os.urandom(32)
+    return f"ssh-ed25519 {base64.b64encode(blob).decode()}"
+
+
+class SFTPAuthTests(TransactionTestCase):
+    # Not a TestCase, since API handlers that use the database run on pool threads (as in production), whose
+    # connections wouldn't see the test's transaction
+    def setUp(self):
+        get_redis_connection().flushdb()
+        self.key = make_ssh_key()
+        self.user = User.objects.create_superuser(
+            "dj", "dj@example.com", "password", authorized_keys=f"no-pty {self.key} dj@laptop\ngarbage line"
+        )
+
+    def sftp_auth(self, username="dj", password="", key="", ip=None):
+        data = {"username": username, "password": password, "key": key, "ip": ip}
+        return api_post(self.client, "sftp_auth", data).json()
+
+    @patch("api.auth.authenticate", wraps=authenticate)
+    def test_key_auth_is_indexed_lookup_without_hashing(self, authenticate_mock):
+        (authorized_key,) = self.user.ssh_keys.all()
+        self.assertEqual((authorized_key.key_type, authorized_key.comment), ("ssh-ed25519", "dj@laptop"))
+
+        self.assertEqual(self.sftp_auth(username="DJ", key=f"{self.key} other-comment")["status"], 1)
+        self.assertEqual(self.sftp_auth(key=make_ssh_key())["status"], 0)
+        authenticate_mock.assert_not_called()
+
+        self.user.authorized_keys = ""
+        self.user.save()
+        self.assertEqual(self.sftp_auth(key=self.key)["status"], 0)
+
+    def test_password_auth(self):
+        self.assertEqual(self.sftp_auth(password="password")["status"], 1)
+        self.assertEqual(self.sftp_auth(password="wrong")["status"], 0)
+
+    def test_throttled_by_username_and_ip(self):
+        for _ in range(10):
+            self.assertEqual(self.sftp_auth(password="wrong", ip="10.0.0.1")["status"], 0)
+        self.assertEqual(self.sftp_auth(password="password", ip="10.0.0.1")["status"], 0)
+        self.assertEqual(self.sftp_auth(password="password", ip="10.0.0.2")["status"], 1)
+
+
+@override_config(GOOGLE_CALENDAR_ENABLED=True, APPEND_LIVE_ON_STATION_NAME_TO_METADATA=False)
+class HarborAuthRecordTests(TestCase):
+    def setUp(self):
+        # Don't flush redis, since it would clear overridden config
+        User.clear_all_harbor_auth_records()
+        cache.delete_pattern(f"{constants.CACHE_KEY_HARBOR_BAN_PREFIX}*")
+        self.now = timezone.now().replace(microsecond=0)
+        self.user = User.objects.create(
+            username="dj",
+            email="dj@example.com",
+            harbor_auth=User.HarborAuth.GOOGLE_CALENDAR,
+            gcal_entry_grace_minutes=5,
+            gcal_exit_grace_minutes=10,
+        )
+        self.show = GCalShow.objects.create(
+            gcal_id="show",
+            title="The Show",
+            start=self.now + datetime.timedelta(minutes=3),
+            end=self.now + datetime.timedelta(hours=1),
+        )
+        self.show.users.add(self.user)
+        self.user.update_harbor_auth_record()
+
+    def test_authorized_from_record_without_queries(self):
+        with self.assertNumQueries(0):
+            auth = self.user.currently_harbor_authorized(now=self.now)
+        self.assertEqual(auth, (True, self.show.end + datetime.timedelta(minutes=10), "The Show"))
+
+        after_exit_grace = self.now + datetime.timedelta(hours=1, minutes=11)
+        self.assertEqual(self.user.currently_harbor_authorized(now=after_exit_grace), (False, None, "dj's show"))
+
+    def test_ban_and_config_change_update_record(self):
+        cache.set(f"{constants.CACHE_KEY_HARBOR_BAN_PREFIX}{self.user.id}", True, timeout=60)
+        self.user.update_harbor_auth_record()
+        self.assertFalse(self.user.currently_harbor_authorized(now=self.now).authorized)
+        self.assertTrue(self.user.currently_harbor_authorized(now=self.now + datetime.timedelta(minutes=2)).authorized)
+
+        with override_config(GOOGLE_CALENDAR_ENABLED=False):
+            auth = self.user.currently_harbor_authorized(now=self.now + datetime.timedelta(days=1))
+        self.assertEqual(auth, (True, None, "dj's show"))
+
+
+class SFTPUploadTests(TestCase):
+    def setUp(self):
+        get_redis_connection().flushdb()
+        self.user = User.objects.create(username="dj", email="dj@example.com")
+
+    def sftp_path(self, path):
+        return f"{settings.SFTP_UPLOADS_ROOT}{self.user.id}/{path}"
+
+    def post(self, **data):
+        return api_post(self.client, "fstp_upload", data)
+
+    @patch("api.tasks.process_sftp_uploads.schedule")
+    def test_uploads_are_buffered_and_debounced(self, schedule):
+        self.assertEqual(self.post(path=self.sftp_path("a.mp3")).status_code, 200)
+        self.assertEqual(self.post(paths=[self.sftp_path("b.mp3"), self.sftp_path("c.mp3")]).status_code, 200)
+
+        schedule.assert_called_once()
+        self.assertEqual(get_redis_connection().llen(constants.REDIS_KEY_SFTP_UPLOADS), 3)
+
+    @patch("api.tasks.os.path.islink", return_value=False)
+    @patch("api.tasks.os.path.isfile", return_value=True)
+    @patch("api.tasks.import_asset_files", return_value=[])
+    @patch("api.tasks.process_sftp_uploads.schedule")
+    def test_batch_groups_by_user_type_and_folder(self, schedule, import_asset_files, isfile, islink):
+        paths = [
+            self.sftp_path("audio-assets/My  Folder/1.mp3"),
+            self.sftp_path("audio-assets/my folder/2.mp3"),
+            self.sftp_path("audio-assets/My  Folder/3.mp3"),
+            self.sftp_path("rotator-assets/4.mp3"),
+        ]
+        self.post(paths=paths)
+
+        from .tasks import process_sftp_uploads
+
+        process_sftp_uploads.call_local()
+
+        playlist = Playlist.objects.get()
+        self.assertEqual(playlist.name, "My Folder")
+        calls = [(call.args[0], call.args[1], call.kwargs["playlist"]) for call in import_asset_files.call_args_list]
+        self.assertEqual(
+            calls,
+            [
+                ([paths[0], paths[2]], AudioAsset, playlist),
+                ([paths[1]], AudioAsset, playlist),
+                ([paths[3]], RotatorAsset, None),
+            ],
+        )
+        self.assertEqual(get_redis_connection().llen(constants.REDIS_KEY_SFTP_UPLOADS), 0)
+
+    @patch("api.tasks.os.path.islink", return_value=False)
+    @patch("api.tasks.os.path.isfile", return_value=True)
+    @patch("api.tasks.import_asset_files", side_effect=OperationalError("database is down"))
+    @patch("api.tasks.process_sftp_uploads.schedule")
+    def test_unprocessed_uploads_requeued_on_error(self, schedule, import_asset_files, isfile, islink):
+        paths = [self.sftp_path("1.mp3"), self.sftp_path("2.mp3")]
+        self.post(paths=paths)
+
+        from .tasks import SFTP_UPLOADS_MAX_ATTEMPTS, process_sftp_uploads
+
+        redis = get_redis_connection()
+        for attempt in range(1, SFTP_UPLOADS_MAX_ATTEMPTS + 1):
+            with self.assertRaises(OperationalError), self.assertLogs("crazyarms.api.tasks", "ERROR"):
+                process_sftp_uploads.call_local()
+            queued = [path.decode() for path in redis.lrange(constants.REDIS_KEY_SFTP_UPLOADS, 0, -1)]
+            if attempt < SFTP_UPLOADS_MAX_ATTEMPTS:
+                self.assertEqual(queued, paths)
+
+        # Given up on, rather than retried forever
+        self.assertEqual(queued, [])
+        self.assertEqual(
+            [path.decode() for path in redis.lrange(constants.REDIS_KEY_SFTP_UPLOADS_FAILED, 0, -1)], paths
+        )
+        self.assertFalse(redis.exists(constants.REDIS_KEY_SFTP_UPLOADS_ATTEMPTS))
+        self.assertEqual(schedule.call_count, SFTP_UPLOADS_MAX_ATTEMPTS)
+
+    @patch("api.tasks.os.path.islink", return_value=False)
+    @patch("api.tasks.os.path.isfile", return_value=True)
+    @patch("api.tasks.import_asset_files", side_effect=[OperationalError("database is down"), []])
+    @patch("api.tasks.process_sftp_uploads.schedule")
+    def test_attempts_cleared_on_success(self, schedule, import_asset_files, isfile, islink):
+        self.post(path=self.sftp_path("1.mp3"))
+
+        from .tasks import process_sftp_uploads
+
+        with self.assertRaises(OperationalError), self.assertLogs("crazyarms.api.tasks", "ERROR"):
+            process_sftp_uploads.call_local()
+        redis = get_redis_connection()
+        self.assertEqual(redis.hget(constants.REDIS_KEY_SFTP_UPLOADS_ATTEMPTS, self.sftp_path("1.mp3")), b"1")
+        process_sftp_uploads.call_local()
+        self.assertFalse(redis.exists(constants.REDIS_KEY_SFTP_UPLOADS_ATTEMPTS))
+
+
+class LogEventsTests(TestCase):
+    @patch("api.views.queue_log_entries")
+    def test_batch_queued_as_one_message(self, queue_log_entries):
+        events = [{"description": f"event {num}", "event_type": "general"} for num in range(3)]
+        response = api_post(self.client, "log_events", events)
+        self.assertEqual(response.json(), {"queued": 3})
+        queue_log_entries.assert_called_once_with(events)
+
+    @patch("api.views.queue_log_entries")
+    def test_invalid_batch(self, queue_log_entries):
+        self.assertEqual(api_post(self.client, "log_events", {"description": "not a list"}).status_code, 400)
+        self.assertEqual(api_post(self.client, "log_events", ["not an object"]).status_code, 400)
+        queue_log_entries.assert_not_called()
@@ -9,6 +9,8 @@ urlpatterns = [
         views.ValidateStreamKeyView.as_view(),
         name="validate_stream_key",
     ),
+    path("harbor-status/", views.HarborStatusAPIView.as_view(), name="harbor_status"),
+    path("log-events/", views.LogEventsAPIView.as_view(), name="log_events"),
     path("next-track/", views.NextTrackAPIView.as_view(), name="next_track"),
     path("sftp-auth/", views.SFTPAuthView.as_view(), name="sftp_auth"),
     path("sftp-upload/", views.SFTPUploadView.as_view(), name="fstp_upload"),
@@ -1,9 +1,15 @@
+import asyncio
+from functools import update_wrapper
 import json
 import logging
+import time
+
+from asgiref.sync import sync_to_async
 
 from django.conf import settings
-from django.contrib.auth import authenticate
+from django.db import close_old_connections
 from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, JsonResponse
+from django.utils.crypto import constant_time_compare
 from django.utils.decorators import method_decorator
 from django.views import View
 from django.views.decorators.csrf import csrf_exempt
@@ -11,16 +17,78 @@ from django.views.decorators.csrf import csrf_exempt
 from constance import config
 
 from autodj.models import AudioAsset, RotatorAsset
-from common.models import User
+from common import metrics
+from common.models import AuthorizedKey, User
+from services.liquidsoap import set_harbor_status
+from services.playout_log import queue_log_entries
 
-from .tasks import SFTP_PATH_ASSET_CLASSES, process_sftp_upload
+from .auth import authenticate_and_cache, clear_failures, get_cached_user, is_throttled, record_failure
+from .tasks import SFTP_PATH_ASSET_CLASSES, queue_sftp_uploads
 
 logger = logging.getLogger(f"crazyarms.{__name__}")
 
 
+class AsyncView(View):
+    """Class based view that runs asynchronously when served by ASGI. Synchronous handlers (anything touching the ORM)
+    are run with sync_to_async() in a thread pool, so they run concurrently."""
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+
+        # Django 3.2 only detects async function based views, so wrap with one (that records latency)
+        async def async_view(request, *args, **kwargs):
+            endpoint = request.resolver_match.url_name if request.resolver_match else cls.__name__
+            start = time.monotonic()
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                # Writing to Redis blocks, so keep it off the event loop
+                await sync_to_async(metrics.api_request_seconds.observe, thread_sensitive=False)(
+                    time.monotonic() - start, endpoint=endpoint
+                )
+
+        return update_wrapper(async_view, view)
+
+    async def dispatch(self, request, *args, **kwargs):
+        method = request.method.lower()
+        handler = getattr(self, method, None) if method in self.http_method_names else None
+        if handler is None:
+            return self.http_method_not_allowed(request, *args, **kwargs)
+        elif asyncio.iscoroutinefunction(handler):
+            return await handler(request, *args, **kwargs)
+        else:
+            return await sync_to_async(self.run_sync_handler, thread_sensitive=settings.API_THREAD_SENSITIVE)(
+                handler, request, *args, **kwargs
+            )
+
+    @staticmethod
+    def run_sync_handler(handler, *args, **kwargs):
+        try:
+            return handler(*args, **kwargs)
+        finally:
+            # Pool threads each have their own database connection, and outside of a request/response cycle nothing
+            # else closes them
+            if not settings.API_THREAD_SENSITIVE:
+                close_old_connections()
+
+
+class MetricsView(View):
+    # Not exposed publicly by nginx, for Prometheus to scrape from within the docker network. Prometheus can't set
+    # arbitrary headers, so the secret key can also be sent as bearer credentials.
+    def get(self, request):
+        secret_keys = [request.headers.get("X-Crazyarms-Secret-Key", "")]
+        scheme, _, credentials = request.headers.get("Authorization", "").partition(" ")
+        if scheme.lower() == "bearer":
+            secret_keys.append(credentials)
+        if not any(constant_time_compare(secret_key, settings.SECRET_KEY) for secret_key in secret_keys):
+            return HttpResponseForbidden()
+        return HttpResponse(metrics.render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 @method_decorator(csrf_exempt, name="dispatch")
-class APIView(View):
-    def dispatch(self, request):
+class APIView(AsyncView):
+    async def dispatch(self, request):
         self.request_json = {}
 
         if request.headers.get("X-Crazyarms-Secret-Key") != settings.SECRET_KEY:
@@ -32,7 +100,7 @@ class APIView(View):
             except json.JSONDecodeError:
                 return HttpResponseBadRequest()
 
-        response = super().dispatch(request)
+        response = await super().dispatch(request)
 
         if isinstance(response, HttpResponse):
             return response
@@ -48,15 +116,16 @@ class DJAuthAPIView(APIView):
     def post(self, request):
         response = {"authorized": False}
         user = non_logged_in_user = None
+        username, ip = self.request_json["username"], self.request_json.get("ip")
 
-        if self.request_json["username"] == "!":
+        if username == "!":
             try:
                 user = User.objects.get(stream_key=self.request_json["password"].strip())
             except User.DoesNotExist:
                 logger.info("dj auth requested by stream key: denied")
         else:
             username_password_tries = [
-                (self.request_json["username"], self.request_json["password"]),
+                (username, self.request_json["password"]),
             ]
 
             # Allow username to be anything and password to be username:password or username-password
@@ -65,16 +134,27 @@ class DJAuthAPIView(APIView):
                 if len(pw_split) == 2:
                     username_password_tries.append(pw_split)
 
-            for username, password in username_password_tries:
-                user = authenticate(username=username, password=password)
-                if user:
-                    break
-                else:
-                    try:
-                        case_insensitive_username_field = "{}__iexact".format(User.USERNAME_FIELD)
-                        non_logged_in_user = User.objects.get(**{case_insensitive_username_field: username})
-                    except User.DoesNotExist:
-                        pass
+            user = next(filter(None, (get_cached_user(*try_) for try_ in username_password_tries)), None)
+            if not user:
+                # Only throttle hashing passwords, not credentials that are known to be good
+                if is_throttled(username, ip):
+                    logger.info(f"dj auth requested by {username}: denied (too many failed attempts)")
+                    return response
+
+                for try_username, password in username_password_tries:
+                    user = authenticate_and_cache(username=try_username, password=password)
+                    if user:
+                        clear_failures(username, ip)
+                        break
+                    else:
+                        try:
+                            case_insensitive_username_field = "{}__iexact".format(User.USERNAME_FIELD)
+                            non_logged_in_user = User.objects.get(**{case_insensitive_username_field: try_username})
+                        except User.DoesNotExist:
+                            pass
+
+                if not user:
+                    record_failure(username, ip)
 
         if user:
             # Log messages handled by currently_harbor_authorized()
@@ -103,7 +183,7 @@ class DJAuthAPIView(APIView):
 
 
 @method_decorator(csrf_exempt, name="dispatch")
-class ValidateStreamKeyView(View):
+class ValidateStreamKeyView(AsyncView):
     def post(self, request, *args, **kwargs):
         # nginx-rtmp expects a 2xx code to allow and a 4xx to deny
         stream_key = self.request.POST.get("name")
@@ -144,28 +224,50 @@ class SFTPAuthView(APIView):
             self.request_json["password"],
             self.request_json["key"],
         )
-        non_logged_in_user = None
-        user = authenticate(username=username, password=password)
+        user = non_logged_in_user = None
+        ip = self.request_json.get("ip")
+
+        if key:
+            parsed_key = AuthorizedKey.parse(key)
+            if parsed_key:
+                case_insensitive_username_field = "user__{}__iexact".format(User.USERNAME_FIELD)
+                authorized_key = (
+                    AuthorizedKey.objects.filter(
+                        fingerprint=parsed_key["fingerprint"],
+                        user__is_active=True,
+                        **{case_insensitive_username_field: username},
+                    )
+                    .select_related("user")
+                    .first()
+                )
+                if authorized_key:
+                    user = authorized_key.user
+                    auth_type = "ssh key"
+
+            if not user:
+                logger.info(f"sftp auth requested by {username}: denied (ssh key not authorized)")
+                return {"status": 0}
 
-        if user:
-            auth_type = "password"
         else:
-            try:
-                case_insensitive_username_field = "{}__iexact".format(User.USERNAME_FIELD)
-                non_logged_in_user = User.objects.get(**{case_insensitive_username_field: username})
-            except User.DoesNotExist:
-                pass
-            else:
-                if non_logged_in_user.is_active:
-                    key_split = key.strip().split()
+            user = get_cached_user(username, password)
+            if not user:
+                # Only throttle hashing passwords, not credentials that are known to be good
+                if is_throttled(username, ip):
+                    logger.info(f"sftp auth requested by {username}: denied (too many failed attempts)")
+                    return {"status": 0}
+
+                user = authenticate_and_cache(username=username, password=password)
+                if user:
+                    clear_failures(username, ip)
 
-                    for authorized_key in non_logged_in_user.authorized_keys.strip().splitlines():
-                        authorized_key_split = authorized_key.strip().split()
-                        split_len = min(len(key_split), len(authorized_key_split))
-                        if split_len >= 2 and key_split[:split_len] == authorized_key_split[:split_len]:
-                            user = non_logged_in_user
-                            auth_type = "ssh key"
-                            break
+            if user:
+                auth_type = "password"
+            else:
+                try:
+                    case_insensitive_username_field = "{}__iexact".format(User.USERNAME_FIELD)
+                    non_logged_in_user = User.objects.get(**{case_insensitive_username_field: username})
+                except User.DoesNotExist:
+                    pass
 
         if user:
             allowed = user.get_sftp_allowable_models()
@@ -191,8 +293,10 @@ class SFTPAuthView(APIView):
             else:
                 logger.info(f"sftp auth requested by {user}: denied ({auth_type} allowed but no permissions)")
         elif non_logged_in_user:
+            record_failure(username, ip)
             logger.info(f"sftp auth requested by {non_logged_in_user}: denied (invalid credentials / inactive account)")
         else:
+            record_failure(username, ip)
             logger.info(f"sftp auth requested by {username}: denied (user does not exist)")
 
         return {"status": 0}
@@ -200,21 +304,45 @@ class SFTPAuthView(APIView):
 
 class SFTPUploadView(APIView):
     def post(self, request):
-        process_sftp_upload(self.request_json["path"])
+        paths = self.request_json.get("paths") or [self.request_json["path"]]
+        queue_sftp_uploads(paths)
+        return 200
+
+
+class HarborStatusAPIView(APIView):
+    def post(self, request):
+        # Pushed by the harbor on every status change, and periodically
+        set_harbor_status(self.request_json)
         return 200
 
 
+class LogEventsAPIView(APIView):
+    def post(self, request):
+        # Batches of playout log events buffered by Liquidsoap, queued for run_log_subscriber as one stream message
+        events = self.request_json
+        if not isinstance(events, list) or not all(isinstance(event, dict) for event in events):
+            return HttpResponseBadRequest()
+
+        if events:
+            queue_log_entries(events)
+        return {"queued": len(events)}
+
+
 class NextTrackAPIView(APIView):
     def get(self, request):
         asset = None
 
         if config.AUTODJ_ENABLED:
-            if config.AUTODJ_STOPSETS_ENABLED:
-                # Will return None if we're not currently playing through a stopset
-                asset = RotatorAsset.get_next_for_autodj()
+            with metrics.autodj_pick_seconds.time():
+                if config.AUTODJ_STOPSETS_ENABLED:
+                    # Will return None if we're not currently playing through a stopset
+                    asset = RotatorAsset.get_next_for_autodj()
+
+                if not asset:
+                    asset = AudioAsset.get_next_for_autodj()
 
             if not asset:
-                asset = AudioAsset.get_next_for_autodj()
+                metrics.autodj_picks.inc(tier="none")
 
         if asset:
             return {"has_asset": True, "asset_uri": asset.liquidsoap_uri()}
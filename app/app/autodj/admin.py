@@ -1,4 +1,6 @@
 from django.contrib import admin, messages
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.utils.html import format_html_join
 from django.utils.safestring import mark_safe
 
@@ -6,6 +8,7 @@ from constance import config
 
 from broadcast.models import BroadcastAsset
 from common.admin import AudioAssetAdminBase, DiskUsageChangelistAdminMixin, asset_conversion_action
+from services.models import AssetPlayCount
 
 from .forms import AudioAssetCreateForm, PlaylistActionForm, RotatorActionForm, RotatorAssetCreateForm
 from .models import AudioAsset, Playlist, Rotator, RotatorAsset, Stopset, StopsetRotator
@@ -98,7 +101,15 @@ class AudioAssetAdmin(AudioAssetAdminBase, AutoDJModelAdmin):
     playlist_action_form = PlaylistActionForm
     create_form = AudioAssetCreateForm
     # title gets swapped to include artist and album
-    list_display = ("title", "created", "playlists_list_display", "duration", "file_size", "status")
+    list_display = (
+        "title",
+        "created",
+        "playlists_list_display",
+        "duration",
+        "plays_list_display",
+        "file_size",
+        "status",
+    )
     list_filter = ("playlists",) + AudioAssetAdminBase.list_filter
 
     convert_to_rotator_assets = asset_conversion_action(AudioAsset, RotatorAsset)
@@ -150,6 +161,23 @@ class AudioAssetAdmin(AudioAssetAdminBase, AutoDJModelAdmin):
 
     playlists_list_display.short_description = "Playlist(s)"
 
+    def get_queryset(self, request):
+        # From the play count rollups, so it doesn't touch the playout log
+        plays = (
+            AssetPlayCount.objects.filter(asset_type=AssetPlayCount.AssetType.AUDIO, asset_id=OuterRef("id"))
+            .order_by()
+            .values("asset_id")
+            .annotate(total=Sum("plays"))
+            .values("total")
+        )
+        return super().get_queryset(request).annotate(plays=Coalesce(Subquery(plays), 0))
+
+    def plays_list_display(self, obj):
+        return obj.plays
+
+    plays_list_display.short_description = "Plays"
+    plays_list_display.admin_order_field = "plays"
+
     @staticmethod
     def add_playlist(modeladmin, request, queryset):
         playlist_id = request.POST.get("playlist")
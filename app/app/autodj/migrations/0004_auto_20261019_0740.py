@@ -0,0 +1,23 @@
+# Generated by Django 3.2rc1 on 2026-10-19 14:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('autodj', '0003_auto_20261019_0737'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='audioasset',
+            name='probe',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='rotatorasset',
+            name='probe',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -12,6 +12,7 @@ from django.utils import timezone
 
 from constance import config
 
+from common import metrics
 from common.models import AudioAssetBase, TruncatingCharField
 from crazyarms import constants
 
@@ -172,6 +173,7 @@ class AudioAsset(AudioAssetBase):
                 logger.warnining(f"request with audio asset id = {request_id} doesn't exist")
             else:
                 logger.info(f"selected {audio_asset} from autodj request queue")
+                metrics.autodj_picks.inc(tier="request")
                 return cls.process_anti_repeat_autodj(audio_asset)
 
         if not config.AUTODJ_ANTI_REPEAT_ENABLED:
@@ -233,6 +235,16 @@ class AudioAsset(AudioAssetBase):
                 f"selected {audio_asset} "
                 f"({f'selected from playlist {playlist}' if playlist else 'did not use a playlist'})"
             )
+            # Fallback tier is named after the most restrictive filter still applied
+            if run_with_playlist:
+                tier = "playlist"
+            elif run_no_repeat_artists:
+                tier = "no_repeat_artists"
+            elif run_no_repeat_track_ids:
+                tier = "no_repeat_tracks"
+            else:
+                tier = "repeats_allowed"
+            metrics.autodj_picks.inc(tier=tier)
             return cls.process_anti_repeat_autodj(audio_asset)
 
         # We couldn't find a track, so we need to un-apply our filters
@@ -310,6 +322,14 @@ class Playlist(PlaylistStopsetBase):
         blank=True,
     )
 
+    @classmethod
+    def get_or_create_for_folder(cls, folder_name):
+        name = " ".join(folder_name.strip().split())  # normalize whitespace
+        playlist = cls.objects.filter(name__iexact=name).first()
+        if playlist:
+            return playlist, False
+        return cls.objects.create(name=name), True
+
 
 class RotatorAsset(AudioAssetBase):
     UNNAMED_TRACK = "Untitled Asset"
@@ -336,7 +356,8 @@ class RotatorAsset(AudioAssetBase):
 
             if should_generate:
                 logger.info(f"{config.AUTODJ_STOPSETS_ONCE_PER_MINUTES} minutes since last stopset. Generating one.")
-                current = Stopset.generate_random_rotator_asset_block()
+                with metrics.autodj_stopset_generation_seconds.time():
+                    current = Stopset.generate_random_rotator_asset_block()
 
         if current:
             stopset, rotator_and_asset_list = current
@@ -348,6 +369,7 @@ class RotatorAsset(AudioAssetBase):
                         f"Picked asset {asset} from rotator {rotator} in stopset {stopset}. "
                         f"{len(rotator_and_asset_list)} left to generate."
                     )
+                    metrics.autodj_picks.inc(tier="stopset")
                     break
 
                 else:
@@ -1,4 +1,8 @@
-from unittest.mock import patch
+import datetime
+import os
+import tempfile
+from unittest.mock import PropertyMock, patch
+import uuid
 
 from django.core.cache import cache
 from django.test import TestCase
@@ -6,9 +10,11 @@ from django.test import TestCase
 from constance.test import override_config
 from django_redis import get_redis_connection
 
+from common.models import Metadata, User
+from common.tasks import get_asset_conversion_progress, queue_asset_conversion
 from crazyarms import constants
 
-from .models import AudioAsset
+from .models import AudioAsset, RotatorAsset
 
 
 @patch("autodj.models.random.sample", lambda l, n: list(l)[:n])  # Deterministic
@@ -164,3 +170,71 @@ class AntiRepeatTests(TestCase):
                 "INFO:crazyarms.autodj.models:autodj: selected A:0 - T:0",
             ],
         )
+
+
+class AssetConversionTests(TestCase):
+    @patch("common.models.subprocess.run", side_effect=AssertionError("assets should not be re-probed"))
+    def test_conversion_shares_file_and_metadata(self, subprocess_run):
+        user = User.objects.create(username="dj", email="dj@example.com")
+        fingerprint = uuid.uuid4()
+        asset = AudioAsset(
+            file="content/ab/cd/abcd.mp3",
+            file_basename="track.mp3",
+            artist="Artist",
+            album="Album",
+            title="Title",
+            fingerprint=fingerprint,
+            duration=datetime.timedelta(seconds=90),
+            status=AudioAsset.Status.READY,
+        )
+        asset.save()
+
+        queue_asset_conversion(AudioAsset, RotatorAsset, [asset.id], user)
+
+        self.assertFalse(AudioAsset.objects.exists())
+        rotator_asset = RotatorAsset.objects.get()
+        self.assertEqual(rotator_asset.file.name, "content/ab/cd/abcd.mp3")
+        self.assertEqual(rotator_asset.title, "Artist - Album - Title")
+        self.assertEqual(rotator_asset.fingerprint, fingerprint)
+        self.assertEqual(rotator_asset.duration, datetime.timedelta(seconds=90))
+        self.assertEqual(rotator_asset.status, RotatorAsset.Status.READY)
+        self.assertEqual(rotator_asset.uploader, user)
+
+        (progress,) = get_asset_conversion_progress(user)
+        self.assertEqual((progress["total"], progress["converted"], progress["finished"]), (1, 1, True))
+        self.assertEqual(get_asset_conversion_progress(user), [])
+
+
+class StoredProbeTests(TestCase):
+    def test_probe_only_rerun_when_file_changes(self):
+        metadata = Metadata("mp3", datetime.timedelta(seconds=10), "Artist", "Album", "Title")
+        with tempfile.NamedTemporaryFile(suffix=".mp3") as file, patch(
+            "common.models.AudioAssetBase.local_filename", new_callable=PropertyMock, return_value=file.name
+        ), patch("common.models.AudioAssetBase.run_metadata", return_value=metadata) as run_metadata:
+            file.write(b"audio")
+            file.flush()
+
+            asset = AudioAsset()
+            self.assertEqual(asset.metadata, metadata)
+            self.assertEqual(AudioAsset(probe=asset.probe).metadata, metadata)
+            self.assertEqual(run_metadata.call_count, 1)
+
+            file.write(b"more audio")
+            file.flush()
+            os.utime(file.name, ns=(0, 0))
+            self.assertEqual(AudioAsset(probe=asset.probe).metadata, metadata)
+            self.assertEqual(run_metadata.call_count, 2)
+
+    def test_probe_rerun_when_file_name_changes(self):
+        metadata = Metadata("mp3", datetime.timedelta(seconds=10), "Artist", "Album", "Title")
+        with tempfile.NamedTemporaryFile(suffix=".mp3") as file, patch(
+            "common.models.AudioAssetBase.local_filename", new_callable=PropertyMock, return_value=file.name
+        ), patch("common.models.AudioAssetBase.run_metadata", return_value=metadata) as run_metadata:
+            asset = AudioAsset(file="content/ab/cd/abcd.mp3")
+            self.assertEqual(asset.metadata, metadata)
+            self.assertEqual(AudioAsset(file="content/ab/cd/abcd.mp3", probe=asset.probe).metadata, metadata)
+            self.assertEqual(run_metadata.call_count, 1)
+
+            # Same size and mtime, but different contents
+            self.assertEqual(AudioAsset(file="content/ef/01/ef01.mp3", probe=asset.probe).metadata, metadata)
+            self.assertEqual(run_metadata.call_count, 2)
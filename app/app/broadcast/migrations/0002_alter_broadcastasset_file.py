@@ -0,0 +1,20 @@
+# Generated by Django 3.2rc1 on 2026-10-19 14:37
+
+import common.models
+import common.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('broadcast', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='broadcastasset',
+            name='file',
+            field=models.FileField(blank=True, db_index=True, help_text='You can provide either an uploaded audio file or a URL to an external asset.', max_length=512, storage=common.storage.ContentAddressedStorage(), upload_to=common.models.audio_asset_file_upload_to, verbose_name='audio file'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2rc1 on 2026-10-19 14:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('broadcast', '0002_alter_broadcastasset_file'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='broadcastasset',
+            name='probe',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
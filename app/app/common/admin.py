@@ -9,7 +9,6 @@ from django.contrib.auth import admin as auth_admin
 from django.contrib.auth.models import Group
 from django.core import signing
 from django.core.cache import cache
-from django.core.exceptions import ValidationError
 from django.template.defaultfilters import filesizeformat
 from django.urls import reverse
 from django.utils.html import format_html
@@ -23,6 +22,7 @@ from crazyarms import constants
 
 from .forms import EmailUserChangeForm, EmailUserCreationForm, ProcessConfigChangesConstanceForm
 from .models import User, filter_inactive_group_queryset
+from .tasks import get_asset_conversion_progress, queue_asset_conversion
 
 
 def swap_title_fields(method):
@@ -45,42 +45,12 @@ def asset_conversion_action(from_cls, to_cls):
     to_name = to_cls._meta.verbose_name_plural
 
     def quick_action(modeladmin, request, queryset):
-        num_converted = 0
-
-        for obj in queryset:
-            if obj.status == obj.Status.READY:
-                new_asset = to_cls(
-                    title=obj.get_full_title(include_duration=False),
-                    file_basename=obj.file_basename,
-                    uploader=request.user,
-                    fingerprint=obj.fingerprint,
-                )
-                new_asset.file.save(os.path.basename(obj.file.name), obj.file, save=False)
-
-                try:
-                    new_asset.clean()
-                except ValidationError as e:
-                    new_asset.file.delete()
-                    modeladmin.message_user(
-                        request,
-                        f'An error occurred while converting {obj}: {", ".join(e.messages)}',
-                        level=messages.ERROR,
-                    )
-
-                else:
-                    num_converted += 1
-                    new_asset.save()
-                    obj.delete()
-
-            else:
-                modeladmin.message_user(
-                    request,
-                    f"{obj} could not be converted since its status was {obj.get_status_display()}.",
-                    level=messages.WARNING,
-                )
-
-        if num_converted:
-            modeladmin.message_user(request, f"{num_converted} {from_name} were successfully converted to {to_name}.")
+        ids = list(queryset.values_list("id", flat=True))
+        queue_asset_conversion(from_cls, to_cls, ids, request.user)
+        modeladmin.message_user(
+            request,
+            f"Converting {len(ids)} {from_name} to {to_name} in the background. Refresh this page to see its progress.",
+        )
 
     quick_action.short_description = f"Convert selected {from_name} to {to_name}"
     return quick_action
@@ -128,6 +98,21 @@ class AudioAssetAdminBase(admin.ModelAdmin):
     class Media:
         js = ("common/admin/js/asset_source.js",)
 
+    def changelist_view(self, request, extra_context=None):
+        for progress in get_asset_conversion_progress(request.user):
+            summary = f"{progress['converted']} of {progress['total']} {progress['from_name']} to {progress['to_name']}"
+            if progress["finished"]:
+                for error in progress["errors"]:
+                    self.message_user(request, error, level=messages.WARNING)
+                self.message_user(request, f"Finished converting {summary}.", level=messages.SUCCESS)
+            else:
+                self.message_user(
+                    request,
+                    f"Converting {summary} ({progress['processed']} processed, {len(progress['errors'])} errors).",
+                    level=messages.INFO,
+                )
+        return super().changelist_view(request, extra_context=extra_context)
+
     def has_change_permission(self, request, obj=None):
         return not (obj and obj.status != obj.Status.READY) and super().has_change_permission(request, obj=obj)
 
@@ -59,6 +59,16 @@ def create_groups(sender, **kwargs):
     Group.objects.exclude(id__in=[g.id for g in groups_created]).delete()
 
 
+HARBOR_AUTH_CONFIG_KEYS = ("APPEND_LIVE_ON_STATION_NAME_TO_METADATA", "GOOGLE_CALENDAR_ENABLED", "STATION_NAME")
+
+
+def clear_harbor_auth_records_on_config_change(sender, key, **kwargs):
+    from .models import User
+
+    if key in HARBOR_AUTH_CONFIG_KEYS:
+        User.clear_all_harbor_auth_records()
+
+
 class CommonConfig(AppConfig):
     name = "common"
     verbose_name = "Authentication and Authorization"
@@ -66,9 +76,11 @@ class CommonConfig(AppConfig):
     def ready(self):
         from constance.admin import Config
         from constance.apps import ConstanceConfig
+        from constance.signals import config_updated
 
         ConstanceConfig.verbose_name = "Station Settings"
         Config._meta.verbose_name = "Configuration"
         Config._meta.verbose_name_plural = "Configuration"
 
         post_migrate.connect(create_groups, sender=self)
+        config_updated.connect(clear_harbor_auth_records_on_config_change)
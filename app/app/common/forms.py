@@ -80,14 +80,18 @@ class ProcessConfigChangesConstanceForm(ConstanceForm):
             logger.info("Got ICECAST_* config change. Restarting icecast.")
             init_services(services="icecast")
         if any(change.startswith("HARBOR_") for change in changes) or "AUTODJ_ENABLED" in changes:
-            logger.info("Got HARBOR_* or AUTODJ_ENABLED config change. Restarting harbor.")
-            init_services(services="harbor", subservices="harbor")
-        if "ICECAST_SOURCE_PASSWORD" in changes:
-            logger.info("Got ICECAST_SOURCE_PASSWORD config change. Setting local-icecast upstream password.")
-            init_services(services="upstream", subservices="local-icecast")
-        if any(change.startswith("UPSTREAM_") for change in changes):
-            logger.info("Got UPSTREAM_* config change. Restarting upstreams.")
-            init_services(services="upstream", restart_services=True)
+            logger.info("Got HARBOR_* or AUTODJ_ENABLED config change. Restarting harbor if its config changed.")
+            init_services(services="harbor")
+        if (
+            "ICECAST_SOURCE_PASSWORD" in changes
+            or "HARBOR_TRANSPORT" in changes
+            or any(change.startswith("UPSTREAM_") for change in changes)
+        ):
+            logger.info(
+                "Got ICECAST_SOURCE_PASSWORD, HARBOR_TRANSPORT or UPSTREAM_* config change. Restarting changed"
+                " upstreams."
+            )
+            init_services(services="upstream")
 
 
 class EmailUserCreationForm(UserCreationForm):
@@ -0,0 +1,66 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+
+from django.core.management.base import BaseCommand
+
+from common.storage import content_addressed_storage
+
+logger = logging.getLogger(f"crazyarms.{__name__}")
+
+
+class Command(BaseCommand):
+    help = "Store probed audio metadata (and fingerprints) for assets missing it or whose files have changed"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-w",
+            "--workers",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Number of ffprobe/exiftool/ffmpeg processes to run at once (default: number of CPUs)",
+        )
+        parser.add_argument("-b", "--batch-size", type=int, default=100, help="Assets saved per query (default: 100)")
+        parser.add_argument(
+            "--skip-fingerprints",
+            action="store_true",
+            help="Don't compute audio fingerprints, which requires decoding each file in full",
+        )
+        parser.add_argument(
+            "-f", "--force", action="store_true", help="Re-probe assets even if their files haven't changed"
+        )
+
+    def probe_asset(self, asset):
+        original_probe = {} if self.force else dict(asset.probe)
+        if self.force:
+            asset.probe = {}
+        # Assets whose stored stamp still matches their file are returned without running anything
+        asset.metadata
+        if not self.skip_fingerprints:
+            asset.computed_fingerprint
+        return asset if asset.probe != original_probe else None
+
+    def handle(self, *args, **options):
+        self.force, self.skip_fingerprints = options["force"], options["skip_fingerprints"]
+        batch_size = options["batch_size"]
+
+        for model_cls in content_addressed_storage.get_asset_models():
+            name = model_cls._meta.verbose_name_plural
+            ids = list(
+                model_cls.objects.filter(status=model_cls.Status.READY)
+                .exclude(file="")
+                .order_by("id")
+                .values_list("id", flat=True)
+            )
+            print(f"Checking {len(ids)} {name}...")
+
+            num_updated = 0
+            with ThreadPoolExecutor(max_workers=options["workers"]) as executor:
+                for i in range(0, len(ids), batch_size):
+                    assets = model_cls.objects.filter(id__in=ids[i : i + batch_size])
+                    updated = list(filter(None, executor.map(self.probe_asset, assets)))
+                    if updated:
+                        num_updated += model_cls.objects.bulk_update(updated, ["probe"])
+                    logger.info(f"checked {min(i + batch_size, len(ids))}/{len(ids)} {name}")
+
+            print(f"Updated stored metadata for {num_updated} of {len(ids)} {name}.")
@@ -2,16 +2,17 @@ import logging
 import os
 
 from django.conf import settings
-from django.core.exceptions import ValidationError
-from django.core.files import File
 from django.core.management.base import BaseCommand
 
 from autodj.models import AudioAsset, Playlist, RotatorAsset
 from broadcast.models import BroadcastAsset
 from common.models import User
+from common.tasks import import_asset_files
 
 logger = logging.getLogger(f"crazyarms.{__name__}")
 
+IMPORT_BATCH_SIZE = 50
+
 
 class Command(BaseCommand):
     help = "Import Audio Files"
@@ -123,26 +124,18 @@ class Command(BaseCommand):
             print("Found no potential assets found with the supplied paths under imports/. Exiting.")
             return
 
-        for path in asset_paths:
-            delete_str = "and deleting " if options["delete"] else ""
-            print(
-                f"Importing {delete_str}{path.removeprefix(settings.AUDIO_IMPORTS_ROOT)}",
-                end="",
-                flush=True,
-            )
-
-            asset = asset_cls(uploader=uploader, file_basename=os.path.basename(path))
-            asset.file.save(f"imported/{asset.file_basename}", File(open(path, "rb")), save=False)
-
-            try:
-                asset.clean()
-            except ValidationError as e:
-                print(f"... skipping, validation error: {e}")
-            else:
-                asset.save()
-                if playlist:
-                    asset.playlists.add(playlist)
-                print("... done!")
-            finally:
-                if options["delete"]:
-                    os.remove(path)
+        delete_str = "and deleting " if options["delete"] else ""
+        for i in range(0, len(asset_paths), IMPORT_BATCH_SIZE):
+            for path, asset, error in import_asset_files(
+                asset_paths[i : i + IMPORT_BATCH_SIZE],
+                asset_cls,
+                upload_dir="imported",
+                uploader=uploader,
+                playlist=playlist,
+                delete=options["delete"],
+            ):
+                path = path.removeprefix(settings.AUDIO_IMPORTS_ROOT)
+                if error:
+                    print(f"Importing {delete_str}{path}... skipping, {error}")
+                else:
+                    print(f"Importing {delete_str}{path}... done!")
@@ -0,0 +1,182 @@
+from collections import defaultdict
+import logging
+import os
+import re
+import threading
+import time
+
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers.inotify import InotifyObserver
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from api.tasks import SFTP_PATH_ASSET_CLASSES
+from autodj.models import AudioAsset, Playlist
+from common.models import User
+from common.tasks import import_asset_files
+
+logger = logging.getLogger(f"crazyarms.{__name__}")
+
+# Same conventions as SFTP uploads, ie imports/<asset type>/<playlist name>/...
+IMPORTS_PATH_RE = re.compile(
+    fr"^{re.escape(settings.AUDIO_IMPORTS_ROOT)}"
+    fr'(?:(?P<asset_type>{"|".join(re.escape(p) for p in SFTP_PATH_ASSET_CLASSES.keys())})/)?'
+    r"(?:(?P<first_folder_name>[^/]+)/)?.+$"
+)
+IGNORED_SUFFIXES = (".filepart", ".part", ".crdownload", ".tmp", "~")
+
+
+class PendingFilesEventHandler(FileSystemEventHandler):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}  # path => time of last write
+
+    def touch(self, path):
+        if not os.path.basename(path).startswith(".") and not path.endswith(IGNORED_SUFFIXES):
+            with self.lock:
+                self.pending[path] = time.monotonic()
+
+    def touch_tree(self, path):
+        # Folders moved into the tree don't generate events for their contents
+        for root, dirs, files in os.walk(path):
+            for file in files:
+                self.touch(os.path.join(root, file))
+
+    def on_created(self, event):
+        if event.is_directory:
+            self.touch_tree(event.src_path)
+        else:
+            self.touch(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.touch(event.src_path)
+
+    on_closed = on_modified
+
+    def on_moved(self, event):
+        with self.lock:
+            self.pending.pop(event.src_path, None)
+        if event.is_directory:
+            self.touch_tree(event.dest_path)
+        else:
+            self.touch(event.dest_path)
+
+    def on_deleted(self, event):
+        with self.lock:
+            self.pending.pop(event.src_path, None)
+
+    def pop_settled(self, settle_seconds):
+        settled_before = time.monotonic() - settle_seconds
+        with self.lock:
+            settled = [path for path, last_write in self.pending.items() if last_write <= settled_before]
+            for path in settled:
+                del self.pending[path]
+        return sorted(settled)
+
+
+class Command(BaseCommand):
+    help = "Watch the imports/ folder and import audio files once they've finished being written"
+
+    def add_arguments(self, parser):
+        parser.add_argument("-u", "--username", help="Username of uploader (can be left blank)")
+        parser.add_argument(
+            "-s",
+            "--settle-seconds",
+            type=float,
+            default=10.0,
+            help="Seconds a file must go unmodified before it's imported (default: 10)",
+        )
+        parser.add_argument(
+            "--no-playlists",
+            action="store_true",
+            help="Don't put audio assets into playlists named by the first sub-folder they're placed in",
+        )
+        parser.add_argument(
+            "--scan",
+            action="store_true",
+            help="Import files already in imports/ at startup, in addition to newly written ones",
+        )
+        parser.add_argument(
+            "-d",
+            "--delete",
+            action="store_true",
+            help="Delete input files after importing them, whether they can be converted to audio files or not",
+        )
+
+    def import_paths(self, paths):
+        groups = defaultdict(list)
+        for path in paths:
+            if not os.path.isfile(path) or os.path.islink(path):
+                continue
+            match = IMPORTS_PATH_RE.search(path)
+            if match:
+                match = match.groupdict()
+                asset_cls = SFTP_PATH_ASSET_CLASSES.get(match["asset_type"]) or AudioAsset
+                groups[(asset_cls, match["first_folder_name"])].append(path)
+
+        for (asset_cls, folder), group_paths in groups.items():
+            playlist = None
+            if asset_cls is AudioAsset and folder and self.playlists_by_folder:
+                playlist, created = Playlist.get_or_create_for_folder(folder)
+                if created:
+                    logger.info(f"created playlist {playlist.name} for imports")
+
+            type_name = asset_cls._meta.verbose_name
+            for path, asset, error in import_asset_files(
+                group_paths,
+                asset_cls,
+                upload_dir="imported",
+                uploader=self.uploader,
+                playlist=playlist,
+                delete=self.delete,
+            ):
+                path = path.removeprefix(settings.AUDIO_IMPORTS_ROOT)
+                if error:
+                    logger.warning(f"skipped import of {type_name} {path}: {error}")
+                else:
+                    logger.info(f"imported {type_name} {path}{f' into playlist {playlist.name}' if playlist else ''}")
+
+    def import_settled(self, handler, settle_seconds):
+        paths = handler.pop_settled(settle_seconds)
+        if paths:
+            logger.info(f"importing {len(paths)} files from {settings.AUDIO_IMPORTS_ROOT}")
+            close_old_connections()
+            try:
+                self.import_paths(paths)
+            except Exception:
+                # Keep watching, and try files that are still there (ie weren't imported) again once they settle
+                logger.exception(f"error importing {len(paths)} files, retrying the ones that are left")
+                for path in paths:
+                    if os.path.isfile(path):
+                        handler.touch(path)
+        return bool(paths)
+
+    def handle(self, *args, **options):
+        self.playlists_by_folder, self.delete = not options["no_playlists"], options["delete"]
+        self.uploader = None
+        if options["username"]:
+            try:
+                self.uploader = User.objects.get(username=options["username"])
+            except User.DoesNotExist:
+                print(f'No user exists with username {options["username"]}. Exiting.')
+                return
+
+        handler = PendingFilesEventHandler()
+        observer = InotifyObserver()
+        observer.schedule(handler, settings.AUDIO_IMPORTS_ROOT, recursive=True)
+        observer.start()
+        self.stdout.write(f"Watching {settings.AUDIO_IMPORTS_ROOT} for audio files to import...")
+
+        if options["scan"]:
+            handler.touch_tree(settings.AUDIO_IMPORTS_ROOT)
+
+        try:
+            while observer.is_alive():
+                if not self.import_settled(handler, options["settle_seconds"]):
+                    time.sleep(1)
+        finally:
+            observer.stop()
+            observer.join()
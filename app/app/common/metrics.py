@@ -0,0 +1,227 @@
+from contextlib import contextmanager
+import datetime
+import logging
+import math
+import time
+
+from huey import PriorityRedisExpireHuey
+
+from django_redis import get_redis_connection
+
+from crazyarms import constants
+
+logger = logging.getLogger(f"crazyarms.{__name__}")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, math.inf)
+HUEY_ENQUEUED_AT_TIMEOUT = 60 * 60 * 24
+REGISTRY = {}
+
+# Metrics are written to Redis hashes (one per metric, one field per label set) so they're aggregated across every
+# gunicorn, uvicorn and huey process, and rendered in the Prometheus text format by whichever process is scraped.
+
+
+def format_labels(labels):
+    def escape(value):
+        return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+    return ",".join(f'{name}="{escape(value)}"' for name, value in sorted(labels.items()))
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return f"{value:g}" if isinstance(value, float) else str(value)
+
+
+class Metric:
+    TYPE = None
+
+    def __init__(self, name, help):
+        self.name = f"crazyarms_{name}"
+        self.help = help
+        REGISTRY[self.name] = self
+
+    @property
+    def redis_key(self):
+        return f"{constants.REDIS_KEY_METRICS_PREFIX}{self.name}"
+
+    def write(self, updates):
+        # Metrics should never break the code they're measuring
+        try:
+            pipe = get_redis_connection().pipeline(transaction=False)
+            for field, amount in updates:
+                if isinstance(amount, float):
+                    pipe.hincrbyfloat(self.redis_key, field, amount)
+                else:
+                    pipe.hincrby(self.redis_key, field, amount)
+            pipe.execute()
+        except Exception:
+            logger.exception(f"error writing metric {self.name}")
+
+    def samples(self):
+        raise NotImplementedError()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.TYPE}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{f'{{{labels}}}' if labels else ''} {format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    TYPE = "counter"
+
+    def inc(self, amount=1, **labels):
+        self.write([(format_labels(labels), amount)])
+
+    def samples(self):
+        for labels, value in sorted(get_redis_connection().hgetall(self.redis_key).items()):
+            yield "_total", labels.decode(), float(value)
+
+
+class Gauge(Metric):
+    """Computed when scraped, by calling func() which returns a number, or a dict of label tuples => number"""
+
+    TYPE = "gauge"
+
+    def __init__(self, name, help, func, label_names=()):
+        super().__init__(name, help)
+        self.func = func
+        self.label_names = label_names
+
+    def samples(self):
+        value = self.func()
+        if isinstance(value, dict):
+            for label_values, num in sorted(value.items()):
+                yield "", format_labels(dict(zip(self.label_names, label_values))), num
+        else:
+            yield "", "", value
+
+
+class Histogram(Metric):
+    TYPE = "histogram"
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        labels = format_labels(labels)
+        # Only the bucket the value falls in is incremented, buckets are made cumulative when rendered
+        bucket = next(bucket for bucket in self.buckets if value <= bucket)
+        self.write([(f"{labels}|{format_value(bucket)}", 1), (f"{labels}|sum", float(value)), (f"{labels}|count", 1)])
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.monotonic()
+        try:
+            yield labels  # Labels can be modified by the caller, ie based on a result
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+
+    def samples(self):
+        label_sets = {}
+        for field, value in get_redis_connection().hgetall(self.redis_key).items():
+            labels, key = field.decode().rsplit("|", 1)
+            label_sets.setdefault(labels, {})[key] = float(value) if key == "sum" else int(value)
+
+        for labels, values in sorted(label_sets.items()):
+            cumulative = 0
+            for bucket in self.buckets:
+                cumulative += values.get(format_value(bucket), 0)
+                yield "_bucket", f'{labels}{"," if labels else ""}le="{format_value(bucket)}"', cumulative
+            yield "_sum", labels, values.get("sum", 0.0)
+            yield "_count", labels, values.get("count", 0)
+
+
+def render_metrics():
+    rendered = []
+    for metric in REGISTRY.values():
+        try:
+            rendered.append(metric.render())
+        except Exception:
+            logger.exception(f"error rendering metric {metric.name}")
+    return "\n".join(rendered) + "\n"
+
+
+def clear_metrics():
+    get_redis_connection().delete(*(metric.redis_key for metric in REGISTRY.values()))
+
+
+class MetricsHuey(PriorityRedisExpireHuey):
+    """Huey that records how long tasks wait in the queue and how long they run for"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pre_execute(name="metrics")(self.metrics_pre_execute)
+        self.post_execute(name="metrics")(self.metrics_post_execute)
+
+    @staticmethod
+    def enqueued_at_key(task):
+        return f"{constants.REDIS_KEY_METRICS_HUEY_ENQUEUED_AT_PREFIX}{task.id}"
+
+    def enqueue(self, task):
+        if not self._immediate:
+            try:
+                get_redis_connection().set(self.enqueued_at_key(task), time.time(), ex=HUEY_ENQUEUED_AT_TIMEOUT)
+            except Exception:
+                logger.exception(f"error recording enqueue time of {task.name}")
+        return super().enqueue(task)
+
+    def metrics_pre_execute(self, task):
+        try:
+            pipe = get_redis_connection().pipeline()
+            pipe.get(self.enqueued_at_key(task))
+            pipe.delete(self.enqueued_at_key(task))
+            enqueued_at, _ = pipe.execute()
+        except Exception:
+            logger.exception(f"error getting enqueue time of {task.name}")
+            enqueued_at = None
+
+        # Scheduled tasks are only waiting once their eta has passed
+        if task.eta:
+            enqueued_at = max(float(enqueued_at or 0), task.eta.replace(tzinfo=datetime.timezone.utc).timestamp())
+        if enqueued_at:
+            huey_task_wait_seconds.observe(max(time.time() - float(enqueued_at), 0.0), task=task.name)
+        task.metrics_started_at = time.monotonic()
+
+    def metrics_post_execute(self, task, task_value, exc):
+        started_at = getattr(task, "metrics_started_at", None)
+        if started_at is not None:
+            status = "success" if exc is None else "error"
+            huey_task_run_seconds.observe(time.monotonic() - started_at, task=task.name, status=status)
+
+
+def get_playout_log_queue_length():
+    from services.playout_log import get_queue_length
+
+    return get_queue_length()
+
+
+def get_huey_queue_depth():
+    from huey.contrib.djhuey import HUEY
+
+    return {("pending",): HUEY.pending_count(), ("scheduled",): HUEY.scheduled_count()}
+
+
+api_request_seconds = Histogram("api_request_seconds", "Internal API request latency by endpoint")
+autodj_pick_seconds = Histogram("autodj_pick_seconds", "Time taken for AutoDJ to pick the next track")
+autodj_picks = Counter("autodj_picks", "AutoDJ picks by fallback tier")
+autodj_stopset_generation_seconds = Histogram(
+    "autodj_stopset_generation_seconds", "Time taken for AutoDJ to generate a stop set"
+)
+gcal_sync_seconds = Histogram("gcal_sync_seconds", "Google Calendar sync duration", buckets=DEFAULT_BUCKETS[6:])
+huey_task_wait_seconds = Histogram("huey_task_wait_seconds", "Time tasks spent waiting in the queue by task name")
+huey_task_run_seconds = Histogram("huey_task_run_seconds", "Task run time by task name")
+huey_queue_depth = Gauge(
+    "huey_queue_depth", "Number of tasks in the queue", get_huey_queue_depth, label_names=("state",)
+)
+playout_log_queue_length = Gauge(
+    "playout_log_queue_length",
+    "Playout log stream messages (batches of entries) waiting for or being processed by the log subscribers",
+    get_playout_log_queue_length,
+)
+playout_log_entries = Counter("playout_log_entries", "Playout log entries ingested by the log subscriber by status")
+liquidsoap_telnet_seconds = Histogram(
+    "liquidsoap_telnet_seconds", "Liquidsoap telnet command latency by host and command"
+)
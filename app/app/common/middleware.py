@@ -1,16 +1,15 @@
 import pytz
 
 from django.utils import timezone
+from django.utils.deprecation import MiddlewareMixin
 
 
-class UserTimezoneMiddleware:
-    def __init__(self, get_response):
-        self.get_response = get_response
-
-    def __call__(self, request):
+class UserTimezoneMiddleware(MiddlewareMixin):
+    # A MiddlewareMixin so it's async capable, otherwise under ASGI every request (and async API view) would be run
+    # on the one thread that synchronous middleware share
+    def process_request(self, request):
         if request.user.is_authenticated:
             tz = pytz.timezone(request.user.timezone)
             timezone.activate(tz)
         else:
             timezone.deactivate()
-        return self.get_response(request)
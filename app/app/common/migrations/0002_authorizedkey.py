@@ -0,0 +1,42 @@
+# Generated by Django 3.2rc1 on 2026-10-19 14:47
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+from common.ssh_keys import parse_authorized_keys
+
+
+def parse_existing_authorized_keys(apps, schema_editor):
+    User = apps.get_model("common", "User")
+    AuthorizedKey = apps.get_model("common", "AuthorizedKey")
+
+    AuthorizedKey.objects.bulk_create(
+        AuthorizedKey(user=user, **parsed)
+        for user in User.objects.exclude(authorized_keys="")
+        for parsed in parse_authorized_keys(user.authorized_keys)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthorizedKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key_type', models.CharField(max_length=64)),
+                ('fingerprint', models.CharField(db_index=True, max_length=64)),
+                ('comment', models.CharField(blank=True, max_length=255)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ssh_keys', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'fingerprint')},
+            },
+        ),
+        migrations.RunPython(parse_existing_authorized_keys, migrations.RunPython.noop),
+    ]
@@ -28,6 +28,9 @@ from dirtyfields import DirtyFieldsMixin
 
 from crazyarms import constants
 
+from .ssh_keys import parse_authorized_key, parse_authorized_keys
+from .storage import content_addressed_storage
+
 logger = logging.getLogger(f"crazyarms.{__name__}")
 
 
@@ -71,6 +74,7 @@ def filter_inactive_group_queryset(queryset):
     return queryset
 
 
+HARBOR_AUTH_RECORD_TIMEOUT = 60 * 60 * 24
 CurrentHarborAuthorization = namedtuple("CurrentHarborAuthorization", ("authorized", "end", "title"))
 
 
@@ -186,7 +190,17 @@ class User(DirtyFieldsMixin, AbstractUser):
     def save(self, *args, **kwargs):
         if self.stream_key is None or "password" in self.get_dirty_fields():
             self.stream_key = generate_random_string(self.STREAM_KEY_LENGTH)
+        authorized_keys_changed = self._state.adding or "authorized_keys" in self.get_dirty_fields()
         super().save(*args, **kwargs)
+        if authorized_keys_changed:
+            self.sync_authorized_keys()
+        on_commit(self.update_harbor_auth_record)
+
+    def sync_authorized_keys(self):
+        self.ssh_keys.all().delete()
+        AuthorizedKey.objects.bulk_create(
+            AuthorizedKey(user=self, **parsed) for parsed in AuthorizedKey.parse_lines(self.authorized_keys)
+        )
 
     def get_full_name(self, short=False):
         if self.name:
@@ -234,21 +248,6 @@ class User(DirtyFieldsMixin, AbstractUser):
         now_with_exit_grace = now - datetime.timedelta(minutes=self.gcal_exit_grace_minutes)
         return list(self._show_times_qs().filter(start__lte=now_with_entry_grace, end__gte=now_with_exit_grace))
 
-    # This one shouldn't be cached since we may need to pass it a dynamic now, ie in authorization
-    # where exact timings and a consistent now is more important
-    def current_show_time(self, now=None):
-        if now is None:
-            now = timezone.now()
-        now_with_entry_grace = now + datetime.timedelta(minutes=self.gcal_entry_grace_minutes)
-        now_with_exit_grace = now - datetime.timedelta(minutes=self.gcal_exit_grace_minutes)
-        return (
-            # We want the latest ending one, hence -end
-            self.gcal_shows.order_by("-end", "start")
-            .filter(start__lte=now_with_entry_grace, end__gte=now_with_exit_grace)
-            .values_list("title", "start", "end")
-            .first()
-        )
-
     def has_autodj_request_permission(self):
         if config.AUTODJ_ENABLED:
             code = config.AUTODJ_REQUESTS
@@ -278,6 +277,64 @@ class User(DirtyFieldsMixin, AbstractUser):
 
         return perms
 
+    def build_harbor_auth_record(self, now=None):
+        # Everything needed to answer currently_harbor_authorized() without hitting the database
+        if now is None:
+            now = timezone.now()
+
+        title_suffix = ""
+        if config.APPEND_LIVE_ON_STATION_NAME_TO_METADATA:
+            # This copy is used in webui/views.py:ZoomView twice, so change it there too
+            title_suffix = f" LIVE on {config.STATION_NAME}"
+
+        ban_seconds = cache.ttl(f"{constants.CACHE_KEY_HARBOR_BAN_PREFIX}{self.id}")
+        entry_grace = datetime.timedelta(minutes=self.gcal_entry_grace_minutes)
+        exit_grace = datetime.timedelta(minutes=self.gcal_exit_grace_minutes)
+
+        return {
+            "harbor_auth": self.harbor_auth,
+            "harbor_auth_display": self.get_harbor_auth_display(),
+            "gcal_enabled": config.GOOGLE_CALENDAR_ENABLED,
+            "default_title": f"{self.get_full_name(short=True)}'s show",
+            "title_suffix": title_suffix,
+            "ban_until": (now + datetime.timedelta(seconds=ban_seconds)).timestamp() if ban_seconds > 0 else None,
+            "entry_grace_minutes": self.gcal_entry_grace_minutes,
+            "exit_grace_minutes": self.gcal_exit_grace_minutes,
+            # Shows as (title, start, end, entry with grace, exit with grace) timestamps
+            "windows": [
+                (
+                    title,
+                    start.timestamp(),
+                    end.timestamp(),
+                    (start - entry_grace).timestamp(),
+                    (end + exit_grace).timestamp(),
+                )
+                for title, start, end in self._show_times_qs().filter(end__gte=now - exit_grace)
+            ],
+        }
+
+    def update_harbor_auth_record(self):
+        record = self.build_harbor_auth_record()
+        cache.set(
+            f"{constants.CACHE_KEY_HARBOR_AUTH_RECORD_PREFIX}{self.id}", record, timeout=HARBOR_AUTH_RECORD_TIMEOUT
+        )
+        return record
+
+    @classmethod
+    def update_all_harbor_auth_records(cls):
+        for user in cls.objects.all():
+            user.update_harbor_auth_record()
+
+    @staticmethod
+    def clear_all_harbor_auth_records():
+        cache.delete_pattern(f"{constants.CACHE_KEY_HARBOR_AUTH_RECORD_PREFIX}*")
+
+    def get_harbor_auth_record(self):
+        record = cache.get(f"{constants.CACHE_KEY_HARBOR_AUTH_RECORD_PREFIX}{self.id}")
+        if record is None:
+            record = self.update_harbor_auth_record()
+        return record
+
     def currently_harbor_authorized(self, now=None, should_log=True):
         def log(s):
             if should_log:
@@ -285,50 +342,52 @@ class User(DirtyFieldsMixin, AbstractUser):
 
         if now is None:
             now = timezone.now()
+        now_ts = now.timestamp()
+        record = self.get_harbor_auth_record()
+
+        # We want the latest ending one
+        current_show = max(
+            (window for window in record["windows"] if window[3] <= now_ts <= window[4]),
+            key=lambda window: (window[2], -window[1]),
+            default=None,
+        )
+        title = (current_show and current_show[0]) or record["default_title"]
+        title += record["title_suffix"]
 
-        title = None
-        current_show = self.current_show_time(now=now)
-        if current_show:
-            title = current_show[0]
-        if not title:
-            title = f"{self.get_full_name(short=True)}'s show"
-        if config.APPEND_LIVE_ON_STATION_NAME_TO_METADATA:
-            # This copy is used in webui/views.py:ZoomView twice, so change it there too
-            title += f" LIVE on {config.STATION_NAME}"
-
-        auth_log = f'harbor_auth = {self.get_harbor_auth_display()} for show "{title}"'
+        auth_log = f'harbor_auth = {record["harbor_auth_display"]} for show "{title}"'
 
-        ban_seconds = cache.ttl(f"{constants.CACHE_KEY_HARBOR_BAN_PREFIX}{self.id}")
-        if ban_seconds > 0:
+        if record["ban_until"] and record["ban_until"] > now_ts:
+            ban_seconds = math.ceil(record["ban_until"] - now_ts)
             log(f"dj auth requested by {self}: denied ({auth_log}, but BANNED with {ban_seconds} seconds left)")
             return CurrentHarborAuthorization(False, None, title)
 
-        if self.harbor_auth == self.HarborAuth.NEVER:
+        if record["harbor_auth"] == self.HarborAuth.NEVER:
             log(f"dj auth requested by {self}: denied ({auth_log})")
             return CurrentHarborAuthorization(False, None, title)
 
-        elif self.harbor_auth == self.HarborAuth.ALWAYS:
+        elif record["harbor_auth"] == self.HarborAuth.ALWAYS:
             log(f"dj auth requested by {self}: allowed ({auth_log})")
             return CurrentHarborAuthorization(True, None, title)
 
-        elif self.harbor_auth == self.HarborAuth.GOOGLE_CALENDAR:
-            if config.GOOGLE_CALENDAR_ENABLED:
+        elif record["harbor_auth"] == self.HarborAuth.GOOGLE_CALENDAR:
+            entry_grace, exit_grace = record["entry_grace_minutes"], record["exit_grace_minutes"]
+            if record["gcal_enabled"]:
                 if current_show:
-                    _, lower, upper = current_show
+                    lower, upper, _, end = (
+                        datetime.datetime.fromtimestamp(ts, datetime.timezone.utc) for ts in current_show[1:]
+                    )
                     log(
                         f"dj auth requested by {self}: allowed ({auth_log}, {timezone.localtime(now)} in time bounds -"
-                        f" {timezone.localtime(lower)} - {timezone.localtime(upper)} with"
-                        f" {self.gcal_entry_grace_minutes} minutes entry grace, {self.gcal_exit_grace_minutes} minutes"
-                        " exit grace)"
+                        f" {timezone.localtime(lower)} - {timezone.localtime(upper)} with {entry_grace} minutes entry"
+                        f" grace, {exit_grace} minutes exit grace)"
                     )
                     # Return the authorized until amount
-                    end = upper + datetime.timedelta(minutes=self.gcal_exit_grace_minutes)
                     return CurrentHarborAuthorization(True, end, title)
                 else:
                     log(
                         f"dj auth requested by {self}: denied ({auth_log}, {timezone.localtime(now)} not in time bounds"
-                        f" for {self.gcal_shows.count()} show times, {self.gcal_entry_grace_minutes} minutes entry"
-                        f" grace, {self.gcal_exit_grace_minutes} minutes exit grace)"
+                        f" for {len(record['windows'])} upcoming show times, {entry_grace} minutes entry grace,"
+                        f" {exit_grace} minutes exit grace)"
                     )
                     return CurrentHarborAuthorization(False, None, title)
             else:
@@ -339,6 +398,28 @@ class User(DirtyFieldsMixin, AbstractUser):
                 return CurrentHarborAuthorization(True, None, title)
 
 
+class AuthorizedKey(models.Model):
+    # Parsed from User.authorized_keys, so key authentication is a lookup by fingerprint
+    user = models.ForeignKey(User, related_name="ssh_keys", on_delete=models.CASCADE)
+    key_type = models.CharField(max_length=64)
+    fingerprint = models.CharField(max_length=64, db_index=True)  # OpenSSH style SHA256, base64 without padding
+    comment = models.CharField(max_length=255, blank=True)
+
+    class Meta:
+        unique_together = ("user", "fingerprint")
+
+    def __str__(self):
+        return f"{self.key_type} SHA256:{self.fingerprint} {self.comment}".strip()
+
+    @staticmethod
+    def parse(line):
+        return parse_authorized_key(line)
+
+    @staticmethod
+    def parse_lines(authorized_keys):
+        return parse_authorized_keys(authorized_keys)
+
+
 def audio_asset_file_upload_to(instance, filename):
     return f"{instance.UPLOAD_DIR}/{filename}"
 
@@ -371,7 +452,9 @@ class AudioAssetBase(DirtyFieldsMixin, TimestampedModel):
         "audio file",
         max_length=512,
         blank=True,
+        db_index=True,
         upload_to=audio_asset_file_upload_to,
+        storage=content_addressed_storage,
         help_text="You can provide either an uploaded audio file or a URL to an external asset.",
     )
     duration = models.DurationField("Audio duration", default=datetime.timedelta(0))
@@ -385,6 +468,8 @@ class AudioAssetBase(DirtyFieldsMixin, TimestampedModel):
         help_text='You will be able to edit this asset when status is "ready for play."',
     )
     task_id = models.UUIDField(null=True)
+    # ffprobe/exiftool metadata + fingerprint, stamped with the name, size and mtime of the file they were computed from
+    probe = models.JSONField(default=dict, blank=True, editable=False)
 
     def __init__(self, *args, **kwargs):
         self.pre_convert_filename = kwargs.pop("pre_convert_filename", None)
@@ -476,9 +561,36 @@ class AudioAssetBase(DirtyFieldsMixin, TimestampedModel):
 
         return Metadata(**kwargs)
 
+    def file_stamp(self):
+        try:
+            stat = os.stat(self.local_filename)
+        except (OSError, TypeError):
+            return None
+        # The name catches a file being swapped for another (ContentAddressedStorage writes new contents under a new
+        # name), but a file replaced in place keeps its name, so one with the same size and mtime isn't caught
+        return {"name": self.file.name, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    def get_or_run_probe(self, key, func, serialize, deserialize):
+        stamp = self.file_stamp()
+        if stamp is not None and self.probe.get("stamp") == stamp and key in self.probe:
+            value = self.probe[key]
+            return None if value is None else deserialize(value)
+
+        value = func()
+        if stamp is not None:
+            if self.probe.get("stamp") != stamp:
+                self.probe = {"stamp": stamp}
+            self.probe[key] = None if value is None else serialize(value)
+        return value
+
     @cached_property
     def metadata(self):
-        return self.run_metadata(self.local_filename)
+        return self.get_or_run_probe(
+            "metadata",
+            lambda: self.run_metadata(self.local_filename),
+            serialize=lambda metadata: metadata._replace(duration=metadata.duration.total_seconds())._asdict(),
+            deserialize=lambda data: Metadata(**dict(data, duration=datetime.timedelta(seconds=data["duration"]))),
+        )
 
     def clear_metadata_cache(self):
         try:
@@ -488,6 +600,9 @@ class AudioAssetBase(DirtyFieldsMixin, TimestampedModel):
 
     @cached_property
     def computed_fingerprint(self):
+        return self.get_or_run_probe("fingerprint", self.run_fingerprint, serialize=str, deserialize=uuid.UUID)
+
+    def run_fingerprint(self):
         cmd = subprocess.run(
             [
                 "ffmpeg",
@@ -550,11 +665,8 @@ class AudioAssetBase(DirtyFieldsMixin, TimestampedModel):
                         if file_exists or isinstance(self.file.file, TemporaryUploadedFile):
                             # If it's pending and a UI based (TemporaryUploadedFile) upload, that's all we have to do
                             if file_exists:
-                                # Otherwise the file already exists, so rename it
-                                os.rename(
-                                    self.file.path,
-                                    f"{os.path.splitext(self.file.path)[0]}.{correct_ext}",
-                                )
+                                # Otherwise the file already exists, so rename it (or link it if it's shared)
+                                self.file.storage.move(self.file.name, f"{file_name}.{correct_ext}")
                             logger.info(f"normalized upload filename {self.file.name} => {file_name}.{correct_ext}")
                             self.file.name = f"{file_name}.{correct_ext}"
                 elif allow_conversion:
@@ -578,6 +690,7 @@ class AudioAssetBase(DirtyFieldsMixin, TimestampedModel):
         else:
             self.file = self.fingerprint = None
             self.duration = datetime.timedelta(0)
+            self.probe = {}
 
     @cached_property
     def task_log_line(self):
@@ -0,0 +1,33 @@
+"""Parsing of OpenSSH authorized_keys lines. Kept apart from the models, since migrations use it too."""
+
+import base64
+import binascii
+import hashlib
+
+
+def parse_authorized_key(line):
+    """Returns a dict of key_type, fingerprint (OpenSSH style SHA256, base64 without padding) and comment for an
+    authorized_keys line, or None if it doesn't contain a key"""
+    # Lines can start with options, so look for the "<type> <base64 key>" pair
+    tokens = line.strip().split()
+    for i, key_type in enumerate(tokens[:-1]):
+        try:
+            blob = base64.b64decode(tokens[i + 1], validate=True)
+        except (binascii.Error, ValueError):
+            continue
+        # Key blobs start with their length-prefixed type
+        if blob[4 : 4 + len(key_type)] == key_type.encode() and int.from_bytes(blob[:4], "big") == len(key_type):
+            fingerprint = base64.b64encode(hashlib.sha256(blob).digest()).decode().rstrip("=")
+            comment = " ".join(tokens[i + 2 :])[:255]
+            return {"key_type": key_type, "fingerprint": fingerprint, "comment": comment}
+    return None
+
+
+def parse_authorized_keys(authorized_keys):
+    """Parse every line of an authorized_keys file, skipping ones without a key and duplicates"""
+    parsed_keys = {}
+    for line in authorized_keys.splitlines():
+        parsed = parse_authorized_key(line)
+        if parsed:
+            parsed_keys.setdefault(parsed["fingerprint"], parsed)
+    return list(parsed_keys.values())
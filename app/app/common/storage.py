@@ -0,0 +1,80 @@
+import hashlib
+import logging
+import os
+
+from django.apps import apps
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+logger = logging.getLogger(f"crazyarms.{__name__}")
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Media storage that stores audio files by the SHA-256 of their contents.
+
+    The name passed to save() is only used for its extension, so the same audio used by several assets (of any
+    type) shares a single file on disk. Files are reference counted using the (indexed) `file` columns of the audio
+    asset models, and they're only removed from disk once no asset refers to them anymore.
+    """
+
+    CONTENT_DIR = "content"
+    HASH_CHUNK_SIZE = 1024 * 1024
+
+    def content_name(self, name, content):
+        sha256 = hashlib.sha256()
+        for chunk in content.chunks(chunk_size=self.HASH_CHUNK_SIZE):
+            sha256.update(chunk)
+        digest = sha256.hexdigest()
+        ext = os.path.splitext(name)[1].lower()
+        return f"{self.CONTENT_DIR}/{digest[:2]}/{digest[2:4]}/{digest}{ext}"
+
+    class ContentExists(Exception):
+        pass
+
+    def get_available_name(self, name, max_length=None):
+        # Names are decided by content in _save(), where identical files are intentionally shared. When saving finds a
+        # file at a content name (ie a concurrent writer created it first) it asks for a new name, but it's the same
+        # contents, so rather than retrying forever that's a dedupe hit too.
+        if name.startswith(f"{self.CONTENT_DIR}/") and self.exists(name):
+            raise self.ContentExists(name)
+        return name
+
+    def _save(self, name, content):
+        name = self.content_name(name, content)
+        if not self.exists(name):
+            try:
+                return super()._save(name, content)
+            except self.ContentExists:
+                pass
+        logger.info(f"content addressed file {name} already exists, sharing it")
+        return name
+
+    @staticmethod
+    def get_asset_models():
+        from .models import AudioAssetBase
+
+        return [model for model in apps.get_models() if issubclass(model, AudioAssetBase)]
+
+    def is_orphaned(self, name):
+        return not any(model.objects.filter(file=name).exists() for model in self.get_asset_models())
+
+    def move(self, old_name, new_name):
+        # Hard link if another asset still refers to the old name, otherwise it's a simple rename
+        old_path, new_path = self.path(old_name), self.path(new_name)
+        if os.path.exists(new_path):
+            if self.is_orphaned(old_name):
+                os.remove(old_path)
+        elif self.is_orphaned(old_name):
+            os.rename(old_path, new_path)
+        else:
+            os.link(old_path, new_path)
+
+    def delete(self, name):
+        if self.is_orphaned(name):
+            super().delete(name)
+        else:
+            logger.info(f"not deleting {name}, since it's still referred to by an asset")
+
+
+content_addressed_storage = ContentAddressedStorage()
@@ -1,3 +1,4 @@
+from concurrent.futures import ThreadPoolExecutor
 import datetime
 import json
 import logging
@@ -10,8 +11,10 @@ import time
 import pytz
 
 from django.core.cache import cache
+from django.core.exceptions import ValidationError
 from django.core.files import File
 from django.core.management import call_command
+from django.db import transaction
 from django.utils import timezone
 
 from constance import config
@@ -27,6 +30,9 @@ YOUTUBE_DL_TITLE_FIELD_MAPPINGS = {
     "title": ("track", "title"),
 }
 PROCESSING_TEMP_PREFIX = "/tmp/asset-processing"
+ASSET_CONVERSION_CHUNK_SIZE = 50
+ASSET_CONVERSION_PROGRESS_TIMEOUT = 60 * 60 * 24
+ASSET_IMPORT_PROBE_WORKERS = os.cpu_count() or 1
 
 logger = logging.getLogger(f"crazyarms.{__name__}")
 
@@ -101,6 +107,7 @@ def mark_asset_failed(asset, title):
     logger.error(title)
     asset.refresh_from_db()
     asset.file = asset.fingerprint = None
+    asset.probe = {}
     for field in asset.TITLE_FIELDS:
         setattr(asset, field, "")
     asset.title = title
@@ -271,3 +278,155 @@ def asset_convert_to_acceptable_format(asset, task=None):
             )
 
         raise
+
+
+def convert_asset(obj, to_cls, uploader):
+    # Carry over the shared file, fingerprint and metadata so clean() doesn't need to run ffprobe/exiftool/ffmpeg
+    from .models import Metadata
+
+    kwargs = {"file_basename": obj.file_basename, "fingerprint": obj.fingerprint, "uploader": uploader}
+    if set(obj.TITLE_FIELDS) <= set(to_cls.TITLE_FIELDS):
+        kwargs.update({field: getattr(obj, field) for field in obj.TITLE_FIELDS})
+    else:
+        kwargs["title"] = obj.get_full_title(include_duration=False)
+
+    new_asset = to_cls(**kwargs)
+    new_asset.file.name = obj.file.name
+    new_asset.probe = obj.probe
+    new_asset.metadata = Metadata(
+        format=os.path.splitext(obj.file.name)[1].lower()[1:],
+        duration=obj.duration,
+        **{field: getattr(obj, field, "") for field in ("artist", "album", "title")},
+    )
+    new_asset.computed_fingerprint = obj.fingerprint
+    new_asset.clean(allow_conversion=False)
+    new_asset.save()
+    obj.delete()
+    return new_asset
+
+
+def get_asset_conversion_progress(user, clear_finished=True):
+    user_key = f"{constants.CACHE_KEY_ASSET_CONVERSION_USER_PREFIX}{user.id}"
+    task_ids = cache.get(user_key, [])
+    progress_keys = [f"{constants.CACHE_KEY_ASSET_CONVERSION_PREFIX}{task_id}" for task_id in task_ids]
+    progress_by_key = cache.get_many(progress_keys)
+    progress = [progress_by_key[key] for key in progress_keys if key in progress_by_key]
+
+    if clear_finished:
+        # Expired or finished tasks are only reported once
+        unfinished_task_ids = [p["task_id"] for p in progress if not p["finished"]]
+        if unfinished_task_ids != task_ids:
+            cache.set(user_key, unfinished_task_ids, timeout=ASSET_CONVERSION_PROGRESS_TIMEOUT)
+
+    return progress
+
+
+def queue_asset_conversion(from_cls, to_cls, ids, user):
+    task = asset_bulk_convert(from_cls, to_cls, ids, user)
+    user_key = f"{constants.CACHE_KEY_ASSET_CONVERSION_USER_PREFIX}{user.id}"
+    cache.set(user_key, cache.get(user_key, []) + [task.id], timeout=ASSET_CONVERSION_PROGRESS_TIMEOUT)
+    return task
+
+
+@djhuey.db_task(priority=1, context=True)
+def asset_bulk_convert(from_cls, to_cls, ids, uploader, task=None):
+    from_name, to_name = from_cls._meta.verbose_name_plural, to_cls._meta.verbose_name_plural
+    progress_key = f"{constants.CACHE_KEY_ASSET_CONVERSION_PREFIX}{task.id}"
+    progress = {
+        "task_id": task.id,
+        "from_name": from_name,
+        "to_name": to_name,
+        "total": len(ids),
+        "processed": 0,
+        "converted": 0,
+        "errors": [],
+        "finished": False,
+    }
+    cache.set(progress_key, progress, timeout=ASSET_CONVERSION_PROGRESS_TIMEOUT)
+    logger.info(f"converting {len(ids)} {from_name} to {to_name}")
+
+    try:
+        for i in range(0, len(ids), ASSET_CONVERSION_CHUNK_SIZE):
+            chunk = ids[i : i + ASSET_CONVERSION_CHUNK_SIZE]
+            with transaction.atomic():
+                for obj in from_cls.objects.filter(id__in=chunk).select_for_update():
+                    if obj.status != obj.Status.READY:
+                        progress["errors"].append(
+                            f"{obj} could not be converted since its status was {obj.get_status_display()}."
+                        )
+                        continue
+
+                    try:
+                        with transaction.atomic():
+                            convert_asset(obj, to_cls, uploader)
+                    except ValidationError as e:
+                        progress["errors"].append(f'An error occurred while converting {obj}: {", ".join(e.messages)}')
+                    else:
+                        progress["converted"] += 1
+
+            progress["processed"] += len(chunk)
+            cache.set(progress_key, progress, timeout=ASSET_CONVERSION_PROGRESS_TIMEOUT)
+    finally:
+        progress["finished"] = True
+        cache.set(progress_key, progress, timeout=ASSET_CONVERSION_PROGRESS_TIMEOUT)
+
+    logger.info(f"converted {progress['converted']}/{len(ids)} {from_name} to {to_name}")
+
+
+def warm_asset_probe(asset):
+    try:
+        asset.metadata
+        asset.computed_fingerprint
+    except Exception:
+        # Only warming up, any error comes up again (and is dealt with) when the asset is cleaned
+        logger.exception(f"error probing {asset.file.name}")
+
+
+def import_asset_files(paths, asset_cls, upload_dir, uploader=None, playlist=None, delete=False):
+    """Import files as assets, probing them in parallel before they're cleaned and saved one at a time.
+
+    Returns a list of (path, asset, error) tuples, where asset is None if it wasn't saved."""
+    results, assets = [], []
+
+    for path in paths:
+        asset = asset_cls(uploader=uploader, file_basename=os.path.basename(path))
+        try:
+            with open(path, "rb") as file:
+                asset.file.save(f"{upload_dir}/{asset.file_basename}", File(file), save=False)
+        except OSError as e:
+            results.append((path, None, str(e)))
+        else:
+            assets.append((path, asset))
+
+    with ThreadPoolExecutor(max_workers=ASSET_IMPORT_PROBE_WORKERS) as executor:
+        for _ in executor.map(warm_asset_probe, (asset for _, asset in assets)):
+            pass
+
+    saved_assets = []
+    for path, asset in assets:
+        try:
+            asset.clean()
+            asset.save()
+        except ValidationError as e:
+            results.append((path, None, ", ".join(e.messages)))
+            asset.file.delete(save=False)
+        except Exception as e:
+            # Anything else (ffprobe, the database) only fails this file, not the rest of them
+            logger.exception(f"error importing {path}")
+            results.append((path, None, f"unexpected error: {e}"))
+            asset.file.delete(save=False)
+        else:
+            saved_assets.append(asset)
+            results.append((path, asset, None))
+
+    if playlist is not None and saved_assets:
+        playlist.audio_assets.add(*saved_assets)
+
+    if delete:
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                logger.exception(f"error removing imported file: {path}")
+
+    return results
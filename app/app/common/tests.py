@@ -0,0 +1,155 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from unittest.mock import patch
+
+from django.core.files.base import ContentFile
+from django.test import TestCase, override_settings
+
+from autodj.models import AudioAsset, Playlist, RotatorAsset
+
+from .management.commands.watch_imports import Command as WatchImportsCommand
+from .management.commands.watch_imports import PendingFilesEventHandler
+from .storage import ContentAddressedStorage
+from .tasks import import_asset_files
+
+
+class ContentAddressedStorageTests(TestCase):
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.location)
+        self.storage = ContentAddressedStorage(location=self.location)
+
+    def create_asset(self, name):
+        asset = AudioAsset(file=name, file_basename=os.path.basename(name), status=AudioAsset.Status.READY)
+        asset.save()
+        return asset
+
+    def test_saved_by_content_hash(self):
+        digest = hashlib.sha256(b"audio").hexdigest()
+        name = self.storage.save("uploads/Track.MP3", ContentFile(b"audio"))
+        self.assertEqual(name, f"content/{digest[:2]}/{digest[2:4]}/{digest}.mp3")
+        with self.storage.open(name) as file:
+            self.assertEqual(file.read(), b"audio")
+
+        self.assertEqual(self.storage.save("uploads/other.mp3", ContentFile(b"audio")), name)
+        self.assertNotEqual(self.storage.save("uploads/other.mp3", ContentFile(b"other audio")), name)
+
+    def test_concurrent_writer_is_a_dedupe_hit(self):
+        name = self.storage.save("uploads/track.mp3", ContentFile(b"audio"))
+        # Another writer creates the file between the existence check and the write
+        with patch.object(self.storage, "exists", side_effect=[False, True]):
+            self.assertEqual(self.storage.save("uploads/track.mp3", ContentFile(b"audio")), name)
+        self.assertEqual(os.listdir(os.path.dirname(self.storage.path(name))), [os.path.basename(name)])
+
+    def test_delete_only_when_orphaned(self):
+        name = self.storage.save("uploads/track.mp3", ContentFile(b"audio"))
+        asset = self.create_asset(name)
+        self.assertFalse(self.storage.is_orphaned(name))
+
+        self.storage.delete(name)
+        self.assertTrue(self.storage.exists(name))
+
+        asset.delete()
+        self.assertTrue(self.storage.is_orphaned(name))
+        self.storage.delete(name)
+        self.assertFalse(self.storage.exists(name))
+
+    def test_move(self):
+        name = self.storage.save("uploads/track.wav", ContentFile(b"audio"))
+        new_name = name.replace(".wav", ".mp3")
+
+        # Still referred to, so it's linked
+        asset = self.create_asset(name)
+        self.storage.move(name, new_name)
+        self.assertTrue(self.storage.exists(name))
+        self.assertEqual(os.stat(self.storage.path(name)).st_ino, os.stat(self.storage.path(new_name)).st_ino)
+
+        # Orphaned, and the new name already exists, so it's removed
+        asset.delete()
+        self.storage.move(name, new_name)
+        self.assertFalse(self.storage.exists(name))
+        self.assertTrue(self.storage.exists(new_name))
+
+        # Orphaned, so it's a rename
+        self.storage.move(new_name, name)
+        self.assertTrue(self.storage.exists(name))
+        self.assertFalse(self.storage.exists(new_name))
+
+
+class ImportAssetFilesTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.import_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.import_dir)
+
+    @patch("common.models.AudioAssetBase.clean", side_effect=[None, RuntimeError("ffprobe crashed"), None])
+    @patch("common.tasks.warm_asset_probe")
+    def test_one_file_failing_doesnt_fail_the_rest(self, warm_asset_probe, clean):
+        paths = []
+        for num in range(3):
+            path = os.path.join(self.import_dir, f"{num}.mp3")
+            with open(path, "wb") as file:
+                file.write(f"audio {num}".encode())
+            paths.append(path)
+
+        with override_settings(MEDIA_ROOT=self.media_root), self.assertLogs("crazyarms.common.tasks", "ERROR"):
+            results = import_asset_files(paths, AudioAsset, upload_dir="uploads", delete=True)
+
+        self.assertEqual([(path, asset is not None) for path, asset, _ in results], [(p, p != paths[1]) for p in paths])
+        self.assertEqual(results[1][2], "unexpected error: ffprobe crashed")
+        self.assertEqual(AudioAsset.objects.count(), 2)
+        self.assertEqual(os.listdir(self.import_dir), [])
+
+
+class WatchImportsTests(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.command = WatchImportsCommand()
+        self.command.uploader, self.command.playlists_by_folder, self.command.delete = None, True, True
+
+    def create_file(self, path):
+        path = os.path.join(self.dir, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, "wb").close()
+        return path
+
+    def test_pending_files_settle(self):
+        handler = PendingFilesEventHandler()
+        paths = [self.create_file("a.mp3"), self.create_file("folder/b.mp3")]
+        self.create_file(".hidden.mp3")
+        self.create_file("c.mp3.part")
+        handler.touch_tree(self.dir)
+
+        self.assertEqual(handler.pop_settled(settle_seconds=60), [])
+        self.assertEqual(handler.pop_settled(settle_seconds=0), sorted(paths))
+        self.assertEqual(handler.pop_settled(settle_seconds=0), [])
+
+    @patch("common.management.commands.watch_imports.os.path.islink", return_value=False)
+    @patch("common.management.commands.watch_imports.os.path.isfile", return_value=True)
+    @patch("common.management.commands.watch_imports.import_asset_files", return_value=[])
+    def test_grouped_by_type_and_folder(self, import_asset_files, isfile, islink):
+        paths = ["/imports_root/My Folder/1.mp3", "/imports_root/rotator-assets/2.mp3", "/imports_root/3.mp3"]
+        self.command.import_paths(paths)
+
+        playlist = Playlist.objects.get()
+        self.assertEqual(playlist.name, "My Folder")
+        calls = [(call.args[0], call.args[1], call.kwargs["playlist"]) for call in import_asset_files.call_args_list]
+        self.assertEqual(
+            calls,
+            [([paths[0]], AudioAsset, playlist), ([paths[1]], RotatorAsset, None), ([paths[2]], AudioAsset, None)],
+        )
+
+    def test_failed_batch_retried(self):
+        handler = PendingFilesEventHandler()
+        path = self.create_file("a.mp3")
+        handler.touch(path)
+
+        with patch.object(self.command, "import_paths", side_effect=RuntimeError("database is down")), self.assertLogs(
+            "crazyarms.common.management.commands.watch_imports", "ERROR"
+        ):
+            self.assertTrue(self.command.import_settled(handler, settle_seconds=0))
+        self.assertEqual(handler.pop_settled(settle_seconds=0), [path])
@@ -1,3 +1,6 @@
+CACHE_KEY_API_AUTH_CREDENTIALS_PREFIX = "api:auth-credentials:"  # + hmac digest
+CACHE_KEY_ASSET_CONVERSION_PREFIX = "asset:conversion:"  # + task.id
+CACHE_KEY_ASSET_CONVERSION_USER_PREFIX = "asset:conversion-user:"  # + user.id
 CACHE_KEY_ASSET_TASK_LOG_PREFIX = "asset:task-log:"  # + task.id
 CACHE_KEY_AUTODJ_CURRENT_STOPSET = "autodj:current-stopset"
 CACHE_KEY_AUTODJ_NO_REPEAT_ARTISTS = "autodj:no-repeat-artists"
@@ -5,9 +8,19 @@ CACHE_KEY_AUTODJ_NO_REPEAT_IDS = "autodj:no-repeat-ids"
 CACHE_KEY_AUTODJ_REQUESTS = "autodj:requests"
 CACHE_KEY_AUTODJ_STOPSET_LAST_FINISHED_AT = "autodj:stopset-last-finished-at"
 CACHE_KEY_GCAL_LAST_SYNC = "gcal:last-sync"
+CACHE_KEY_HARBOR_AUTH_RECORD_PREFIX = "harbor:auth-record:"  # + user.id
 CACHE_KEY_HARBOR_BAN_PREFIX = "harbor:ban:"  # + user.id
 CACHE_KEY_HARBOR_CONFIG_CONTEXT = "harbor:config-context"
+CACHE_KEY_HARBOR_STATUS = "harbor:status"
 CACHE_KEY_YTDL_UP2DATE = "youtube-dl:up2date"
+CACHE_KEY_SERVICES_STATUS = "services:status"
 CACHE_KEY_SET_PASSWORD_PREFIX = "user:set-password:"
+REDIS_KEY_API_AUTH_FAILURES_PREFIX = "api:auth-failures:"  # + username:<username>, ip:<ip> or no-ip
+REDIS_KEY_METRICS_HUEY_ENQUEUED_AT_PREFIX = "metrics:huey-enqueued-at:"  # + task.id
+REDIS_KEY_METRICS_PREFIX = "metrics:"  # + metric name
 REDIS_KEY_ROOM_INFO = "zoom-runner:room-info"
-REDIS_KEY_SERVICE_LOGS = "service:logs"
+REDIS_KEY_SERVICE_LOGS = "service:log-stream"  # Redis stream, see services/playout_log.py
+REDIS_KEY_SFTP_UPLOADS = "sftp:uploads"
+REDIS_KEY_SFTP_UPLOADS_ATTEMPTS = "sftp:uploads-attempts"  # Redis hash of path => failed attempts
+REDIS_KEY_SFTP_UPLOADS_FAILED = "sftp:uploads-failed"  # Paths given up on after SFTP_UPLOADS_MAX_ATTEMPTS
+REDIS_KEY_SFTP_UPLOADS_SCHEDULED = "sftp:uploads-scheduled"
@@ -25,7 +25,7 @@ SFTP_PORT = env.int("SFTP_PORT", default=2022)
 TIME_ZONE = env("TIMEZONE", default="US/Pacific")
 ZOOM_ENABLED = env.bool("ZOOM_ENABLED", default=False)
 
-ALLOWED_HOSTS = ["app", "localhost", "127.0.0.1", DOMAIN_NAME]
+ALLOWED_HOSTS = ["api", "app", "localhost", "127.0.0.1", DOMAIN_NAME]
 SECURE_PROXY_SSL_HEADER = ("HTTP_X_FORWARDED_PROTO", "https")
 
 INSTALLED_APPS = [
@@ -138,6 +138,8 @@ DATABASES = {
         "PASSWORD": "postgres",
         "HOST": "db",
         "PORT": 5432,
+        # Lower than the default of 0.6 for playout log searches, since they're often a few words of a description
+        "OPTIONS": {"options": "-c pg_trgm.word_similarity_threshold=0.4"},
     }
 }
 
@@ -176,11 +178,13 @@ MEDIA_URL = "/media/"
 MEDIA_ROOT = "/media_root/"
 AUDIO_IMPORTS_ROOT = "/imports_root/"
 SFTP_UPLOADS_ROOT = "/sftp_root/"
+# Whether synchronous API handlers all run on one shared thread under ASGI, rather than concurrently in a pool
+API_THREAD_SENSITIVE = False
 
 HUEY = {
     "connection": {"host": "redis"},
     "expire_time": 60 * 60,
-    "huey_class": "huey.PriorityRedisExpireHuey",
+    "huey_class": "common.metrics.MetricsHuey",
     "immediate": False,
     "name": "crazyarms",
     # 'connection_pool': ConnectionPool(host='redis', max_connections=5),
@@ -196,9 +200,9 @@ SHELL_PLUS_IMPORTS = [
     " remove_unused_media_files_daily",
     "from gcal.tasks import sync_gcal_api",
     "from webui.tasks import stop_zoom_broadcast",
-    "from api.tasks import process_sftp_upload",
+    "from api.tasks import process_sftp_uploads",
     "from broadcast.tasks import play_broadcast",
-    "from services.tasks import purge_playout_log_entries, liquidsoap_services_watchdog",
+    "from services.tasks import purge_playout_log_entries, create_playout_log_partitions, liquidsoap_services_watchdog",
 ]
 
 CONSTANCE_BACKEND = "constance.backends.redisd.RedisBackend"
@@ -227,6 +231,18 @@ CONSTANCE_ADDITIONAL_FIELDS = {
             ),
         },
     ],
+    "harbor_transport_choices": [
+        "django.forms.fields.ChoiceField",
+        {
+            "widget": "django.forms.Select",
+            # Careful: referred to by services/templates/services/{harbor,library}.liq
+            "choices": (
+                ("wav", "Uncompressed WAVE (about 1.4 Mbit/s)"),
+                ("flac", "FLAC (lossless, about half the bandwidth)"),
+                ("ogg-flac", "Ogg/FLAC (lossless, about half the bandwidth)"),
+            ),
+        },
+    ],
     "autodj_requests_choices": [
         "django.forms.fields.ChoiceField",
         {
@@ -272,7 +288,8 @@ CONSTANCE_CONFIG = OrderedDict(
             "PLAYOUT_LOG_PURGE_DAYS",
             (
                 14,
-                "The number of days to keep playout log entries after which they're purged. "
+                "The number of days to keep playout log entries after which they're purged. Entries are stored and "
+                "purged by calendar month (UTC), so they're kept until their whole month is this old. "
                 "Set to 0 to keep playout log entries forever.",
                 "positive_int",
             ),
@@ -338,6 +355,15 @@ CONSTANCE_CONFIG = OrderedDict(
                 "clearable_file",
             ),
         ),
+        (
+            "HARBOR_TRANSPORT",
+            (
+                "wav",
+                "Format the harbor streams in to the upstream servers' Liquidsoap processes. FLAC uses less bandwidth "
+                "(useful when they run on another host) at the cost of a little CPU to encode and decode it.",
+                "harbor_transport_choices",
+            ),
+        ),
         ("AUTODJ_ENABLED", (True, "Whether or not to run an AutoDJ on the harbor.")),
         (
             "AUTODJ_REQUESTS",
@@ -467,6 +493,7 @@ CONSTANCE_CONFIG_FIELDSETS = OrderedDict(
                 "HARBOR_TRANSITION_SECONDS",
                 "HARBOR_MAX_SECONDS_SILENCE_BEFORE_INVACTIVE",
                 "HARBOR_FAILSAFE_AUDIO_FILE",
+                "HARBOR_TRANSPORT",
                 "UPSTREAM_FAILSAFE_AUDIO_FILE",
             ),
         ),
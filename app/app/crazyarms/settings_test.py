@@ -1,5 +1,7 @@
 # flake8: noqa
 
+import os
+
 import fakeredis
 
 from django_redis.pool import ConnectionFactory
@@ -27,13 +29,17 @@ CACHES = {
     }
 }
 
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": ":memory:",
+# Postgres only features (partitioning, trigram search) are tested if given a database, ie
+# TEST_DATABASE_URL=postgres://postgres:postgres@db/postgres
+if os.environ.get("TEST_DATABASE_URL"):
+    DATABASES = {"default": {**env.db("TEST_DATABASE_URL"), "OPTIONS": DATABASES["default"]["OPTIONS"]}}
+else:
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": ":memory:",
+        }
     }
-}
-
 
 HUEY["immediate"] = True
 del HUEY["connection"]
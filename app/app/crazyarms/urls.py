@@ -3,10 +3,13 @@ from django.contrib import admin
 from django.urls import include, path, re_path
 from django.views.static import serve
 
+from api.views import MetricsView
+
 urlpatterns = [
     path("", include("webui.urls")),
     path("api/", include("api.urls")),
     path("admin/", admin.site.urls),
+    path("metrics", MetricsView.as_view(), name="metrics"),
 ]
 
 if settings.DEBUG:
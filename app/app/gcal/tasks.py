@@ -8,6 +8,8 @@ from django.utils import timezone
 from constance import config
 from huey.contrib import djhuey
 
+from common import metrics
+from common.models import User
 from common.tasks import once_at_startup
 from crazyarms import constants
 
@@ -22,7 +24,8 @@ def sync_gcal_api():
     if config.GOOGLE_CALENDAR_ENABLED:
         logger.info("Synchronizing with Google Calendar API")
         try:
-            GCalShow.sync_api()
+            with metrics.gcal_sync_seconds.time():
+                GCalShow.sync_api()
         except Exception:
             cache.set(
                 constants.CACHE_KEY_GCAL_LAST_SYNC,
@@ -32,5 +35,6 @@ def sync_gcal_api():
             raise
         else:
             cache.set(constants.CACHE_KEY_GCAL_LAST_SYNC, timezone.now(), timeout=None)
+            User.update_all_harbor_auth_records()
     else:
         logger.info("Synchronization with Google Calendar API disabled by config")
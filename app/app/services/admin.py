@@ -1,3 +1,4 @@
+from collections import defaultdict
 import datetime
 
 import pytz
@@ -5,22 +6,29 @@ import pytz
 from django.conf import settings
 from django.contrib import admin, messages
 from django.contrib.admin.templatetags.admin_list import _boolean_icon
+from django.contrib.admin.views.main import SEARCH_VAR
 from django.contrib.auth.mixins import PermissionRequiredMixin
 from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connection
 from django.template.loader import render_to_string
 from django.urls import reverse_lazy
 from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.utils.functional import cached_property
 from django.utils.html import format_html
 from django.utils.safestring import mark_safe
-from django.views.generic import FormView
+from django.views.generic import FormView, TemplateView
 
 from constance import config
 
+from autodj.models import AudioAsset
 from crazyarms import constants
 
 from .forms import HarborCustomConfigForm
-from .liquidsoap import upstream
+from .health import clear_services_status, get_upstream_status
 from .models import PlayoutLogEntry, UpstreamServer
+from .play_counts import get_asset_plays, get_source_plays
 from .services import HarborService, init_services
 
 
@@ -53,8 +61,15 @@ class HarborCustomConfigAdminView(admin.site.AdminBaseContextMixin, PermissionRe
 
         else:
             cache.set(constants.CACHE_KEY_HARBOR_CONFIG_CONTEXT, custom_config, timeout=None)
-            init_services(services="harbor", subservices="harbor")
-            messages.success(self.request, "Liquidsoap source code changed. Harbor was restarted.")
+            changes = init_services(services="harbor")["harbor"]
+            if changes.restart:
+                messages.success(self.request, "Liquidsoap source code changed. Harbor was restarted.")
+            else:
+                messages.warning(
+                    self.request,
+                    "Liquidsoap source code changed, but the harbor's rendered config didn't. Harbor was not"
+                    " restarted.",
+                )
 
         return super().form_valid(form)
 
@@ -78,7 +93,8 @@ class UpstreamServerAdmin(admin.ModelAdmin):
     def is_online(self, obj):
         connected = False
         message = "Error: upstream failed to start (see upstream logs)"
-        status = upstream(obj).status(safe=True, as_dict=True)
+        # Statuses of all upstreams are fetched at once and cached briefly, rather than serially for each row
+        status = (get_upstream_status(obj) or {}).get("status")
         if status:
             connected = status["online"]
             if connected:
@@ -109,26 +125,89 @@ class UpstreamServerAdmin(admin.ModelAdmin):
 
     def save_model(self, request, obj, form, change):
         saved = super().save_model(request, obj, form, change)
-        init_services("upstream", subservices=obj.name)
+        init_services("upstream")  # Restarts obj's upstream, only if its config changed
+        clear_services_status()
         return saved
 
     def delete_model(self, request, obj):
         deleted = super().delete_model(request, obj)
         init_services("upstream", restart_services=False)
+        clear_services_status()
         return deleted
 
     def delete_queryset(self, request, queryset):
         deleted = super().delete_queryset(request, queryset)
         init_services("upstream", restart_services=False)
+        clear_services_status()
         return deleted
 
 
+@admin.site.register_view(route="play-counts/", title="Play counts")
+class PlayCountsAdminView(admin.site.AdminBaseContextMixin, PermissionRequiredMixin, TemplateView):
+    NUM_TOP = 50
+    template_name = "admin/services/play_counts.html"
+    permission_required = "services.view_playoutlogentry"
+
+    def get_context_data(self, **kwargs):
+        # Defaults to this month so far
+        today = timezone.localdate()
+        start = parse_date(self.request.GET.get("start", "")) or today.replace(day=1)
+        end = parse_date(self.request.GET.get("end", "")) or today
+        end_exclusive = end + datetime.timedelta(days=1)
+
+        asset_plays = get_asset_plays(start, end_exclusive)
+        top_asset_ids = sorted(asset_plays, key=lambda asset_id: -asset_plays[asset_id])[: self.NUM_TOP]
+        assets = AudioAsset.objects.in_bulk(asset_plays.keys())
+        artist_plays = defaultdict(int)
+        for asset_id, plays in asset_plays.items():
+            if asset_id in assets and assets[asset_id].artist:
+                artist_plays[assets[asset_id].artist] += plays
+
+        return super().get_context_data(
+            **kwargs,
+            start=start,
+            end=end,
+            NUM_TOP=self.NUM_TOP,
+            top_tracks=[(asset_id, assets.get(asset_id), asset_plays[asset_id]) for asset_id in top_asset_ids],
+            top_artists=sorted(artist_plays.items(), key=lambda item: (-item[1], item[0]))[: self.NUM_TOP],
+            source_plays=get_source_plays(start, end_exclusive),
+        )
+
+
+class CappedCountPaginator(Paginator):
+    MAX_COUNT = 10000
+
+    @cached_property
+    def count(self):
+        # Counting millions of log entries is slow, so stop at MAX_COUNT (only the pages up to it are linked to)
+        return self.object_list[: self.MAX_COUNT].count()
+
+
 class PlayoutLogEntryAdmin(admin.ModelAdmin):
+    paginator = CappedCountPaginator
+    show_full_result_count = False
     list_display = ("created", "event_type", "description", "active_source")
-    search_fields = ("description", "active_source")
+    # Active sources by exact match, so searches can use their index
+    search_fields = ("description", "=active_source")
     list_filter = ("event_type", "active_source")
     date_hierarchy = "created"
 
+    def is_ranked_search(self, request):
+        return bool(request.GET.get(SEARCH_VAR, "").strip()) and connection.vendor == "postgresql"
+
+    def get_ordering(self, request):
+        # The changelist orders by this before the queryset's own ordering, so best matches wouldn't come first
+        if self.is_ranked_search(request):
+            return ("-rank", "-created", "-id")
+        return super().get_ordering(request)
+
+    def get_search_results(self, request, queryset, search_term):
+        if search_term and connection.vendor == "postgresql":
+            # Descriptions using their trigram index rather than a substring match against every entry, ranked ahead
+            # of entries matched by active source (case sensitive, so it can use that index too)
+            return queryset.search(search_term) | queryset.filter(active_source=search_term), False
+        return super().get_search_results(request, queryset, search_term)
+
     def has_add_permission(self, request):
         return False
 
@@ -0,0 +1,120 @@
+import csv
+import datetime
+import json
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import PlayoutLogEntry
+
+EXPORT_FORMATS = {"csv": "text/csv", "jsonl": "application/x-ndjson"}
+EXPORT_COLUMNS = (
+    "created",
+    "event_type",
+    "description",
+    "active_source",
+    "asset_type",
+    "asset_id",
+    "artist",
+    "title",
+    "album",
+    "duration",
+    "user",
+)
+# Rows fetched from the database at a time, with a server-side cursor on Postgres
+EXPORT_CHUNK_SIZE = 2000
+
+
+def parse_date_or_datetime(value):
+    """Parse a date (midnight) or datetime, in the current timezone if it doesn't have one. Returns None if invalid."""
+    parsed = parse_datetime(value)
+    if parsed is None:
+        date = parse_date(value)
+        if date is None:
+            return None
+        parsed = datetime.datetime.combine(date, datetime.time())
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def get_export_queryset(start=None, end=None, event_types=()):
+    queryset = PlayoutLogEntry.objects.order_by("created", "id")
+    if start:
+        queryset = queryset.filter(created__gte=start)
+    if end:
+        queryset = queryset.filter(created__lt=end)
+    if event_types:
+        queryset = queryset.filter(event_type__in=event_types)
+
+    # Plain values (joined in one query) rather than model instances, so rows are cheap to build
+    return queryset.values(
+        "created",
+        "event_type",
+        "description",
+        "active_source",
+        "audio_asset_id",
+        "audio_asset__artist",
+        "audio_asset__title",
+        "audio_asset__album",
+        "audio_asset__duration",
+        "rotator_asset_id",
+        "rotator_asset__title",
+        "rotator_asset__duration",
+        "broadcast_asset_id",
+        "broadcast_asset__title",
+        "broadcast_asset__duration",
+        "user__username",
+    )
+
+
+def iter_export_rows(queryset):
+    """Yields a dict for each log entry with EXPORT_COLUMNS as keys, streamed from the database"""
+    for values in queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        row = {
+            "created": timezone.localtime(values["created"]).isoformat(),
+            "event_type": values["event_type"],
+            "description": values["description"],
+            "active_source": values["active_source"],
+            "asset_type": None,
+            "asset_id": None,
+            "artist": None,
+            "title": None,
+            "album": None,
+            "duration": None,
+            "user": values["user__username"],
+        }
+        for asset_type in ("audio", "rotator", "broadcast"):
+            if values[f"{asset_type}_asset_id"] is not None:
+                duration = values[f"{asset_type}_asset__duration"]
+                row.update(
+                    {
+                        "asset_type": asset_type,
+                        "asset_id": values[f"{asset_type}_asset_id"],
+                        "artist": values.get(f"{asset_type}_asset__artist"),
+                        "title": values[f"{asset_type}_asset__title"],
+                        "album": values.get(f"{asset_type}_asset__album"),
+                        "duration": None if duration is None else round(duration.total_seconds(), 3),
+                    }
+                )
+                break
+        yield row
+
+
+class _Echo:
+    """File-like object that returns what's written, so csv.writer() can produce lines one at a time"""
+
+    def write(self, value):
+        return value
+
+
+def iter_export_lines(queryset, format="csv"):
+    rows = iter_export_rows(queryset)
+    if format == "csv":
+        writer = csv.writer(_Echo())
+        yield writer.writerow(EXPORT_COLUMNS)
+        for row in rows:
+            yield writer.writerow(["" if row[column] is None else row[column] for column in EXPORT_COLUMNS])
+    else:
+        for row in rows:
+            yield f"{json.dumps(row)}\n"
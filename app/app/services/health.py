@@ -0,0 +1,69 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+
+import requests
+
+from django.core.cache import cache
+
+from crazyarms import constants
+
+from .liquidsoap import upstream
+from .models import UpstreamServer
+
+logger = logging.getLogger(f"crazyarms.{__name__}")
+
+HEALTHCHECK_TIMEOUT = 5  # in seconds
+SERVICES_STATUS_CACHE_TIMEOUT = 10
+SERVICES_STATUS_MAX_WORKERS = 16
+
+
+def ping(service, port):
+    try:
+        response = requests.get(f"http://{service}:{port}/ping", timeout=HEALTHCHECK_TIMEOUT)
+    except Exception:
+        logger.exception(f"{service} on port {port} healthcheck threw exception")
+        return False
+    return response.status_code == 200 and response.text == "pong"
+
+
+def upstream_status(upstream_server):
+    return upstream(upstream_server).status(safe=True, as_dict=True, timeout=HEALTHCHECK_TIMEOUT)
+
+
+def collect_services_status():
+    """Healthcheck the harbor and every upstream (and get upstream statuses over telnet) all at once, rather than one
+    at a time, since a dead service takes a full timeout. Returns a dict keyed by (service, subservice)."""
+    upstream_servers = list(UpstreamServer.objects.all())
+
+    with ThreadPoolExecutor(max_workers=SERVICES_STATUS_MAX_WORKERS) as executor:
+        harbor_healthy = executor.submit(ping, "harbor", 8001)
+        upstreams_healthy = {u.name: executor.submit(ping, "upstream", u.healthcheck_port) for u in upstream_servers}
+        upstream_statuses = {u.name: executor.submit(upstream_status, u) for u in upstream_servers}
+
+        services_status = {("harbor", "harbor"): {"healthy": harbor_healthy.result(), "status": None}}
+        for upstream_server in upstream_servers:
+            services_status[("upstream", upstream_server.name)] = {
+                "healthy": upstreams_healthy[upstream_server.name].result(),
+                "status": upstream_statuses[upstream_server.name].result(),
+            }
+
+    cache.set(constants.CACHE_KEY_SERVICES_STATUS, services_status, timeout=SERVICES_STATUS_CACHE_TIMEOUT)
+    return services_status
+
+
+def get_services_status(force=False):
+    services_status = None if force else cache.get(constants.CACHE_KEY_SERVICES_STATUS)
+    if services_status is None:
+        services_status = collect_services_status()
+    return services_status
+
+
+def get_upstream_status(upstream_server):
+    status = get_services_status().get(("upstream", upstream_server.name))
+    if status is None:  # Added since the last collection
+        status = get_services_status(force=True).get(("upstream", upstream_server.name))
+    return status
+
+
+def clear_services_status():
+    cache.delete(constants.CACHE_KEY_SERVICES_STATUS)
@@ -1,9 +1,23 @@
+import asyncio
+from collections import deque
 import json
 import logging
-from telnetlib import Telnet
-from threading import Lock
+import random
+import socket
+import threading
+import time
+import weakref
 
-END_PREFIX = b"\r\nEND\r\n"
+from django.core.cache import cache
+
+from common import metrics
+from crazyarms import constants
+
+END_MARKER = b"\r\nEND\r\n"
+TIMED_OUT_MARKER = b"Connection timed out.. Bye!\r\n"
+READ_LIMIT = 2 ** 20
+# Harbor pushes its status on every change and as a heartbeat every 10 seconds
+HARBOR_STATUS_MAX_AGE = 30
 
 logger = logging.getLogger(f"crazyarms.{__name__}")
 
@@ -12,17 +26,98 @@ class LiquidsoapTelnetException(Exception):
     pass
 
 
+class _Connection:
+    def __init__(self, host, port, timeout):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.buffer = b""
+        self.last_used = time.monotonic()
+
+    def send(self, payload, deadline):
+        self.sock.settimeout(max(deadline - time.monotonic(), 0.001))
+        self.sock.sendall(payload)
+
+    def read_response(self, deadline):
+        while True:
+            end = self.buffer.find(END_MARKER)
+            if end != -1:
+                response, self.buffer = self.buffer[:end], self.buffer[end + len(END_MARKER) :]
+                return response
+            elif self.buffer.endswith(TIMED_OUT_MARKER):
+                raise ConnectionError("Connection timed out by Liquidsoap")
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise socket.timeout("Deadline exceeded")
+            self.sock.settimeout(remaining)
+            data = self.sock.recv(65536)
+            if not data:
+                raise ConnectionError("Connection closed by Liquidsoap")
+            self.buffer += data
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class _AsyncConnection:
+    def __init__(self, reader, writer):
+        self.reader, self.writer = reader, writer
+        self.last_used = time.monotonic()
+
+    @classmethod
+    async def open(cls, host, port, deadline):
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, limit=READ_LIMIT), deadline - time.monotonic()
+        )
+        return cls(reader, writer)
+
+    async def send(self, payload, deadline):
+        self.writer.write(payload)
+        await asyncio.wait_for(self.writer.drain(), max(deadline - time.monotonic(), 0.001))
+
+    async def read_response(self, deadline):
+        try:
+            response = await asyncio.wait_for(self.reader.readuntil(END_MARKER), deadline - time.monotonic())
+        except asyncio.IncompleteReadError:
+            raise ConnectionError("Connection closed by Liquidsoap")
+        return response.removesuffix(END_MARKER)
+
+    def close(self):
+        self.writer.close()
+
+
+class _Waiter:
+    __slots__ = ("event", "conn")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.conn = None
+
+
 class _Liquidsoap:
+    """Liquidsoap telnet client with a small connection pool. Commands can be pipelined with execute_many(), have a
+    deadline (rather than a timeout per socket operation), and are retried with backoff after connection errors."""
+
     MAX_TRIES = 3
+    POOL_SIZE = 4
+    # Liquidsoap closes idle connections (server.timeout defaults to 30s), so don't reuse ones that are close to it
+    IDLE_TIMEOUT = 20
+    DEFAULT_TIMEOUT = 5
+    BACKOFF_BASE = 0.1
 
-    def __init__(self, host="harbor", port=1234):
-        self._telnet = None
-        # Since huey runs as threaded, let's make sure only one thread actually talks to
-        # the telnet connection at a given time.
-        self._access_lock = Lock()
+    def __init__(self, host="harbor", port=1234, pool_size=POOL_SIZE):
         self._version = None
         self.host = host
         self.port = port
+        self.pool_size = pool_size
+        self._lock = threading.Lock()
+        self._idle = deque()
+        self._waiters = deque()
+        self._num_connections = 0  # Idle, in use, or being opened
+        self._async_pools = weakref.WeakKeyDictionary()  # event loop => (idle connections, semaphore)
 
     @property
     def version(self):
@@ -33,31 +128,147 @@ class _Liquidsoap:
                 return "unknown"
         return self._version
 
-    def execute(self, command, arg=None, splitlines=False, safe=False, as_dict=False):
-        if arg is not None:
-            command += f" {arg}"
-        command = f"{command}\n".encode("utf-8")
+    def _backoff(self, try_number, deadline):
+        delay = self.BACKOFF_BASE * 2 ** try_number * random.uniform(0.5, 1.5)
+        return min(delay, max(deadline - time.monotonic(), 0))
+
+    def _pop_idle(self, idle):
+        while idle:
+            try:
+                conn = idle.pop()
+            except IndexError:
+                break
+            if time.monotonic() - conn.last_used < self.IDLE_TIMEOUT:
+                return conn
+            conn.close()
+        return None
+
+    def _observe(self, timings):
+        for command, duration, status in timings:
+            metrics.liquidsoap_telnet_seconds.observe(
+                duration, host=self.host, port=self.port, command=command.split(" ", 1)[0], status=status
+            )
 
-        with self._access_lock:
-            for try_number in range(self.MAX_TRIES):  # Try three times before giving up
+    def _checkout(self, deadline):
+        """Returns an idle connection, or None if the caller should open a new one. When the pool is exhausted, callers
+        wait their turn and connections are handed off to them first come, first served."""
+        with self._lock:
+            if not self._waiters:
+                if self._idle:
+                    return self._idle.pop()
+                if self._num_connections < self.pool_size:
+                    self._num_connections += 1
+                    return None
+            waiter = _Waiter()
+            self._waiters.append(waiter)
+
+        if not waiter.event.wait(timeout=max(deadline - time.monotonic(), 0)):
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                    raise socket.timeout("Deadline exceeded waiting for a free connection")
+        return waiter.conn
+
+    def _checkin(self, conn, ok):
+        if conn is not None and not ok:
+            conn.close()
+            conn = None
+
+        with self._lock:
+            if conn is not None:
+                conn.last_used = time.monotonic()
+            if self._waiters:
+                waiter = self._waiters.popleft()
+                waiter.conn = conn
+                waiter.event.set()
+            elif conn is not None:
+                self._idle.append(conn)
+            else:
+                self._num_connections -= 1
+
+    def _connect(self, deadline):
+        conn = self._checkout(deadline)
+        if conn is not None and time.monotonic() - conn.last_used >= self.IDLE_TIMEOUT:
+            conn.close()
+            conn = None
+        if conn is None:
+            try:
+                conn = _Connection(self.host, self.port, timeout=max(deadline - time.monotonic(), 0.001))
+            except Exception:
+                self._checkin(None, ok=False)
+                raise
+        return conn
+
+    def execute_many(self, commands, timeout=None):
+        """Send commands pipelined over one connection and return their raw responses in order. After a connection
+        error, only commands that weren't answered yet are retried."""
+        start = time.monotonic()
+        deadline = start + (timeout or self.DEFAULT_TIMEOUT)
+        responses, remaining, timings = [], list(commands), []
+
+        try:
+            for try_number in range(self.MAX_TRIES):
+                conn = None
                 try:
-                    if self._telnet is None:
-                        self._telnet = Telnet(host=self.host, port=self.port, timeout=5)
-
-                    self._telnet.write(command)
-                    response = self._telnet.read_until(END_PREFIX)
-                    if response.endswith(b"Connection timed out.. Bye!\r\n"):
-                        raise Exception("Connection timed out error")
-                    break
+                    conn = self._connect(deadline)
+                    conn.send(b"".join(f"{command}\n".encode("utf-8") for command in remaining), deadline)
+                    while remaining:
+                        responses.append(conn.read_response(deadline).decode("utf-8"))
+                        timings.append((remaining.pop(0), time.monotonic() - start, "success"))
                 except Exception as e:
-                    self._telnet = None
-                    if try_number >= self.MAX_TRIES - 1:
-                        if safe:
-                            return None
-                        else:
-                            raise LiquidsoapTelnetException(str(e))
-
-        response = response.removesuffix(END_PREFIX).decode("utf-8").splitlines()
+                    if conn is not None:
+                        self._checkin(conn, ok=False)
+                    if try_number >= self.MAX_TRIES - 1 or time.monotonic() >= deadline:
+                        timings.extend((command, time.monotonic() - start, "error") for command in remaining)
+                        raise LiquidsoapTelnetException(str(e))
+                    time.sleep(self._backoff(try_number, deadline))
+                else:
+                    self._checkin(conn, ok=True)
+                    return responses
+        finally:
+            self._observe(timings)
+
+    async def aexecute_many(self, commands, timeout=None):
+        """Asynchronous version of execute_many(), with a separate connection pool for each event loop"""
+        start = time.monotonic()
+        deadline = start + (timeout or self.DEFAULT_TIMEOUT)
+        responses, remaining, timings = [], list(commands), []
+
+        loop = asyncio.get_running_loop()
+        if loop not in self._async_pools:
+            self._async_pools[loop] = (deque(), asyncio.Semaphore(self.pool_size))
+        idle, semaphore = self._async_pools[loop]
+
+        try:
+            for try_number in range(self.MAX_TRIES):
+                conn = None
+                try:
+                    async with semaphore:
+                        conn = self._pop_idle(idle) or await _AsyncConnection.open(self.host, self.port, deadline)
+                        await conn.send(b"".join(f"{command}\n".encode("utf-8") for command in remaining), deadline)
+                        while remaining:
+                            responses.append((await conn.read_response(deadline)).decode("utf-8"))
+                            timings.append((remaining.pop(0), time.monotonic() - start, "success"))
+                        conn.last_used = time.monotonic()
+                        idle.append(conn)
+                        return responses
+                except Exception as e:
+                    if conn is not None:
+                        conn.close()
+                    if try_number >= self.MAX_TRIES - 1 or time.monotonic() >= deadline:
+                        timings.extend((command, time.monotonic() - start, "error") for command in remaining)
+                        raise LiquidsoapTelnetException(str(e))
+                    await asyncio.sleep(self._backoff(try_number, deadline))
+        finally:
+            self._observe(timings)
+
+    @staticmethod
+    def _make_command(command, arg=None):
+        return command if arg is None else f"{command} {arg}"
+
+    @staticmethod
+    def _parse_response(response, splitlines=False, safe=False, as_dict=False):
+        response = response.splitlines()
         if as_dict or not splitlines:
             response = "\n".join(response)
             if as_dict:
@@ -72,6 +283,24 @@ class _Liquidsoap:
 
         return response
 
+    def execute(self, command, arg=None, splitlines=False, safe=False, as_dict=False, timeout=None):
+        try:
+            (response,) = self.execute_many([self._make_command(command, arg)], timeout=timeout)
+        except LiquidsoapTelnetException:
+            if safe:
+                return None
+            raise
+        return self._parse_response(response, splitlines=splitlines, safe=safe, as_dict=as_dict)
+
+    async def aexecute(self, command, arg=None, splitlines=False, safe=False, as_dict=False, timeout=None):
+        try:
+            (response,) = await self.aexecute_many([self._make_command(command, arg)], timeout=timeout)
+        except LiquidsoapTelnetException:
+            if safe:
+                return None
+            raise
+        return self._parse_response(response, splitlines=splitlines, safe=safe, as_dict=as_dict)
+
     def __getattr__(self, command):
         command = command.replace("__", ".")
         return lambda arg=None, **kwargs: self.execute(command=command, arg=arg, **kwargs)
@@ -91,3 +320,21 @@ class _UpstreamGetter:
 
 harbor = _Liquidsoap()
 upstream = _UpstreamGetter()
+
+
+def set_harbor_status(status):
+    cache.set(constants.CACHE_KEY_HARBOR_STATUS, (time.time(), status), timeout=None)
+
+
+def get_harbor_status(max_age=HARBOR_STATUS_MAX_AGE):
+    """Latest status snapshot pushed by the harbor, only asking it over telnet if the snapshot is stale"""
+    snapshot = cache.get(constants.CACHE_KEY_HARBOR_STATUS)
+    if snapshot is not None:
+        updated, status = snapshot
+        if time.time() - updated <= max_age:
+            return status
+
+    status = harbor.status(safe=True, as_dict=True)
+    if status is not None:
+        set_harbor_status(status)
+    return status
@@ -0,0 +1,133 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import socket
+import socketserver
+import statistics
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+from services.liquidsoap import _Liquidsoap
+
+
+class FakeLiquidsoapTelnetHandler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def handle(self):
+        for line in self.rfile:
+            command = line.decode("utf-8").strip()
+            if command == "quit":
+                self.wfile.write(b"Bye!\r\n")
+                break
+            if self.server.delay:
+                time.sleep(self.server.delay)
+            self.wfile.write(f"{self.server.responses.get(command, command)}\r\nEND\r\n".encode("utf-8"))
+
+
+class FakeLiquidsoapTelnetServer(socketserver.ThreadingTCPServer):
+    """Local stand-in for Liquidsoap's telnet server, that answers commands in order on each connection with a
+    canned response (or echoes the command back) after an optional delay"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, responses=None, delay=0.0, host="127.0.0.1", port=0):
+        super().__init__((host, port), FakeLiquidsoapTelnetHandler)
+        self.responses = responses or {}
+        self.delay = delay
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+class BenchmarkLiquidsoap(_Liquidsoap):
+    def _observe(self, timings):
+        pass  # Only measure the client
+
+
+class Command(BaseCommand):
+    help = "Benchmark the Liquidsoap telnet client against a local fake telnet server"
+
+    def add_arguments(self, parser):
+        parser.add_argument("-n", "--commands", type=int, default=2000, help="Commands per run (default: 2000)")
+        parser.add_argument("-c", "--concurrency", type=int, default=16, help="Concurrent callers (default: 16)")
+        parser.add_argument(
+            "-d",
+            "--delay",
+            type=float,
+            default=0.001,
+            help="Seconds the fake server takes to answer each command (default: 0.001)",
+        )
+        parser.add_argument(
+            "-b", "--batch-size", type=int, default=10, help="Commands per pipelined batch (default: 10)"
+        )
+
+    def report(self, name, num_commands, elapsed, latencies):
+        latencies = sorted(latency * 1000 for latency in latencies)
+        p50, p99 = (statistics.quantiles(latencies, n=100)[p - 1] for p in (50, 99))
+        self.stdout.write(f"{name:<40} {num_commands / elapsed:>9.0f} commands/s   p50={p50:.2f}ms p99={p99:.2f}ms")
+
+    def run_threaded(self, liquidsoap, num_commands, concurrency, batch_size=None):
+        def run(num):
+            start = time.monotonic()
+            if batch_size:
+                liquidsoap.execute_many([f"command.{num}.{i}" for i in range(batch_size)])
+            else:
+                liquidsoap.execute(f"command.{num}")
+            return time.monotonic() - start
+
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            latencies = list(executor.map(run, range(num_commands // (batch_size or 1))))
+        return time.monotonic() - start, latencies
+
+    async def run_async(self, liquidsoap, num_commands, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run(num):
+            async with semaphore:
+                start = time.monotonic()
+                await liquidsoap.aexecute(f"command.{num}")
+                return time.monotonic() - start
+
+        start = time.monotonic()
+        latencies = await asyncio.gather(*(run(num) for num in range(num_commands)))
+        return time.monotonic() - start, latencies
+
+    def handle(self, *args, **options):
+        num_commands, concurrency, batch_size = options["commands"], options["concurrency"], options["batch_size"]
+
+        with FakeLiquidsoapTelnetServer(delay=options["delay"]) as server:
+            host, port = server.server_address
+            self.stdout.write(
+                f"Running {num_commands} commands with {concurrency} concurrent callers against a fake telnet server"
+                f" answering in {options['delay'] * 1000:g}ms..."
+            )
+
+            # Equivalent to the previous client: a single connection that every caller waits on
+            single = BenchmarkLiquidsoap(host=host, port=port, pool_size=1)
+            self.report("single connection", num_commands, *self.run_threaded(single, num_commands, concurrency))
+
+            pooled = BenchmarkLiquidsoap(host=host, port=port)
+            self.report(
+                f"pool of {pooled.pool_size}", num_commands, *self.run_threaded(pooled, num_commands, concurrency)
+            )
+            self.report(
+                f"pool of {pooled.pool_size}, pipelined x{batch_size} (per batch)",
+                num_commands,
+                *self.run_threaded(pooled, num_commands, concurrency, batch_size=batch_size),
+            )
+            self.report(
+                f"pool of {pooled.pool_size}, asyncio",
+                num_commands,
+                *asyncio.run(self.run_async(pooled, num_commands, concurrency)),
+            )
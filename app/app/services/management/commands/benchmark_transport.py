@@ -0,0 +1,98 @@
+import os
+import shlex
+import signal
+import subprocess
+import tempfile
+import time
+import urllib.request
+
+from django.core.management.base import BaseCommand, CommandError
+
+# Same encoders as services/templates/services/harbor.liq
+TRANSPORTS = {
+    "wav": ("live", "%wav(duration=0., stereo=true, channels=2, samplesize=16, header=true)"),
+    "flac": ("live.flac", "%flac(channels=2, samplerate=44100, bits_per_sample=16, compression=5)"),
+    "ogg-flac": ("live.ogg", "%ogg(%flac(channels=2, samplerate=44100, bits_per_sample=16, compression=5))"),
+}
+
+HARBOR_SCRIPT = """
+set('log.stdout', false)
+set('harbor.bind_addrs', ['127.0.0.1'])
+output.harbor({encoder}, port={port}, mount='{mount}', mksafe(playlist(mode='random', {audio_file})))
+"""
+
+UPSTREAM_SCRIPT = """
+set('log.stdout', false)
+output.dummy(input.http(buffer=5., max=10., poll_delay=0.5, 'http://127.0.0.1:{port}/{mount}'), fallible=true)
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare bandwidth and CPU usage of the harbor to upstream transports (WAVE, FLAC and Ogg/FLAC) with real "
+        "audio (needs Liquidsoap, ie run it in the harbor or upstream container)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("audio_file", help="Audio file or directory to stream, ideally representative music")
+        parser.add_argument("-s", "--seconds", type=int, default=30, help="Seconds to measure each one (default: 30)")
+        parser.add_argument("-p", "--port", type=int, default=4100, help="Port for the harbor (default: 4100)")
+        parser.add_argument("--liquidsoap", default="liquidsoap", help="Liquidsoap command (default: liquidsoap)")
+
+    def spawn(self, script, directory, name):
+        filename = f"{directory}/{name}.liq"
+        with open(filename, "w") as script_file:
+            script_file.write(script)
+        return subprocess.Popen([*shlex.split(self.liquidsoap), filename], stdout=subprocess.DEVNULL)
+
+    def stop(self, process):
+        """Stop a process, returning the CPU time it used (or None if it had already exited)"""
+        if process.poll() is not None:
+            return None
+        process.send_signal(signal.SIGINT)
+        _, _, rusage = os.wait4(process.pid, 0)
+        process.returncode = 0
+        return rusage.ru_utime + rusage.ru_stime
+
+    def measure_bandwidth(self, url, seconds):
+        # Skip the initial burst, then count bytes over the measuring period
+        with urllib.request.urlopen(url, timeout=10) as response:
+            start = time.monotonic()
+            while time.monotonic() - start < 3:
+                response.read(4096)
+
+            num_bytes, start = 0, time.monotonic()
+            while time.monotonic() - start < seconds:
+                num_bytes += len(response.read(4096))
+            return num_bytes * 8 / 1000 / (time.monotonic() - start)
+
+    def handle(self, *args, **options):
+        self.liquidsoap = options["liquidsoap"]
+        seconds, port = options["seconds"], options["port"]
+        audio_file = os.path.abspath(options["audio_file"])
+
+        self.stdout.write(f"Streaming {audio_file} for {seconds}s per transport...")
+        with tempfile.TemporaryDirectory() as directory:
+            for transport, (mount, encoder) in TRANSPORTS.items():
+                harbor = self.spawn(
+                    HARBOR_SCRIPT.format(encoder=encoder, port=port, mount=mount, audio_file=repr(audio_file)),
+                    directory,
+                    f"harbor-{transport}",
+                )
+                time.sleep(3)  # Wait for the harbor to come up
+                upstream = self.spawn(
+                    UPSTREAM_SCRIPT.format(port=port, mount=mount), directory, f"upstream-{transport}"
+                )
+
+                try:
+                    kbits = self.measure_bandwidth(f"http://127.0.0.1:{port}/{mount}", seconds)
+                finally:
+                    # Both processes ran for the same time, so compare their total CPU time
+                    upstream_cpu, harbor_cpu = self.stop(upstream), self.stop(harbor)
+                if upstream_cpu is None or harbor_cpu is None:
+                    raise CommandError(f"Liquidsoap exited early streaming {transport}, check its output")
+
+                self.stdout.write(
+                    f"{transport:<10} {kbits:>8.0f} kbit/s   harbor {harbor_cpu:>6.2f}s CPU"
+                    f"   upstream {upstream_cpu:>6.2f}s CPU"
+                )
@@ -0,0 +1,41 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from services.export import EXPORT_FORMATS, get_export_queryset, iter_export_lines, parse_date_or_datetime
+from services.models import PlayoutLogEntry
+
+
+class Command(BaseCommand):
+    help = "Export playout log entries with their assets (ie for music licensing reports) as CSV or JSON Lines"
+
+    def add_arguments(self, parser):
+        parser.add_argument("start", nargs="?", help="start date or datetime (inclusive), eg 2021-01-01")
+        parser.add_argument("end", nargs="?", help="end date or datetime (exclusive), eg 2021-04-01")
+        parser.add_argument(
+            "-t",
+            "--event-type",
+            action="append",
+            choices=PlayoutLogEntry.EventType.values,
+            dest="event_types",
+            help="only export entries of this type (can be repeated, default: all)",
+        )
+        parser.add_argument(
+            "-f", "--format", choices=EXPORT_FORMATS, default="csv", help="output format (default: csv)"
+        )
+        parser.add_argument("-o", "--output", help="file to write to (default: stdout)")
+
+    def handle(self, *args, **options):
+        start, end = (parse_date_or_datetime(options[arg]) if options[arg] else None for arg in ("start", "end"))
+        for arg, value in (("start", start), ("end", end)):
+            if options[arg] and value is None:
+                raise CommandError(f"Invalid {arg} date or datetime: {options[arg]!r}")
+
+        queryset = get_export_queryset(start, end, options["event_types"])
+        output = open(options["output"], "w", newline="") if options["output"] else sys.stdout
+        try:
+            for line in iter_export_lines(queryset, options["format"]):
+                output.write(line)
+        finally:
+            if options["output"]:
+                output.close()
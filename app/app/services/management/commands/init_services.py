@@ -32,6 +32,12 @@ class Command(BaseCommand):
             action="store_true",
             help="render config files only, don't (re-start services)",
         )
+        parser.add_argument(
+            "-n",
+            "--dry-run",
+            action="store_true",
+            help="show a diff of changed config files and which programs would restart, without changing anything",
+        )
 
     def handle(self, *args, **options):
         if User.objects.exists() or options["force"]:
@@ -40,10 +46,20 @@ class Command(BaseCommand):
             else:
                 self.stdout.write("Initializing services (all)")
 
-            init_services(
+            all_changes = init_services(
                 services=options["services"],
                 restart_services=options["restart"],
                 render_only=options["render_only"],
+                dry_run=options["dry_run"],
             )
+
+            if options["dry_run"]:
+                for service, changes in all_changes.items():
+                    if changes.diff:
+                        self.stdout.write(changes.diff)
+                    self.stdout.write(
+                        f"{service}: {len(changes.changed)} changed and {len(changes.removed)} stale config file(s),"
+                        f' would restart: {", ".join(changes.restart) or "nothing"}'
+                    )
         else:
             self.stdout.write("No users exist, assuming this is the first run and not starting services.")
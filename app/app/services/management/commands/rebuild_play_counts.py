@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from services.play_counts import rebuild_play_counts
+
+
+class Command(BaseCommand):
+    help = "Rebuild play count rollups from the playout log, ie for history from before they existed"
+
+    def add_arguments(self, parser):
+        parser.add_argument("start", nargs="?", help="start date (inclusive, default: the oldest log entry)")
+        parser.add_argument("end", nargs="?", help="end date (exclusive, default: the end of the log)")
+
+    def handle(self, *args, **options):
+        dates = {}
+        for arg in ("start", "end"):
+            dates[arg] = options[arg] and parse_date(options[arg])
+            if options[arg] and dates[arg] is None:
+                raise CommandError(f"Invalid {arg} date: {options[arg]!r}")
+
+        num_asset_play_counts, num_source_play_counts = rebuild_play_counts(**dates)
+        self.stdout.write(
+            f"Rebuilt {num_asset_play_counts} daily asset play counts and {num_source_play_counts} hourly active"
+            " source play counts"
+        )
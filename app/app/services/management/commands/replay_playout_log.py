@@ -0,0 +1,107 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from django_redis import get_redis_connection
+
+from crazyarms.constants import REDIS_KEY_SERVICE_LOGS
+from services.export import parse_date_or_datetime
+from services.models import PlayoutLogEntry
+from services.playout_log import build_log_entries, write_log_entries
+
+# Stream message IDs are the time they were added, a little after the entries in them were created
+MESSAGE_DELAY_MARGIN = datetime.timedelta(minutes=5)
+
+
+def stream_id(dt):
+    return str(int(dt.timestamp() * 1000))
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild playout log entries created in a date range from the Redis stream (only as far back as it's kept), "
+        "adding any that are missing"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("start", help="start date or datetime (inclusive), eg 2021-06-01 or 2021-06-01T12:00")
+        parser.add_argument("end", nargs="?", help="end date or datetime (exclusive, default: now)")
+        parser.add_argument(
+            "--delete",
+            action="store_true",
+            help=(
+                "delete existing entries in the range that came from the stream first, so they're rebuilt entirely "
+                "from it (entries created directly, ie by the web UI, aren't in the stream and are kept)"
+            ),
+        )
+        parser.add_argument("-n", "--dry-run", action="store_true", help="only show how many entries would be written")
+        parser.add_argument("-b", "--batch-size", type=int, default=1000, help="messages per read (default: 1000)")
+
+    def read_messages(self, redis, start, end, batch_size):
+        min_id, max_id = stream_id(start - MESSAGE_DELAY_MARGIN), stream_id(end + MESSAGE_DELAY_MARGIN)
+        while True:
+            messages = redis.xrange(REDIS_KEY_SERVICE_LOGS, min=min_id, max=max_id, count=batch_size)
+            yield from messages
+            if len(messages) < batch_size:
+                break
+            # Continue after the last message read
+            last_ms, last_seq = messages[-1][0].decode().split("-")
+            min_id = f"{last_ms}-{int(last_seq) + 1}"
+
+    def handle(self, *args, **options):
+        redis = get_redis_connection()
+        start = parse_date_or_datetime(options["start"])
+        end = parse_date_or_datetime(options["end"]) if options["end"] else timezone.now()
+        if start is None or end is None:
+            raise CommandError("Invalid start or end date or datetime")
+        if start >= end:
+            raise CommandError("Start must be before end")
+
+        first = redis.xrange(REDIS_KEY_SERVICE_LOGS, count=1)
+        if not first:
+            raise CommandError(f"Redis stream {REDIS_KEY_SERVICE_LOGS} is empty, nothing to replay")
+        first_ms = int(first[0][0].decode().split("-")[0])
+        retained_since = datetime.datetime.fromtimestamp(first_ms / 1000, tz=datetime.timezone.utc)
+        if retained_since > start:
+            self.stderr.write(
+                f"WARNING: the stream only goes back to {timezone.localtime(retained_since)}, entries before then"
+                " can't be replayed"
+            )
+            if options["delete"]:
+                raise CommandError("Refusing to delete entries that can't be replayed, use a later start")
+
+        log_entries = []
+        batch = []
+        for message in self.read_messages(redis, start, end, options["batch_size"]):
+            batch.append(message)
+            if len(batch) >= options["batch_size"]:
+                log_entries.extend(e for e in build_log_entries(batch) if start <= e.created < end)
+                batch = []
+        log_entries.extend(e for e in build_log_entries(batch) if start <= e.created < end)
+
+        # Only entries written from the stream can be rebuilt from it
+        existing = PlayoutLogEntry.objects.filter(created__gte=start, created__lt=end, stream_id__isnull=False)
+        already_written = set(
+            existing.filter(stream_id__in=[e.stream_id for e in log_entries]).values_list("stream_id", flat=True)
+        )
+        if options["delete"]:
+            self.stdout.write(
+                f"{existing.count()} existing entries from the stream between {start} and {end} will be deleted"
+            )
+            already_written = set()
+        missing = [e for e in log_entries if e.stream_id not in already_written]
+
+        self.stdout.write(
+            f"Found {len(log_entries)} entries between {start} and {end} in the stream, {len(missing)} to write"
+        )
+        if options["dry_run"]:
+            return
+
+        with transaction.atomic():
+            if options["delete"]:
+                num_deleted, _ = existing.delete()
+                self.stdout.write(f"Deleted {num_deleted} entries")
+            num_written = write_log_entries(missing) if missing else 0
+        self.stdout.write(f"Wrote {num_written} entries")
@@ -1,55 +1,159 @@
-import datetime
-import json
-import traceback
-
-import pytz
+import os
+import socket
+import time
 
 from django.conf import settings
 from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.db.utils import InterfaceError, OperationalError
 
 from django_redis import get_redis_connection
 
+from common import metrics
 from crazyarms.constants import REDIS_KEY_SERVICE_LOGS
-from services.models import PlayoutLogEntry
+from services.playout_log import (
+    CONSUMER_GROUP,
+    STREAM_MAXLEN,
+    build_log_entries,
+    ensure_consumer_group,
+    write_log_entries,
+)
 
+# Before log entries were a Redis stream, they were LPUSH'd onto a list with this key
+LEGACY_LIST_KEY = "service:logs"
 
-class Command(BaseCommand):
-    help = "Consume And Store Logs Messages From Redis"
 
-    def handle(self, *args, **options):
-        redis = get_redis_connection()
+class Command(BaseCommand):
+    help = "Consume And Store Logs Messages From Redis (several can run at once, sharing the load as a consumer group)"
 
-        self.stdout.write(f"Running log subscriber for redis key {REDIS_KEY_SERVICE_LOGS}...")
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-b",
+            "--batch-size",
+            type=int,
+            default=100,
+            help="maximum number of stream messages (batches of entries) to read and write at once (default: 100)",
+        )
+        parser.add_argument(
+            "--claim-idle-seconds",
+            type=int,
+            default=60,
+            help=(
+                "reclaim messages another subscriber read but didn't acknowledge for this many seconds, ie it died "
+                "or its database write failed (default: 60)"
+            ),
+        )
+        parser.add_argument(
+            "--max-deliveries",
+            type=int,
+            default=5,
+            help="give up on a message after trying to write it this many times (default: 5)",
+        )
+        parser.add_argument(
+            "--report-interval",
+            type=int,
+            default=60,
+            help="how often to report the ingest rate in seconds (default: 60)",
+        )
 
+    def migrate_legacy_list(self):
+        num_migrated = 0
         while True:
-            _, data = redis.brpop(REDIS_KEY_SERVICE_LOGS, timeout=0)
+            data = self.redis.rpop(LEGACY_LIST_KEY)  # Oldest first
+            if data is None:
+                break
+            # Each is a single entry's JSON object, which is also a valid stream message
+            self.redis.xadd(REDIS_KEY_SERVICE_LOGS, {"data": data}, maxlen=STREAM_MAXLEN, approximate=True)
+            num_migrated += 1
+        if num_migrated:
+            self.stdout.write(f"Moved {num_migrated} log entries from legacy list {LEGACY_LIST_KEY} to the stream")
+
+    def delete_idle_consumers(self, idle_ms=60 * 60 * 1000):
+        # Every run is a new consumer, so clean up old ones (with nothing pending, otherwise they get reclaimed first)
+        for consumer in self.redis.xinfo_consumers(REDIS_KEY_SERVICE_LOGS, CONSUMER_GROUP):
+            if consumer["pending"] == 0 and consumer["idle"] >= idle_ms:
+                self.redis.xgroup_delconsumer(REDIS_KEY_SERVICE_LOGS, CONSUMER_GROUP, consumer["name"])
+
+    def reclaim(self):
+        """Claim messages that were read but not acknowledged for too long, giving up on ones tried too many times"""
+        pending = self.redis.xpending_range(REDIS_KEY_SERVICE_LOGS, CONSUMER_GROUP, "-", "+", self.batch_size)
+        stale = [p for p in pending if p["time_since_delivered"] >= self.claim_idle_ms]
+
+        give_up = [p["message_id"] for p in stale if p["times_delivered"] >= self.max_deliveries]
+        if give_up:
+            self.stderr.write(
+                f"Giving up on {len(give_up)} log message(s) after {self.max_deliveries} tries (they can still be"
+                f" replayed with replay_playout_log): {', '.join(message_id.decode() for message_id in give_up)}"
+            )
+            self.redis.xack(REDIS_KEY_SERVICE_LOGS, CONSUMER_GROUP, *give_up)
+
+        claim = [p["message_id"] for p in stale if p["times_delivered"] < self.max_deliveries]
+        if claim:
+            return self.redis.xclaim(REDIS_KEY_SERVICE_LOGS, CONSUMER_GROUP, self.consumer, self.claim_idle_ms, claim)
+        return []
+
+    def read(self, block_ms=5000):
+        response = self.redis.xreadgroup(
+            CONSUMER_GROUP, self.consumer, {REDIS_KEY_SERVICE_LOGS: ">"}, count=self.batch_size, block=block_ms
+        )
+        return response[0][1] if response else []
 
-            try:
-                log_entry_kwargs = json.loads(data)
-                if not isinstance(log_entry_kwargs, dict):
-                    raise ValueError
+    def process(self, messages):
+        """Write the log entries in messages, returning the number written. Messages are only acknowledged after
+        they're committed, so if writing fails they're retried by whichever subscriber reclaims them."""
+        log_entries = build_log_entries(messages)
+        try:
+            num_written = write_log_entries(log_entries) if log_entries else 0
+        except (InterfaceError, OperationalError) as e:
+            self.stderr.write(f"Database error writing {len(log_entries)} log entries, will retry: {e}")
+            close_old_connections()
+            time.sleep(1)
+            return 0
 
-            except ValueError:
-                self.stderr.write(f"Error decoding JSON in data: {data.decode()!r}")
+        self.redis.xack(REDIS_KEY_SERVICE_LOGS, CONSUMER_GROUP, *(message_id for message_id, _ in messages))
 
+        if self.verbosity >= 2 or settings.DEBUG:
+            for log_entry in log_entries:
+                self.stdout.write(f"Wrote log entry: {log_entry}")
+
+        metrics.playout_log_entries.inc(num_written, status="written")
+        if len(log_entries) > num_written:
+            metrics.playout_log_entries.inc(len(log_entries) - num_written, status="invalid")
+        return num_written
+
+    def handle(self, *args, **options):
+        self.redis = get_redis_connection()
+        self.verbosity = options["verbosity"]
+        self.batch_size = options["batch_size"]
+        self.claim_idle_ms = options["claim_idle_seconds"] * 1000
+        self.max_deliveries = options["max_deliveries"]
+        self.consumer = f"{socket.gethostname()}-{os.getpid()}"
+        report_interval = options["report_interval"]
+
+        ensure_consumer_group(self.redis)
+        self.delete_idle_consumers()
+        self.migrate_legacy_list()
+        self.stdout.write(
+            f"Running log subscriber {self.consumer} for redis stream {REDIS_KEY_SERVICE_LOGS} (group {CONSUMER_GROUP})"
+        )
+
+        num_written, num_batches = 0, 0
+        report_start = last_reclaim = time.monotonic()
+        while True:
+            if time.monotonic() - last_reclaim >= self.claim_idle_ms / 1000 / 2:
+                messages = self.reclaim()
+                last_reclaim = time.monotonic()
             else:
-                if settings.DEBUG:
-                    self.stdout.write(f"Got message: {json.dumps(log_entry_kwargs, indent=2, sort_keys=True)}")
-
-                if "created" in log_entry_kwargs:
-                    try:
-                        log_entry_kwargs["created"] = datetime.datetime.utcfromtimestamp(
-                            float(log_entry_kwargs["created"])
-                        ).replace(tzinfo=pytz.utc)
-                    except ValueError:
-                        pass
-
-                try:
-                    log_entry = PlayoutLogEntry(**log_entry_kwargs)
-                    log_entry.full_clean()
-                    log_entry.save()
-                    self.stdout.write(f"Wrote log entry: {log_entry}")
-
-                except Exception:
-                    self.stderr.write(f"Uncaught exception creating log entry with kwargs: {log_entry_kwargs!r}:")
-                    self.stderr.write(traceback.format_exc())
+                messages = self.read()
+
+            if messages:
+                num_written += self.process(messages)
+                num_batches += 1
+
+            elapsed = time.monotonic() - report_start
+            if elapsed >= report_interval:
+                self.stdout.write(
+                    f"Wrote {num_written} log entries in {num_batches} batches over {elapsed:.0f}s"
+                    f" ({num_written / elapsed:.1f}/s)"
+                )
+                num_written, num_batches, report_start = 0, 0, time.monotonic()
@@ -0,0 +1,36 @@
+# Generated by Django 3.2rc1 on 2026-10-19 15:20
+
+from django.db import migrations, models
+
+
+def partition_playout_log(apps, schema_editor):
+    from services.partitions import partition_table
+
+    partition_table(apps.get_model("services", "PlayoutLogEntry")._meta.db_table, schema_editor)
+
+
+def unpartition_playout_log(apps, schema_editor):
+    from services.partitions import unpartition_table
+
+    unpartition_table(apps.get_model("services", "PlayoutLogEntry")._meta.db_table, schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0002_playoutlogentry_stream_id'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='playoutlogentry',
+            name='stream_id',
+            field=models.CharField(blank=True, editable=False, max_length=40, null=True),
+        ),
+        migrations.AlterUniqueTogether(
+            name='playoutlogentry',
+            unique_together={('stream_id', 'created')},
+        ),
+        # Only on Postgres, otherwise it stays a plain table
+        migrations.RunPython(partition_playout_log, unpartition_playout_log),
+    ]
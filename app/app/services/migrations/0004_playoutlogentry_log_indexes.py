@@ -0,0 +1,29 @@
+# Generated by Django 3.2rc1 on 2026-10-19 15:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0003_partition_playoutlogentry'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='playoutlogentry',
+            index=models.Index(fields=['created', 'id'], name='services_pl_created_87b425_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='playoutlogentry',
+            index=models.Index(fields=['event_type', 'created'], name='services_pl_event_t_568558_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='playoutlogentry',
+            index=models.Index(fields=['user', 'created'], name='services_pl_user_id_1ba8c4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='playoutlogentry',
+            index=models.Index(fields=['active_source', 'created'], name='services_pl_active__457e18_idx'),
+        ),
+    ]
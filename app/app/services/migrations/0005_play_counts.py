@@ -0,0 +1,48 @@
+# Generated by Django 3.2rc1 on 2026-10-19 15:25
+
+import common.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0004_playoutlogentry_log_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AssetPlayCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Date')),
+                ('asset_type', models.CharField(choices=[('audio', 'Audio Asset'), ('rotator', 'Rotator Asset'), ('broadcast', 'Broadcast Asset')], max_length=10, verbose_name='Asset Type')),
+                ('asset_id', models.PositiveIntegerField(verbose_name='Asset ID')),
+                ('plays', models.PositiveIntegerField(default=0, verbose_name='Plays')),
+            ],
+            options={
+                'ordering': ('-date', 'asset_type', 'asset_id'),
+            },
+        ),
+        migrations.CreateModel(
+            name='SourcePlayCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField(verbose_name='Hour')),
+                ('active_source', common.models.TruncatingCharField(max_length=50, verbose_name='Active Source')),
+                ('plays', models.PositiveIntegerField(default=0, verbose_name='Plays')),
+            ],
+            options={
+                'ordering': ('-hour', 'active_source'),
+                'unique_together': {('hour', 'active_source')},
+            },
+        ),
+        migrations.AddIndex(
+            model_name='assetplaycount',
+            index=models.Index(fields=['date', 'asset_type'], name='services_as_date_042f34_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='assetplaycount',
+            unique_together={('asset_type', 'asset_id', 'date')},
+        ),
+    ]
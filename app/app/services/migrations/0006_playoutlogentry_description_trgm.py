@@ -0,0 +1,29 @@
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+INDEX_NAME = "services_playoutlogentry_description_trgm"
+
+
+def create_description_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        table = apps.get_model("services", "PlayoutLogEntry")._meta.db_table
+        # On the partitioned table, so it's created on every partition (and future ones)
+        schema_editor.execute(f'CREATE INDEX "{INDEX_NAME}" ON "{table}" USING gin ("description" gin_trgm_ops)')
+
+
+def drop_description_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(f'DROP INDEX IF EXISTS "{INDEX_NAME}"')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0005_play_counts'),
+    ]
+
+    operations = [
+        # Both only on Postgres (not in the model's Meta.indexes, since other databases don't have GIN indexes)
+        TrigramExtension(),
+        migrations.RunPython(create_description_index, drop_description_index),
+    ]
@@ -1,4 +1,6 @@
-from django.db import models
+import datetime
+
+from django.db import connection, models
 from django.utils import timezone
 from django.utils.safestring import mark_safe
 
@@ -6,6 +8,8 @@ from autodj.models import AudioAsset, RotatorAsset
 from broadcast.models import BroadcastAsset
 from common.models import TruncatingCharField, User
 
+from .search import TrigramWordSimilarity
+
 
 class UpstreamServer(models.Model):
     HEALTHCHECK_PORT_OFFSET = 1500
@@ -96,6 +100,58 @@ class UpstreamServer(models.Model):
         return super().save(*args, **kwargs)
 
 
+class PlayoutLogEntryQuerySet(models.QuerySet):
+    EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+    MAX_ID = 2 ** 63 - 1  # Largest BigAutoField
+
+    def filter_log(self, event_type=None, user=None, active_source=None, start=None, end=None):
+        queryset = self
+        for lookup, value in (
+            ("event_type", event_type),
+            ("user", user),
+            ("active_source", active_source),
+            ("created__gte", start),
+            ("created__lt", end),
+        ):
+            if value:
+                queryset = queryset.filter(**{lookup: value})
+        return queryset
+
+    def search(self, query):
+        """Entries with descriptions matching query, best matches first. On Postgres this uses the description's
+        trigram index and ranks fuzzy matches by word similarity, otherwise it's a substring match, newest first."""
+        if connection.vendor == "postgresql":
+            return (
+                self.filter(description__trigram_word_similar=query)
+                .annotate(rank=TrigramWordSimilarity(query, "description"))
+                .order_by("-rank", "-created", "-id")
+            )
+        return self.filter(description__icontains=query).order_by("-created", "-id")
+
+    @classmethod
+    def make_cursor(cls, log_entry):
+        return f"{(log_entry.created - cls.EPOCH) // datetime.timedelta(microseconds=1)}-{log_entry.id}"
+
+    def page(self, cursor=None, limit=250):
+        """Keyset pagination (newest first) using (created, id), so a page is an index scan however far back it is,
+        without an OFFSET or a count. Returns a list of entries and the cursor for the next page, if there is one.
+        Raises ValueError on an invalid cursor."""
+        queryset = self.order_by("-created", "-id")
+        if cursor:
+            microseconds, entry_id = map(int, cursor.split("-"))
+            try:
+                created = self.EPOCH + datetime.timedelta(microseconds=microseconds)
+            except OverflowError:
+                raise ValueError(f"cursor date out of range: {cursor}")
+            if not 0 < entry_id <= self.MAX_ID:
+                raise ValueError(f"cursor id out of range: {cursor}")
+            queryset = queryset.filter(models.Q(created__lt=created) | models.Q(created=created, id__lt=entry_id))
+
+        log_entries = list(queryset[: limit + 1])
+        next_cursor = self.make_cursor(log_entries[limit - 1]) if len(log_entries) > limit else None
+        return log_entries[:limit], next_cursor
+
+
 class PlayoutLogEntry(models.Model):
     class EventType(models.TextChoices):
         # These are used by templates/services/*.liq files, so be mindful before changing
@@ -112,11 +168,62 @@ class PlayoutLogEntry(models.Model):
     broadcast_asset = models.ForeignKey(BroadcastAsset, on_delete=models.SET_NULL, blank=True, null=True)
     rotator_asset = models.ForeignKey(RotatorAsset, on_delete=models.SET_NULL, blank=True, null=True)
     user = models.ForeignKey(User, on_delete=models.SET_NULL, blank=True, null=True)
+    # Redis stream message ID and index of the entry in it, so entries are written at most once (and can be replayed).
+    # Unique together with created, since on Postgres the table is partitioned by it (see services/partitions.py)
+    stream_id = models.CharField(max_length=40, null=True, blank=True, editable=False)
+
+    objects = PlayoutLogEntryQuerySet.as_manager()
 
     def __str__(self):
         return f"[{self.get_event_type_display()}] {timezone.localtime(self.created)} - {self.description}"
 
     class Meta:
         ordering = ("-created",)
+        unique_together = ("stream_id", "created")
+        # For paging through the log (see PlayoutLogEntryQuerySet.page()), alone or filtered
+        indexes = [
+            models.Index(fields=("created", "id")),
+            models.Index(fields=("event_type", "created")),
+            models.Index(fields=("user", "created")),
+            models.Index(fields=("active_source", "created")),
+        ]
         verbose_name = "playout log entry"
         verbose_name_plural = "playout logs"
+
+
+class AssetPlayCount(models.Model):
+    """Plays of an asset on a (local) day, rolled up from the playout log by services/play_counts.py"""
+
+    class AssetType(models.TextChoices):
+        AUDIO = "audio", "Audio Asset"
+        ROTATOR = "rotator", "Rotator Asset"
+        BROADCAST = "broadcast", "Broadcast Asset"
+
+    date = models.DateField("Date")
+    asset_type = models.CharField("Asset Type", max_length=10, choices=AssetType.choices)
+    # Not a foreign key, so counts are kept (eg for licensing reports) if the asset is deleted
+    asset_id = models.PositiveIntegerField("Asset ID")
+    plays = models.PositiveIntegerField("Plays", default=0)
+
+    def __str__(self):
+        return f"{self.get_asset_type_display()} #{self.asset_id} played {self.plays} time(s) on {self.date}"
+
+    class Meta:
+        ordering = ("-date", "asset_type", "asset_id")
+        unique_together = ("asset_type", "asset_id", "date")
+        indexes = [models.Index(fields=("date", "asset_type"))]
+
+
+class SourcePlayCount(models.Model):
+    """Plays on an active source in an hour, rolled up from the playout log by services/play_counts.py"""
+
+    hour = models.DateTimeField("Hour")
+    active_source = TruncatingCharField("Active Source", max_length=50)
+    plays = models.PositiveIntegerField("Plays", default=0)
+
+    def __str__(self):
+        return f"{self.active_source} played {self.plays} time(s) in hour {timezone.localtime(self.hour)}"
+
+    class Meta:
+        ordering = ("-hour", "active_source")
+        unique_together = ("hour", "active_source")
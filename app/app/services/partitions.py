@@ -0,0 +1,150 @@
+"""Monthly range partitions (by created date, in UTC) for the playout log table. Postgres only, on other databases
+it's a plain table and none of this applies. Used by migrations, so nothing here imports models."""
+
+import datetime
+import re
+
+from django.db import connection as default_connection
+from django.db import transaction
+
+PARTITION_KEY = "created"
+PARTITION_MONTHS_AHEAD = 3
+PARTITION_NAME_RE = re.compile(r"_y(?P<year>\d{4})m(?P<month>\d{2})$")
+
+
+def month_start(dt):
+    dt = dt.astimezone(datetime.timezone.utc)
+    return datetime.datetime(dt.year, dt.month, 1, tzinfo=datetime.timezone.utc)
+
+
+def add_months(month, num_months):
+    years, month_index = divmod(month.month - 1 + num_months, 12)
+    return month.replace(year=month.year + years, month=month_index + 1)
+
+
+def partition_name(table, month):
+    return f"{table}_y{month.year}m{month.month:02d}"
+
+
+def default_partition_name(table):
+    return f"{table}_default"
+
+
+def is_partitioned(table, connection=default_connection):
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT EXISTS(SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))", [table])
+        return cursor.fetchone()[0]
+
+
+def get_partitions(table, cursor):
+    """Returns a dict of month => partition name, excluding the default partition"""
+    cursor.execute(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = %s::regclass",
+        [table],
+    )
+    partitions = {}
+    for (name,) in cursor.fetchall():
+        match = PARTITION_NAME_RE.search(name)
+        if match:
+            month = datetime.datetime(int(match["year"]), int(match["month"]), 1, tzinfo=datetime.timezone.utc)
+            partitions[month] = name
+    return partitions
+
+
+def create_partition(table, month, cursor):
+    name, default_name = partition_name(table, month), default_partition_name(table)
+    start, end = month, add_months(month, 1)
+    cursor.execute(f'CREATE TABLE "{name}" (LIKE "{table}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+    # Rows for this month may have landed in the default partition, and it can't be attached until they're moved
+    cursor.execute(
+        f'WITH moved AS (DELETE FROM "{default_name}" WHERE "{PARTITION_KEY}" >= %s AND "{PARTITION_KEY}" < %s'
+        f' RETURNING *) INSERT INTO "{name}" SELECT * FROM moved',
+        [start, end],
+    )
+    cursor.execute(f'ALTER TABLE "{table}" ATTACH PARTITION "{name}" FOR VALUES FROM (%s) TO (%s)', [start, end])
+    return name
+
+
+def partition_months(start=None, months_ahead=PARTITION_MONTHS_AHEAD):
+    """Months from start's (default: this month) to months_ahead from now"""
+    now = datetime.datetime.now(datetime.timezone.utc)
+    month, last_month = month_start(start or now), add_months(month_start(now), months_ahead)
+    while month <= last_month:
+        yield month
+        month = add_months(month, 1)
+
+
+def ensure_partitions(table, start=None, months_ahead=PARTITION_MONTHS_AHEAD, connection=default_connection):
+    """Create any missing monthly partitions from start's month (default: this month) to months_ahead from now"""
+    created = []
+    with connection.cursor() as cursor:
+        existing = get_partitions(table, cursor)
+        for month in partition_months(start, months_ahead):
+            if month not in existing:
+                # Otherwise if attaching failed, rows already moved out of the default partition would be stranded in
+                # an unattached table, and every run after would fail to create it
+                with transaction.atomic(using=connection.alias):
+                    created.append(create_partition(table, month, cursor))
+    return created
+
+
+def drop_partitions_before(table, before, connection=default_connection):
+    """Drop partitions that only hold rows older than before, returning their names"""
+    dropped = []
+    with connection.cursor() as cursor:
+        for month, name in sorted(get_partitions(table, cursor).items()):
+            if add_months(month, 1) <= before:
+                cursor.execute(f'DROP TABLE "{name}"')
+                dropped.append(name)
+    return dropped
+
+
+def _rebuild_table(cursor, table, partitioned):
+    """Recreate table as (or no longer as) partitioned, with the same data, sequence, constraints and indexes"""
+    old_table = f"{table}_rebuild"
+    cursor.execute(
+        "SELECT conname, contype, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass", [table]
+    )
+    constraints = cursor.fetchall()
+    constraint_names = {name for name, _, _ in constraints}
+    cursor.execute("SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s", [table])
+    indexes = [(name, definition) for name, definition in cursor.fetchall() if name not in constraint_names]
+    cursor.execute(f'SELECT pg_get_serial_sequence(%s, \'id\'), min("{PARTITION_KEY}") FROM "{table}"', [table])
+    sequence, oldest = cursor.fetchone()
+
+    cursor.execute(f'ALTER TABLE "{table}" RENAME TO "{old_table}"')
+    partition_by = f' PARTITION BY RANGE ("{PARTITION_KEY}")' if partitioned else ""
+    cursor.execute(f'CREATE TABLE "{table}" (LIKE "{old_table}" INCLUDING DEFAULTS){partition_by}')
+    if partitioned:
+        cursor.execute(f'CREATE TABLE "{default_partition_name(table)}" PARTITION OF "{table}" DEFAULT')
+        for month in partition_months(start=oldest):
+            create_partition(table, month, cursor)
+
+    cursor.execute(f'INSERT INTO "{table}" SELECT * FROM "{old_table}"')
+    if sequence:
+        cursor.execute(f'ALTER SEQUENCE {sequence} OWNED BY "{table}"."id"')
+    # Frees up the names of its constraints and indexes, so they can be recreated exactly as they were
+    cursor.execute(f'DROP TABLE "{old_table}"')
+
+    for name, constraint_type, definition in constraints:
+        if constraint_type == "p":
+            # Unique constraints on a partitioned table must include the partition key
+            definition = f'PRIMARY KEY ("id", "{PARTITION_KEY}")' if partitioned else 'PRIMARY KEY ("id")'
+        cursor.execute(f'ALTER TABLE "{table}" ADD CONSTRAINT "{name}" {definition}')
+    for name, definition in indexes:
+        # Definitions refer to the table by name, so they now apply to the new one (ONLY is for partitioned tables)
+        cursor.execute(definition.replace(" ON ONLY ", " ON ", 1))
+
+
+def partition_table(table, schema_editor):
+    if schema_editor.connection.vendor == "postgresql" and not is_partitioned(table, schema_editor.connection):
+        with schema_editor.connection.cursor() as cursor:
+            _rebuild_table(cursor, table, partitioned=True)
+
+
+def unpartition_table(table, schema_editor):
+    if is_partitioned(table, schema_editor.connection):
+        with schema_editor.connection.cursor() as cursor:
+            _rebuild_table(cursor, table, partitioned=False)
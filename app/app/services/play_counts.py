@@ -0,0 +1,180 @@
+from collections import defaultdict
+import datetime
+
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate, TruncHour
+from django.utils import timezone
+
+from .models import AssetPlayCount, PlayoutLogEntry, SourcePlayCount
+
+ASSET_FIELDS = {
+    AssetPlayCount.AssetType.AUDIO: "audio_asset_id",
+    AssetPlayCount.AssetType.ROTATOR: "rotator_asset_id",
+    AssetPlayCount.AssetType.BROADCAST: "broadcast_asset_id",
+}
+
+
+def get_plays():
+    return PlayoutLogEntry.objects.filter(event_type=PlayoutLogEntry.EventType.TRACK).order_by()
+
+
+def local_day_start(date):
+    return timezone.make_aware(datetime.datetime.combine(date, datetime.time()))
+
+
+def local_hour(dt):
+    return timezone.localtime(dt).replace(minute=0, second=0, microsecond=0)
+
+
+def lock_play_counts(keys):
+    """Take transaction level advisory locks on rollup keys (Postgres only, SQLite only has one writer at a time), so
+    concurrent refreshes of the same rollup take turns, and each counts the log entries the other wrote. Taken in
+    sorted order, so they can't deadlock."""
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            for key in sorted(set(keys)):
+                cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", [key])
+
+
+def upsert_play_counts(model, key_fields, rows):
+    """Insert (*key_fields, plays) rows, updating plays of any that already exist. bulk_create() can't do that before
+    Django 4.1, so it's raw SQL that Postgres and SQLite both support."""
+    fields = [model._meta.get_field(name) for name in (*key_fields, "plays")]
+    columns = [f'"{field.column}"' for field in fields]
+    sql = (
+        f'INSERT INTO "{model._meta.db_table}" ({", ".join(columns)}) VALUES ({", ".join("%s" for _ in fields)}) '
+        f'ON CONFLICT ({", ".join(columns[:-1])}) DO UPDATE SET "plays" = EXCLUDED."plays"'
+    )
+    params = [[field.get_db_prep_save(value, connection) for field, value in zip(fields, row)] for row in rows]
+    if params:
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, params)
+
+
+def refresh_play_counts(log_entries):
+    """Recount the rollups that (just written) log entries fall in. Rather than being incremented, counts are
+    recomputed from the log and upserted, so an entry written twice or by two log subscribers at once isn't counted
+    twice."""
+    asset_ids, sources = defaultdict(set), defaultdict(set)
+    for log_entry in log_entries:
+        if log_entry.event_type == PlayoutLogEntry.EventType.TRACK:
+            for asset_type, field in ASSET_FIELDS.items():
+                if getattr(log_entry, field):
+                    asset_ids[asset_type, timezone.localdate(log_entry.created)].add(getattr(log_entry, field))
+            sources[local_hour(log_entry.created)].add(log_entry.active_source)
+
+    with transaction.atomic():
+        lock_play_counts(
+            [f"asset_play_count:{asset_type}:{date}" for asset_type, date in asset_ids]
+            + [f"source_play_count:{hour.isoformat()}" for hour in sources]
+        )
+
+        for (asset_type, date), ids in asset_ids.items():
+            field = ASSET_FIELDS[asset_type]
+            counts = dict(
+                get_plays()
+                .filter(
+                    created__gte=local_day_start(date), created__lt=local_day_start(date + datetime.timedelta(days=1))
+                )
+                .filter(**{f"{field}__in": ids})
+                .values_list(field)
+                .annotate(plays=Count("id"))
+            )
+            upsert_play_counts(
+                AssetPlayCount,
+                ("asset_type", "asset_id", "date"),
+                [(asset_type, asset_id, date, plays) for asset_id, plays in counts.items()],
+            )
+            AssetPlayCount.objects.filter(asset_type=asset_type, date=date, asset_id__in=ids - counts.keys()).delete()
+
+        for hour, active_sources in sources.items():
+            counts = dict(
+                get_plays()
+                .filter(
+                    created__gte=hour, created__lt=hour + datetime.timedelta(hours=1), active_source__in=active_sources
+                )
+                .values_list("active_source")
+                .annotate(plays=Count("id"))
+            )
+            upsert_play_counts(
+                SourcePlayCount,
+                ("hour", "active_source"),
+                [(hour, active_source, plays) for active_source, plays in counts.items()],
+            )
+            SourcePlayCount.objects.filter(hour=hour, active_source__in=active_sources - counts.keys()).delete()
+
+
+def rebuild_play_counts(start=None, end=None):
+    """Rebuild rollups from the playout log for (local) dates from start to end (exclusive), by default all of the
+    log. Returns the number of asset and source play counts created."""
+    tz = timezone.get_current_timezone()
+    if start is None:
+        # Rollups outlive purged log entries, so keep the ones from before the oldest entry
+        oldest = PlayoutLogEntry.objects.order_by("created").values_list("created", flat=True).first()
+        if oldest is None:
+            return 0, 0
+        start = timezone.localdate(oldest)
+    plays = get_plays().filter(created__gte=local_day_start(start))
+    asset_play_counts = AssetPlayCount.objects.filter(date__gte=start)
+    source_play_counts = SourcePlayCount.objects.filter(hour__gte=local_day_start(start))
+    if end:
+        plays = plays.filter(created__lt=local_day_start(end))
+        asset_play_counts = asset_play_counts.filter(date__lt=end)
+        source_play_counts = source_play_counts.filter(hour__lt=local_day_start(end))
+
+    with transaction.atomic():
+        asset_play_counts.delete()
+        source_play_counts.delete()
+
+        num_asset_play_counts = 0
+        for asset_type, field in ASSET_FIELDS.items():
+            counts = (
+                plays.filter(**{f"{field}__isnull": False})
+                .annotate(date=TruncDate("created", tzinfo=tz))
+                .values_list("date", field)
+                .annotate(plays=Count("id"))
+            )
+            num_asset_play_counts += len(
+                AssetPlayCount.objects.bulk_create(
+                    (
+                        AssetPlayCount(asset_type=asset_type, asset_id=asset_id, date=date, plays=num_plays)
+                        for date, asset_id, num_plays in counts.iterator()
+                    ),
+                    batch_size=1000,
+                )
+            )
+
+        counts = plays.annotate(hour=TruncHour("created", tzinfo=tz)).values_list("hour", "active_source")
+        num_source_play_counts = len(
+            SourcePlayCount.objects.bulk_create(
+                (
+                    SourcePlayCount(hour=hour, active_source=active_source, plays=num_plays)
+                    for hour, active_source, num_plays in counts.annotate(plays=Count("id")).iterator()
+                ),
+                batch_size=1000,
+            )
+        )
+
+    return num_asset_play_counts, num_source_play_counts
+
+
+def get_asset_plays(start, end, asset_type=AssetPlayCount.AssetType.AUDIO):
+    """Returns a dict of asset id => plays from start to end (dates, exclusive), from the rollups only"""
+    return dict(
+        AssetPlayCount.objects.filter(asset_type=asset_type, date__gte=start, date__lt=end)
+        .order_by()
+        .values_list("asset_id")
+        .annotate(total=Sum("plays"))
+    )
+
+
+def get_source_plays(start, end):
+    """Returns a list of (active source, plays) from start to end (dates, exclusive), most played first"""
+    return list(
+        SourcePlayCount.objects.filter(hour__gte=local_day_start(start), hour__lt=local_day_start(end))
+        .order_by()
+        .values_list("active_source")
+        .annotate(total=Sum("plays"))
+        .order_by("-total", "active_source")
+    )
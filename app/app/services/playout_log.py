@@ -0,0 +1,173 @@
+import datetime
+import json
+import logging
+
+import pytz
+from redis.exceptions import ResponseError
+
+from django.db import transaction
+from django.db.utils import InterfaceError, OperationalError
+
+from django_redis import get_redis_connection
+
+from crazyarms import constants
+
+from .models import PlayoutLogEntry
+from .play_counts import refresh_play_counts
+
+logger = logging.getLogger(f"crazyarms.{__name__}")
+
+CONSUMER_GROUP = "log-subscribers"
+# Approximate number of stream messages (each a batch of entries) kept after they're processed, for replaying
+STREAM_MAXLEN = 100000
+# Foreign keys that log entries can refer to, validated with one query per model per batch
+FOREIGN_KEY_FIELDS = ("audio_asset", "broadcast_asset", "rotator_asset", "user")
+
+
+class LogEntryError(Exception):
+    pass
+
+
+def queue_log_entries(log_entries, redis=None):
+    """Add a batch of log entries (dicts) to the stream as one message"""
+    if redis is None:
+        redis = get_redis_connection()
+    return redis.xadd(
+        constants.REDIS_KEY_SERVICE_LOGS, {"data": json.dumps(log_entries)}, maxlen=STREAM_MAXLEN, approximate=True
+    )
+
+
+def ensure_consumer_group(redis):
+    try:
+        # Start from the beginning of the stream, so nothing added before the group exists is missed
+        redis.xgroup_create(constants.REDIS_KEY_SERVICE_LOGS, CONSUMER_GROUP, id="0", mkstream=True)
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+def get_queue_length(redis=None, limit=1000):
+    """Messages not yet acknowledged by a log subscriber (pending or not yet delivered), counted up to limit"""
+    if redis is None:
+        redis = get_redis_connection()
+
+    try:
+        group = next(g for g in redis.xinfo_groups(constants.REDIS_KEY_SERVICE_LOGS) if g["name"] == CONSUMER_GROUP)
+    except (ResponseError, StopIteration):  # No stream or group yet
+        return redis.xlen(constants.REDIS_KEY_SERVICE_LOGS)
+
+    last_delivered_id = group["last-delivered-id"]
+    undelivered = redis.xrange(constants.REDIS_KEY_SERVICE_LOGS, min=last_delivered_id, count=limit + 1)
+    return group["pending"] + len([message_id for message_id, _ in undelivered if message_id != last_delivered_id])
+
+
+def parse_message(message_id, fields):
+    """Returns a list of (stream_id, log entry kwargs) for a stream message, which holds a batch of entries"""
+    if isinstance(message_id, bytes):
+        message_id = message_id.decode()
+    data = fields.get(b"data", fields.get("data", b""))
+
+    try:
+        log_entries = json.loads(data)
+    except ValueError:
+        raise LogEntryError(f"Error decoding JSON in message {message_id}: {data!r}")
+    if isinstance(log_entries, dict):
+        log_entries = [log_entries]
+    if not isinstance(log_entries, list):
+        raise LogEntryError(f"Expected a list of log entries in message {message_id}: {data!r}")
+
+    return [(f"{message_id}-{num}", log_entry) for num, log_entry in enumerate(log_entries)]
+
+
+def build_log_entry(stream_id, log_entry_kwargs):
+    if not isinstance(log_entry_kwargs, dict):
+        raise LogEntryError(f"Log entry {stream_id} isn't an object: {log_entry_kwargs!r}")
+    log_entry_kwargs = dict(log_entry_kwargs)
+
+    if "created" not in log_entry_kwargs:
+        # When the message was added, so an entry written twice gets the same created, which is part of its key
+        log_entry_kwargs["created"] = int(stream_id.split("-")[0]) / 1000
+    try:
+        log_entry_kwargs["created"] = datetime.datetime.utcfromtimestamp(float(log_entry_kwargs["created"])).replace(
+            tzinfo=pytz.utc
+        )
+    except (TypeError, ValueError, OverflowError, OSError):
+        raise LogEntryError(f"Invalid created time for log entry {stream_id}: {log_entry_kwargs['created']!r}")
+
+    try:
+        log_entry = PlayoutLogEntry(stream_id=stream_id, **log_entry_kwargs)
+        if not log_entry.description or log_entry.event_type not in PlayoutLogEntry.EventType.values:
+            raise ValueError("Invalid description or event type")
+        for field in FOREIGN_KEY_FIELDS:
+            value = getattr(log_entry, f"{field}_id")
+            setattr(log_entry, f"{field}_id", None if value in (None, "", 0, "0") else int(value))
+    except (TypeError, ValueError) as e:
+        raise LogEntryError(f"Invalid log entry {stream_id} with kwargs {log_entry_kwargs!r}: {e}")
+    return log_entry
+
+
+def build_log_entries(messages):
+    """Build (unsaved) log entries from stream messages, skipping invalid ones"""
+    log_entries = []
+    for message_id, fields in messages:
+        if not fields:  # Claimed after being trimmed from the stream
+            logger.error(f"Log message {message_id!r} no longer exists in the stream")
+            continue
+        try:
+            for stream_id, log_entry_kwargs in parse_message(message_id, fields):
+                try:
+                    log_entries.append(build_log_entry(stream_id, log_entry_kwargs))
+                except LogEntryError as e:
+                    logger.error(str(e))
+        except LogEntryError as e:
+            logger.error(str(e))
+    return log_entries
+
+
+def validate_foreign_keys(log_entries):
+    for field in FOREIGN_KEY_FIELDS:
+        ids = {getattr(log_entry, f"{field}_id") for log_entry in log_entries} - {None}
+        if ids:
+            model = PlayoutLogEntry._meta.get_field(field).related_model
+            existing_ids = model.objects.in_bulk(ids).keys()
+            for log_entry in log_entries:
+                if getattr(log_entry, f"{field}_id") not in existing_ids | {None}:
+                    logger.warning(f"Log entry {log_entry.stream_id} refers to non-existent {field}, unsetting it")
+                    setattr(log_entry, f"{field}_id", None)
+
+
+def write_log_entries(log_entries):
+    """Write log entries, skipping ones already written (by stream_id), and update play count rollups. Database
+    connection errors are raised, so the caller doesn't acknowledge the entries, anything else falls back to writing
+    one at a time and skipping bad ones."""
+    validate_foreign_keys(log_entries)
+
+    try:
+        with transaction.atomic():
+            PlayoutLogEntry.objects.bulk_create(log_entries, ignore_conflicts=True)
+            refresh_play_counts(log_entries)
+        return len(log_entries)
+    except (InterfaceError, OperationalError):
+        raise
+    except Exception:
+        logger.exception("Error writing batch of log entries, writing them one at a time")
+
+    num_written = 0
+    for log_entry in log_entries:
+        try:
+            with transaction.atomic():
+                PlayoutLogEntry.objects.bulk_create([log_entry], ignore_conflicts=True)
+            num_written += 1
+        except (InterfaceError, OperationalError):
+            raise
+        except Exception:
+            logger.exception(f"Error writing log entry {log_entry.stream_id}, skipping it: {log_entry}")
+
+    try:
+        with transaction.atomic():
+            refresh_play_counts(log_entries)
+    except (InterfaceError, OperationalError):
+        raise
+    except Exception:
+        logger.exception("Error updating play counts, they can be fixed with ./manage.py rebuild_play_counts")
+    return num_written
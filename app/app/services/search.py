@@ -0,0 +1,26 @@
+"""Trigram word similarity search, which Django doesn't have until 4.0. Needs the pg_trgm extension, so Postgres
+only, on other databases searches fall back to a plain substring match."""
+
+from django.db import models
+from django.db.models.lookups import PostgresOperatorLookup
+
+
+class TrigramWordSimilarity(models.Func):
+    """How similar string is to the most similar run of words in expression"""
+
+    function = "WORD_SIMILARITY"
+    output_field = models.FloatField()
+
+    def __init__(self, string, expression, **extra):
+        if not hasattr(string, "resolve_expression"):
+            string = models.Value(string)
+        super().__init__(string, expression, **extra)
+
+
+@models.CharField.register_lookup
+class TrigramWordSimilar(PostgresOperatorLookup):
+    """Whether the rhs is word similar to the field (above pg_trgm.word_similarity_threshold, see DATABASES in
+    settings), which can use a trigram index"""
+
+    lookup_name = "trigram_word_similar"
+    postgres_operator = "%%>"
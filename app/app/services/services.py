@@ -1,8 +1,10 @@
+from collections import namedtuple
+import difflib
+import glob
+import hashlib
 import logging
 import os
 import shlex
-import shutil
-import subprocess
 
 from django.conf import settings
 from django.core.cache import cache
@@ -13,9 +15,19 @@ from constance import config
 
 from crazyarms import constants
 
+from .supervisor import SupervisorException, get_supervisor
+
 logger = logging.getLogger(f"crazyarms.{__name__}")
 
-SUPERVISOR_RUNNING_STATES = {"STARTING", "RUNNING", "BACKOFF"}
+CONFIG_DIR = "/config"
+# Files a service renders, anything else matching these that wasn't rendered is stale and gets removed
+CONF_FILE_PATTERNS = ("*.liq", "*.xml", "supervisor/*.conf")
+
+ConfChanges = namedtuple("ConfChanges", ("changed", "removed", "restart", "diff"))
+
+
+def conf_hash(conf):
+    return hashlib.sha256(conf.encode("utf-8")).hexdigest()
 
 
 class ServiceBase:
@@ -24,24 +36,38 @@ class ServiceBase:
     def __init__(self):
         self._server = None
         self.programs_to_start = []
+        self.rendered_confs = {}  # filename => contents
+        self.program_conf_files = {}  # program => config filenames it reads (including its supervisor conf)
 
     def render_conf(self):
         raise NotImplementedError()
 
-    def supervisorctl(self, *args):
-        cmd = ["supervisorctl", "-s", f"http://{self.service_name}:9001"] + list(args)
-        logger.info(f'running: {" ".join(cmd)}')
-        cmd = subprocess.run(cmd, capture_output=True, text=True)
-        if cmd.returncode != 0:
-            logger.warning(f"supervisorctl exited with {cmd.returncode}")
-
-        stdout, stderr = (" / ".join(s.strip().splitlines()) for s in (cmd.stdout, cmd.stderr))
-        if stderr:
-            logger.warning(f"supervisorctl error output: {stderr}")
-        if stdout:
-            logger.info(f"supervisorctl output: {stdout}")
-
-        return stdout
+    @property
+    def supervisor_url(self):
+        return f"http://{self.service_name}:9001"
+
+    @property
+    def supervisor(self):
+        return get_supervisor(self.supervisor_url)
+
+    def supervisorctl(self, action, *programs):
+        # Same actions as supervisorctl (start, stop, restart, update), but over XML-RPC
+        logger.info(f'supervisor {self.service_name}: {" ".join((action,) + programs)}')
+        try:
+            return getattr(self.supervisor, action)(*programs)
+        except SupervisorException as e:
+            logger.warning(f"supervisor {self.service_name} error: {e}")
+
+    def is_program_running(self, program_name):
+        try:
+            return self.supervisor.is_running(program_name)
+        except SupervisorException as e:
+            logger.warning(f"supervisor {self.service_name} error: {e}")
+            return False
+
+    @property
+    def conf_dir(self):
+        return f"{CONFIG_DIR}/{self.service_name}"
 
     def render_conf_file(self, filename, context=None, conf_filename=None):
         default_context = {"settings": settings, "config": config}
@@ -51,22 +77,19 @@ class ServiceBase:
         template = get_template(f"services/{filename}")
         conf = template.template.render(make_context(default_context, autoescape=False))
 
-        conf_filename = f"/config/{self.service_name}/{filename if conf_filename is None else conf_filename}"
-        os.makedirs(os.path.dirname(conf_filename), exist_ok=True)
-        with open(conf_filename, "w") as conf_file:
-            conf_file.write(conf)
-            logger.info(f"writing config file {conf_filename}")
-
-    def clear_supervisor_conf(self):
-        shutil.rmtree(f"/config/{self.service_name}/supervisor", ignore_errors=True)
+        conf_filename = f"{self.conf_dir}/{filename if conf_filename is None else conf_filename}"
+        self.rendered_confs[conf_filename] = conf
+        return conf_filename
 
-    def render_supervisor_conf_file(self, command, program_name=None, start=True, **extras):
+    def render_supervisor_conf_file(self, command, program_name=None, start=True, conf_files=(), **extras):
+        # conf_files = config files (relative to the service's directory) the program reads, so it's restarted when
+        # any of them change
         program_name = self.service_name if program_name is None else program_name
         # Really, very awful hack to wrap both stdout/error in a string "[program-name]" in supervisor logs
         command = f'{command} 2> >(sed -ue "s/^/[{program_name}:stderr] /" >&2) | sed -ue "s/^/[{program_name}] /"'
         command = f"bash -c {shlex.quote(command)}"
 
-        self.render_conf_file(
+        supervisor_conf_filename = self.render_conf_file(
             "service.conf",
             conf_filename=f"supervisor/{program_name}.conf",
             context={
@@ -75,16 +98,90 @@ class ServiceBase:
                 "extras": extras,
             },
         )
+        self.program_conf_files[program_name] = {supervisor_conf_filename} | {
+            f"{self.conf_dir}/{conf_file}" for conf_file in conf_files
+        }
 
         if start:
             self.programs_to_start.append(program_name)
 
-    def reload_supervisor(self, restart_services=False):
+    def deployed_conf_filenames(self):
+        return {
+            filename
+            for pattern in CONF_FILE_PATTERNS
+            for filename in glob.glob(f"{self.conf_dir}/{pattern}")
+            if os.path.isfile(filename)
+        }
+
+    @staticmethod
+    def read_conf_file(filename):
+        try:
+            with open(filename, "r") as conf_file:
+                return conf_file.read()
+        except FileNotFoundError:
+            return None
+
+    def conf_changes(self, diff=False):
+        """Compare rendered config files to deployed ones by content hash. Returns which files changed (or are new),
+        which are stale, which programs would need a restart because of them and optionally a unified diff."""
+        changed, diffs = [], []
+        for filename, conf in sorted(self.rendered_confs.items()):
+            deployed = self.read_conf_file(filename)
+            if deployed is None or conf_hash(deployed) != conf_hash(conf):
+                changed.append(filename)
+                if diff:
+                    diffs.extend(
+                        difflib.unified_diff(
+                            (deployed or "").splitlines(keepends=True),
+                            conf.splitlines(keepends=True),
+                            fromfile=filename if deployed is not None else "/dev/null",
+                            tofile=filename,
+                        )
+                    )
+
+        removed = sorted(self.deployed_conf_filenames() - self.rendered_confs.keys())
+        if diff:
+            for filename in removed:
+                diffs.extend(
+                    difflib.unified_diff(
+                        self.read_conf_file(filename).splitlines(keepends=True),
+                        [],
+                        fromfile=filename,
+                        tofile="/dev/null",
+                    )
+                )
+
+        restart = [
+            program
+            for program, conf_files in self.program_conf_files.items()
+            if program in self.programs_to_start and not conf_files.isdisjoint(changed)
+        ]
+        return ConfChanges(changed=changed, removed=removed, restart=restart, diff="".join(diffs))
+
+    def write_conf_files(self, changes):
+        for filename in changes.changed:
+            logger.info(f"writing config file {filename}")
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            # Write and move into place, so services never read a partially written file
+            with open(f"{filename}.tmp", "w") as conf_file:
+                conf_file.write(self.rendered_confs[filename])
+            os.replace(f"{filename}.tmp", filename)
+
+        for filename in changes.removed:
+            logger.info(f"removing stale config file {filename}")
+            os.remove(filename)
+
+    def reload_supervisor(self, restart_services=False, restart=()):
         if self.supervisor_enabled:
             if restart_services:
                 self.supervisorctl("stop", "all")
 
-            self.supervisorctl("update")
+            # Stops and re-adds (but doesn't start) programs whose supervisor conf changed, removes stale ones
+            added, changed, _ = self.supervisorctl("update") or ((), (), ())
+
+            restart = [program for program in restart if program not in added and program not in changed]
+            if restart and not restart_services:
+                self.supervisorctl("restart", *restart)
 
             if self.programs_to_start:
                 self.supervisorctl("start", *self.programs_to_start)
@@ -104,11 +201,13 @@ class HarborService(ServiceBase):
 
     def render_conf(self):
         from .models import PlayoutLogEntry
+        from .playout_log import STREAM_MAXLEN
 
         self.render_conf_file(
             "library.liq",
             context={
                 "REDIS_KEY_SERVICE_LOGS": constants.REDIS_KEY_SERVICE_LOGS,
+                "PLAYOUT_LOG_STREAM_MAXLEN": STREAM_MAXLEN,
                 "event_types": zip(PlayoutLogEntry.EventType.names, PlayoutLogEntry.EventType.values),
             },
         )
@@ -116,10 +215,12 @@ class HarborService(ServiceBase):
         kwargs = {"environment": 'HOME="/tmp/pulse"', "user": "liquidsoap"}
 
         liq_cmd = "liquidsoap /config/harbor/harbor.liq"
+        liq_conf_files = ("harbor.liq", "library.liq")
         if settings.ZOOM_ENABLED:
             # Wait for pulse to be up
             self.render_supervisor_conf_file(
                 command=f'sh -c "wait-for-it -t 0 localhost:4713 && {liq_cmd}"',
+                conf_files=liq_conf_files,
                 **kwargs,
             )
             self.render_supervisor_conf_file(
@@ -133,7 +234,7 @@ class HarborService(ServiceBase):
                 **kwargs,
             )
         else:
-            self.render_supervisor_conf_file(command=liq_cmd, **kwargs)
+            self.render_supervisor_conf_file(command=liq_cmd, conf_files=liq_conf_files, **kwargs)
 
 
 class UpstreamService(ServiceBase):
@@ -141,6 +242,7 @@ class UpstreamService(ServiceBase):
 
     def render_conf(self):
         from .models import PlayoutLogEntry, UpstreamServer
+        from .playout_log import STREAM_MAXLEN
 
         # Make sure there's a local Icecast upstream
         local_icecast = UpstreamServer.objects.filter(name="local-icecast")
@@ -162,6 +264,7 @@ class UpstreamService(ServiceBase):
                 "library.liq",
                 context={
                     "REDIS_KEY_SERVICE_LOGS": constants.REDIS_KEY_SERVICE_LOGS,
+                    "PLAYOUT_LOG_STREAM_MAXLEN": STREAM_MAXLEN,
                     "event_types": zip(
                         PlayoutLogEntry.EventType.names,
                         PlayoutLogEntry.EventType.values,
@@ -178,6 +281,7 @@ class UpstreamService(ServiceBase):
             self.render_supervisor_conf_file(
                 command=f"liquidsoap /config/upstream/{upstream.name}.liq",
                 program_name=upstream.name,
+                conf_files=(f"{upstream.name}.liq", "library.liq"),
                 user="liquidsoap",
             )
 
@@ -185,10 +289,8 @@ class UpstreamService(ServiceBase):
 class ZoomService(ServiceBase):
     service_name = "zoom"
 
-    # TODO move to ServiceBase with name as arg, and provide @cached_property version
     def is_zoom_running(self):
-        status = self.supervisorctl("status", "zoom-runner").split()
-        return len(status) >= 2 and status[1] == "RUNNING"
+        return self.is_program_running("zoom-runner")
 
     def render_conf(self):
         kwargs = {
@@ -230,28 +332,44 @@ if not settings.ZOOM_ENABLED:
     del SERVICES[ZoomService.service_name]
 
 
-def init_services(services=None, restart_services=False, subservices=(), render_only=False):
-    # subservices = restart these specific one(s)
+def init_services(services=None, restart_services=False, subservices=(), render_only=False, dry_run=False):
+    """Render services' config files, writing only those whose contents changed and restarting only the programs
+    affected by them. restart_services restarts all programs regardless, and subservices are specific one(s) to restart
+    regardless. In dry_run mode, nothing is written or restarted. Returns a dict of service name => ConfChanges."""
     if isinstance(services, str):
         services = (services,)
+    if isinstance(subservices, str):
+        subservices = (subservices,)
 
     if not services:
         services = SERVICES.keys()
 
+    all_changes = {}
     for service in services:
-        logger.info(f'initializing service: {service}{" (rendering only)" if render_only else ""}')
+        logger.info(
+            f"initializing service: {service}"
+            f'{" (rendering only)" if render_only else ""}{" (dry run)" if dry_run else ""}'
+        )
         service_cls = SERVICES[service]
         service = service_cls()
+        service.render_conf()
 
-        if service.supervisor_enabled:
-            service.clear_supervisor_conf()
+        changes = service.conf_changes(diff=dry_run)
+        if service.supervisor_enabled and restart_services:
+            changes = changes._replace(restart=list(service.programs_to_start))
+        elif subservices:
+            changes = changes._replace(restart=changes.restart + [s for s in subservices if s not in changes.restart])
+        all_changes[service.service_name] = changes
 
-        service.render_conf()
+        if dry_run:
+            continue
+
+        if changes.changed or changes.removed:
+            service.write_conf_files(changes)
+        else:
+            logger.info(f"config files for {service.service_name} unchanged")
 
         if service.supervisor_enabled and not render_only:
-            service.reload_supervisor(restart_services=restart_services)
+            service.reload_supervisor(restart_services=restart_services, restart=changes.restart)
 
-            if subservices:
-                if isinstance(subservices, str):
-                    subservices = (subservices,)
-                service.supervisorctl("restart", *subservices)
+    return all_changes
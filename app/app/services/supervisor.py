@@ -0,0 +1,134 @@
+from collections import namedtuple
+import logging
+import threading
+import xmlrpc.client
+
+from supervisor.xmlrpc import Faults
+
+logger = logging.getLogger(f"crazyarms.{__name__}")
+
+SUPERVISOR_RUNNING_STATES = {"STARTING", "RUNNING", "BACKOFF"}
+SUPERVISOR_TIMEOUT = 30  # Stopping processes waits for them to exit
+
+ProcessState = namedtuple("ProcessState", ("name", "group", "state", "pid", "description"))
+
+
+class SupervisorException(Exception):
+    pass
+
+
+class _Transport(xmlrpc.client.Transport):
+    def make_connection(self, host):
+        connection = super().make_connection(host)
+        connection.timeout = SUPERVISOR_TIMEOUT
+        return connection
+
+
+class SupervisorClient:
+    """Talks to supervisord over XML-RPC, over a persistent HTTP connection (one per thread, since ServerProxy
+    isn't thread safe). Calls for several processes are batched with system.multicall."""
+
+    # Faults that supervisorctl doesn't consider errors either
+    IGNORED_FAULTS = {
+        "startProcess": {Faults.ALREADY_STARTED},
+        "stopProcess": {Faults.NOT_RUNNING},
+        "addProcessGroup": {Faults.ALREADY_ADDED},
+        "removeProcessGroup": {Faults.BAD_NAME},
+    }
+
+    def __init__(self, url):
+        self.url = url
+        self._local = threading.local()
+
+    @property
+    def proxy(self):
+        proxy = getattr(self._local, "proxy", None)
+        if proxy is None:
+            proxy = self._local.proxy = xmlrpc.client.ServerProxy(f"{self.url}/RPC2", transport=_Transport())
+        return proxy
+
+    def call(self, method, *params):
+        try:
+            return getattr(self.proxy.supervisor, method)(*params)
+        except (OSError, xmlrpc.client.Error) as e:
+            self._local.proxy = None  # Reconnect next time
+            raise SupervisorException(f"{method} failed: {e}")
+
+    def multicall(self, calls):
+        """Run [(method, *params), ...] in one request, returning results in order (None for ignorable faults)"""
+        if not calls:
+            return []
+
+        try:
+            results = self.proxy.system.multicall(
+                [{"methodName": f"supervisor.{method}", "params": list(params)} for method, *params in calls]
+            )
+        except (OSError, xmlrpc.client.Error) as e:
+            self._local.proxy = None
+            raise SupervisorException(f"multicall failed: {e}")
+
+        values = []
+        for (method, *params), result in zip(calls, results):
+            if isinstance(result, dict) and "faultCode" in result:
+                if result["faultCode"] not in self.IGNORED_FAULTS.get(method, ()):
+                    raise SupervisorException(f"{method}{tuple(params)} failed: {result['faultString']}")
+                values.append(None)
+            else:
+                values.append(result)
+        return values
+
+    def process_states(self):
+        return {
+            info["name"]: ProcessState(
+                name=info["name"],
+                group=info["group"],
+                state=info["statename"],
+                pid=info["pid"],
+                description=info["description"],
+            )
+            for info in self.call("getAllProcessInfo")
+        }
+
+    def is_running(self, name):
+        state = self.process_states().get(name)
+        return state is not None and state.state in SUPERVISOR_RUNNING_STATES
+
+    def update(self):
+        """Equivalent of `supervisorctl update`, adds, removes and restarts groups whose config changed"""
+        ((added, changed, removed),) = self.call("reloadConfig")
+        calls = []
+        for group in changed + removed:
+            calls.extend((("stopProcessGroup", group, True), ("removeProcessGroup", group)))
+        calls.extend(("addProcessGroup", group) for group in changed + added)
+        self.multicall(calls)
+        return added, changed, removed
+
+    def start(self, *names):
+        if "all" in names:
+            return self.call("startAllProcesses", False)
+        return self.multicall([("startProcess", name, False) for name in names])
+
+    def stop(self, *names):
+        if "all" in names:
+            return self.call("stopAllProcesses", True)
+        return self.multicall([("stopProcess", name, True) for name in names])
+
+    def restart(self, *names):
+        if "all" in names:
+            self.call("stopAllProcesses", True)
+            return self.call("startAllProcesses", False)
+        return self.multicall(
+            [("stopProcess", name, True) for name in names] + [("startProcess", name, False) for name in names]
+        )
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_supervisor(url):
+    with _clients_lock:
+        client = _clients.get(url)
+        if client is None:
+            client = _clients[url] = SupervisorClient(url)
+        return client
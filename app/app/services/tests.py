@@ -0,0 +1,810 @@
+import asyncio
+import datetime
+import io
+import json
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from unittest import skipUnless
+from unittest.mock import MagicMock, Mock, patch
+
+from redis import Redis
+from redis.exceptions import ResponseError
+
+from django.contrib import admin
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.db.utils import OperationalError
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from constance.test import override_config
+from django_redis import get_redis_connection
+
+from autodj.models import AudioAsset
+from common.models import User
+from crazyarms import constants
+from crazyarms.constants import REDIS_KEY_SERVICE_LOGS
+
+from . import play_counts
+from .health import clear_services_status, get_services_status, get_upstream_status
+from .liquidsoap import LiquidsoapTelnetException, _Liquidsoap
+from .management.commands.benchmark_liquidsoap_telnet import FakeLiquidsoapTelnetServer
+from .management.commands.run_log_subscriber import Command as LogSubscriberCommand
+from .models import AssetPlayCount, PlayoutLogEntry, SourcePlayCount, UpstreamServer
+from .partitions import (
+    PARTITION_MONTHS_AHEAD,
+    add_months,
+    default_partition_name,
+    drop_partitions_before,
+    ensure_partitions,
+    get_partitions,
+    is_partitioned,
+    month_start,
+    partition_months,
+    partition_name,
+)
+from .play_counts import get_asset_plays, get_source_plays, rebuild_play_counts, refresh_play_counts
+from .playout_log import CONSUMER_GROUP, ensure_consumer_group, get_queue_length, queue_log_entries, write_log_entries
+from .services import ConfChanges, ServiceBase, init_services
+from .supervisor import SupervisorClient
+from .tasks import purge_playout_log_entries
+
+
+class LiquidsoapTelnetTests(SimpleTestCase):
+    def setUp(self):
+        self.server = FakeLiquidsoapTelnetServer(responses={"status": '{"live": true}', "list": "a\r\nb"})
+        self.server.__enter__()
+        self.liquidsoap = _Liquidsoap(*self.server.server_address, pool_size=2)
+
+    def tearDown(self):
+        self.server.__exit__()
+
+    def test_execute(self):
+        self.assertEqual(self.liquidsoap.status(as_dict=True), {"live": True})
+        self.assertEqual(self.liquidsoap.list(splitlines=True), ["a", "b"])
+        self.assertEqual(self.liquidsoap.prerecord__push("file.mp3"), "prerecord.push file.mp3")
+        # All on one connection
+        self.assertEqual(len(self.liquidsoap._idle), 1)
+
+    def test_execute_many_pipelined_in_order(self):
+        commands = [f"command.{num}" for num in range(50)]
+        self.assertEqual(self.liquidsoap.execute_many(commands), commands)
+        self.assertEqual(len(self.liquidsoap._idle), 1)
+
+    def test_reconnects_after_connection_closed(self):
+        self.liquidsoap.execute("one")
+        self.liquidsoap._idle[0].sock.shutdown(socket.SHUT_RDWR)
+        self.assertEqual(self.liquidsoap.execute("two"), "two")
+
+    def test_deadline(self):
+        self.server.delay = 0.5
+        start = time.monotonic()
+        with self.assertRaises(LiquidsoapTelnetException):
+            self.liquidsoap.execute("slow", timeout=0.2)
+        self.assertLess(time.monotonic() - start, 0.4)
+        self.assertIsNone(self.liquidsoap.execute("slow", timeout=0.2, safe=True))
+
+    def test_aexecute(self):
+        async def run():
+            return await asyncio.gather(
+                self.liquidsoap.aexecute("status", as_dict=True), *(self.liquidsoap.aexecute(f"{n}") for n in range(5))
+            )
+
+        self.assertEqual(asyncio.run(run()), [{"live": True}, "0", "1", "2", "3", "4"])
+
+
+class ServicesHealthTests(TestCase):
+    def setUp(self):
+        clear_services_status()
+        self.upstream_servers = [
+            UpstreamServer.objects.create(
+                name=f"upstream{num}", hostname="example.com", port=8000, mount=f"stream{num}", password="hackme"
+            )
+            for num in range(3)
+        ]
+
+    def slow_ping(self, service, port):
+        time.sleep(0.2)
+        return port != self.upstream_servers[1].healthcheck_port
+
+    def slow_upstream_status(self, upstream_server):
+        time.sleep(0.2)
+        return {"online": True, "name": upstream_server.name}
+
+    def test_services_checked_concurrently_and_cached(self):
+        with patch("services.health.ping", side_effect=self.slow_ping) as ping, patch(
+            "services.health.upstream_status", side_effect=self.slow_upstream_status
+        ):
+            start = time.monotonic()
+            services_status = get_services_status()
+            self.assertLess(time.monotonic() - start, 0.6)  # Rather than 7 x 0.2s
+
+            self.assertEqual(
+                {key: status["healthy"] for key, status in services_status.items()},
+                {
+                    ("harbor", "harbor"): True,
+                    ("upstream", "upstream0"): True,
+                    ("upstream", "upstream1"): False,
+                    ("upstream", "upstream2"): True,
+                },
+            )
+            self.assertEqual(ping.call_count, 4)
+
+            self.assertEqual(
+                get_upstream_status(self.upstream_servers[2])["status"], {"online": True, "name": "upstream2"}
+            )
+            self.assertEqual(ping.call_count, 4)
+
+
+SUPERVISORD_CONF = """
+[supervisord]
+nodaemon=true
+logfile=/dev/null
+logfile_maxbytes=0
+pidfile={dir}/supervisord.pid
+
+[inet_http_server]
+port=127.0.0.1:{port}
+
+[rpcinterface:supervisor]
+supervisor.rpcinterface_factory = supervisor.rpcinterface:make_main_rpcinterface
+
+[include]
+files = {dir}/conf.d/*.conf
+"""
+PROGRAM_CONF = """
+[program:{name}]
+command=sleep 1000
+autostart=false
+startsecs=0
+stopsignal=KILL
+"""
+
+
+@skipUnless(shutil.which("supervisord"), "supervisord not installed")
+class SupervisorTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.dir = tempfile.mkdtemp()
+        os.mkdir(f"{cls.dir}/conf.d")
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            cls.port = sock.getsockname()[1]
+        with open(f"{cls.dir}/supervisord.conf", "w") as conf:
+            conf.write(SUPERVISORD_CONF.format(dir=cls.dir, port=cls.port))
+
+        cls.supervisord = subprocess.Popen(["supervisord", "-c", f"{cls.dir}/supervisord.conf"])
+        cls.supervisor = SupervisorClient(f"http://127.0.0.1:{cls.port}")
+        for _ in range(50):
+            try:
+                cls.supervisor.process_states()
+                break
+            except Exception:
+                time.sleep(0.1)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.supervisord.terminate()
+        cls.supervisord.wait()
+        shutil.rmtree(cls.dir)
+        super().tearDownClass()
+
+    def setUp(self):
+        for conf in os.listdir(f"{self.dir}/conf.d"):
+            os.remove(f"{self.dir}/conf.d/{conf}")
+        self.supervisor.update()
+
+    def add_program(self, name):
+        with open(f"{self.dir}/conf.d/{name}.conf", "w") as conf:
+            conf.write(PROGRAM_CONF.format(name=name))
+
+    def test_update_start_stop(self):
+        self.add_program("one")
+        self.add_program("two")
+        added, changed, removed = self.supervisor.update()
+        self.assertEqual(sorted(added), ["one", "two"])
+        self.assertEqual(
+            {name: s.state for name, s in self.supervisor.process_states().items()},
+            {"one": "STOPPED", "two": "STOPPED"},
+        )
+
+        self.supervisor.start("one", "two")
+        self.supervisor.start("one")  # Already started isn't an error
+        self.assertTrue(self.supervisor.is_running("one"))
+        pid = self.supervisor.process_states()["two"].pid
+
+        self.supervisor.restart("two")
+        self.assertNotEqual(self.supervisor.process_states()["two"].pid, pid)
+
+        self.supervisor.stop("one", "two")
+        self.assertFalse(self.supervisor.is_running("one"))
+
+        os.remove(f"{self.dir}/conf.d/two.conf")
+        self.assertEqual(self.supervisor.update(), ([], [], ["two"]))
+        self.assertEqual(list(self.supervisor.process_states()), ["one"])
+
+    def test_service_base_api(self):
+        class TestService(ServiceBase):
+            service_name = "test"
+            supervisor_url = f"http://127.0.0.1:{self.port}"
+
+        self.add_program("three")
+        service = TestService()
+        service.supervisorctl("update")
+        service.supervisorctl("start", "three")
+        self.assertTrue(service.is_program_running("three"))
+        service.supervisorctl("stop", "all")
+        self.assertFalse(service.is_program_running("three"))
+
+        # Errors are logged, not raised
+        with self.assertLogs("crazyarms.services.services", level="WARNING"):
+            service.supervisorctl("start", "does-not-exist")
+
+
+class ConfRenderTests(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        for patcher in (
+            patch("services.services.CONFIG_DIR", self.dir),
+            patch("services.services.ServiceBase.supervisorctl", return_value=None),
+        ):
+            self.addCleanup(patcher.stop)
+            self.supervisorctl = patcher.start()
+
+        self.upstream_servers = [
+            UpstreamServer.objects.create(
+                name=f"upstream{num}", hostname="example.com", port=8000, mount=f"stream{num}", password="hackme"
+            )
+            for num in range(2)
+        ]
+
+    def restarted(self):
+        return [call.args[1:] for call in self.supervisorctl.call_args_list if call.args[0] == "restart"]
+
+    def test_only_changed_files_written_and_programs_restarted(self):
+        def supervisorctl(action, *args):
+            if action == "update":  # Everything's new to supervisor
+                return list(UpstreamServer.objects.values_list("name", flat=True)), [], []
+
+        self.supervisorctl.side_effect = supervisorctl
+        changes = init_services("upstream")["upstream"]
+        self.supervisorctl.side_effect = None
+        self.assertIn(f"{self.dir}/upstream/upstream0.liq", changes.changed)
+        self.assertIn(f"{self.dir}/upstream/supervisor/upstream1.conf", changes.changed)
+        self.assertEqual(self.restarted(), [])  # First render, update added them (and start starts them)
+
+        mtime = os.stat(f"{self.dir}/upstream/upstream0.liq").st_mtime_ns
+        self.supervisorctl.reset_mock()
+        changes = init_services("upstream")["upstream"]
+        self.assertEqual((changes.changed, changes.removed, changes.restart), ([], [], []))
+        self.assertEqual(self.restarted(), [])
+        self.assertEqual(os.stat(f"{self.dir}/upstream/upstream0.liq").st_mtime_ns, mtime)
+
+        self.upstream_servers[1].port = 8001
+        self.upstream_servers[1].save()
+        changes = init_services("upstream")["upstream"]
+        self.assertEqual(changes.changed, [f"{self.dir}/upstream/upstream1.liq"])
+        self.assertEqual(self.restarted(), [("upstream1",)])
+
+        self.upstream_servers[0].delete()
+        changes = init_services("upstream")["upstream"]
+        self.assertEqual(
+            changes.removed, [f"{self.dir}/upstream/supervisor/upstream0.conf", f"{self.dir}/upstream/upstream0.liq"]
+        )
+        self.assertFalse(os.path.exists(f"{self.dir}/upstream/upstream0.liq"))
+
+    def test_dry_run(self):
+        init_services("upstream")
+        self.upstream_servers[0].mount = "changed"
+        self.upstream_servers[0].save()
+        self.supervisorctl.reset_mock()
+
+        changes = init_services("upstream", dry_run=True)["upstream"]
+        self.assertEqual(changes.restart, ["upstream0"])
+        self.assertRegex(changes.diff, r"\n-mount = .*'/stream0'\n\+mount = .*'/changed'\n")
+        self.supervisorctl.assert_not_called()
+        with open(f"{self.dir}/upstream/upstream0.liq") as conf_file:
+            self.assertNotIn("changed", conf_file.read())
+
+    @override_config(HARBOR_TRANSPORT="ogg-flac")
+    def test_transport_restarts_harbor_and_upstreams(self):
+        with override_config(HARBOR_TRANSPORT="wav"):
+            init_services(("harbor", "upstream"))
+
+        all_changes = init_services(("harbor", "upstream"))
+        self.assertEqual(
+            all_changes["harbor"].changed, [f"{self.dir}/harbor/harbor.liq", f"{self.dir}/harbor/library.liq"]
+        )
+        self.assertEqual(all_changes["harbor"].restart, ["harbor"])
+        self.assertEqual(all_changes["upstream"].changed, [f"{self.dir}/upstream/library.liq"])
+        self.assertEqual(all_changes["upstream"].restart, [u.name for u in UpstreamServer.objects.all()])
+
+        with open(f"{self.dir}/harbor/harbor.liq") as conf_file:
+            self.assertIn("%ogg(%flac(", conf_file.read())
+        with open(f"{self.dir}/upstream/library.liq") as conf_file:
+            self.assertIn("TRANSPORT_MOUNT = 'live.ogg'", conf_file.read())
+
+
+def get_stream_redis():
+    """fakeredis doesn't implement streams, so tests that use them need a real Redis, ie TEST_REDIS_URL=redis://redis/1
+    (they'll delete the playout log stream there)"""
+    if os.environ.get("TEST_REDIS_URL"):
+        return Redis.from_url(os.environ["TEST_REDIS_URL"])
+    try:
+        get_redis_connection().xlen(REDIS_KEY_SERVICE_LOGS)
+    except ResponseError:
+        return None
+    return get_redis_connection()
+
+
+class LogSubscriberTests(TestCase):
+    def setUp(self):
+        self.command = LogSubscriberCommand(stdout=io.StringIO(), stderr=io.StringIO())
+        self.command.redis = Mock()
+        self.command.verbosity = 1
+
+    def message(self, message_id, *entries):
+        return (message_id.encode(), {b"data": json.dumps(entries if len(entries) > 1 else entries[0]).encode()})
+
+    def test_messages_validated_and_written_in_bulk(self):
+        user = User.objects.create(username="dj")
+        asset = AudioAsset(title="Track")
+        asset.save()
+
+        messages = [
+            self.message(
+                "1-0",
+                {"description": "track", "event_type": "track", "audio_asset_id": str(asset.id)},
+                {"description": "dj", "event_type": "dj", "user_id": str(user.id), "created": "1600000000"},
+                {"description": "deleted asset", "event_type": "track", "audio_asset_id": str(asset.id + 1)},
+                {"description": "bad type", "event_type": "invalid"},
+                {"description": "bad field", "not_a_field": 1},
+                {"description": "bad created", "created": "yesterday"},
+            ),
+            (b"2-0", {b"data": b"not json"}),
+            (b"3-0", {}),  # Trimmed from the stream before it was claimed
+        ]
+        # One in_bulk() for each of the two foreign keys referred to, one insert (within a savepoint), then a recount
+        # (within another savepoint, a select and an upsert) of the one asset day and one active source hour played in
+        with self.assertNumQueries(2 + 3 + 2 + 2 * 2):
+            self.assertEqual(self.command.process(messages), 3)
+        # Everything acknowledged, including invalid messages, so they aren't retried forever
+        self.command.redis.xack.assert_called_once_with(REDIS_KEY_SERVICE_LOGS, CONSUMER_GROUP, b"1-0", b"2-0", b"3-0")
+
+        entries = {entry.description: entry for entry in PlayoutLogEntry.objects.all()}
+        self.assertEqual(set(entries), {"track", "dj", "deleted asset"})
+        self.assertEqual(entries["track"].audio_asset, asset)
+        self.assertEqual(entries["track"].stream_id, "1-0-0")
+        self.assertEqual(entries["dj"].user, user)
+        self.assertEqual(entries["dj"].created.timestamp(), 1600000000)
+        self.assertIsNone(entries["deleted asset"].audio_asset)
+
+    def test_redelivered_messages_written_once(self):
+        messages = [self.message("1-0", {"description": "a"}, {"description": "b"})]
+        self.command.process(messages)
+        # A subscriber that reclaimed the message after the first wrote it, but before it was acknowledged
+        self.command.process(messages + [self.message("2-0", {"description": "c"})])
+        self.assertEqual(
+            sorted(PlayoutLogEntry.objects.values_list("stream_id", flat=True)), ["1-0-0", "1-0-1", "2-0-0"]
+        )
+
+    def test_not_acknowledged_on_database_error(self):
+        with patch("services.playout_log.PlayoutLogEntry.objects.bulk_create", side_effect=OperationalError), patch(
+            "time.sleep"
+        ):
+            self.assertEqual(self.command.process([self.message("1-0", {"description": "a"})]), 0)
+        self.command.redis.xack.assert_not_called()
+
+    def test_reclaim(self):
+        self.command.batch_size, self.command.claim_idle_ms, self.command.max_deliveries = 100, 60000, 5
+        self.command.consumer = "test"
+        self.command.redis.xpending_range.return_value = [
+            {"message_id": b"1-0", "consumer": b"dead", "time_since_delivered": 90000, "times_delivered": 1},
+            {"message_id": b"2-0", "consumer": b"dead", "time_since_delivered": 90000, "times_delivered": 5},
+            {"message_id": b"3-0", "consumer": b"alive", "time_since_delivered": 1000, "times_delivered": 1},
+        ]
+        self.command.reclaim()
+        self.command.redis.xack.assert_called_once_with(REDIS_KEY_SERVICE_LOGS, CONSUMER_GROUP, b"2-0")
+        self.command.redis.xclaim.assert_called_once_with(
+            REDIS_KEY_SERVICE_LOGS, CONSUMER_GROUP, "test", 60000, [b"1-0"]
+        )
+
+    def set_up_stream_redis(self):
+        redis = get_stream_redis()
+        redis.delete(REDIS_KEY_SERVICE_LOGS)
+        self.addCleanup(redis.delete, REDIS_KEY_SERVICE_LOGS)
+        self.command.redis, self.command.consumer, self.command.batch_size = redis, "test", 100
+        return redis
+
+    def replay(self, *args):
+        with patch(
+            "services.management.commands.replay_playout_log.get_redis_connection", return_value=self.command.redis
+        ):
+            call_command("replay_playout_log", *args, stdout=io.StringIO(), stderr=io.StringIO())
+
+    @skipUnless(get_stream_redis(), "Redis streams not supported (set TEST_REDIS_URL)")
+    def test_stream_consumer_group(self):
+        redis = self.set_up_stream_redis()
+        queue_log_entries([{"description": "a"}, {"description": "b"}], redis=redis)
+        ensure_consumer_group(redis)
+        ensure_consumer_group(redis)  # Already exists
+        self.assertEqual(get_queue_length(redis), 1)
+
+        messages = self.command.read(block_ms=None)
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(get_queue_length(redis), 1)  # Pending until acknowledged
+        self.assertEqual(self.command.process(messages), 2)
+        self.assertEqual(get_queue_length(redis), 0)
+
+        # Replaying after the entries are lost
+        PlayoutLogEntry.objects.all().delete()
+        self.replay("2000-01-01")
+        self.assertEqual(PlayoutLogEntry.objects.count(), 2)
+
+    @skipUnless(get_stream_redis(), "Redis streams not supported (set TEST_REDIS_URL)")
+    def test_replay_delete_keeps_entries_not_from_stream(self):
+        redis = self.set_up_stream_redis()
+        queue_log_entries([{"description": "from stream"}], redis=redis)
+        ensure_consumer_group(redis)
+        self.command.process(self.command.read(block_ms=None))
+        PlayoutLogEntry.objects.filter(description="from stream").update(description="changed")
+        PlayoutLogEntry.objects.create(description="from web UI")
+
+        (first_id, _), *_ = redis.xrange(REDIS_KEY_SERVICE_LOGS, count=1)
+        start = datetime.datetime.fromtimestamp(int(first_id.split(b"-")[0]) / 1000, tz=datetime.timezone.utc)
+        self.replay(start.isoformat(), "--delete")
+        self.assertEqual(
+            sorted(PlayoutLogEntry.objects.values_list("description", flat=True)), ["from stream", "from web UI"]
+        )
+
+
+class PartitionTests(SimpleTestCase):
+    def test_months(self):
+        month = month_start(datetime.datetime(2021, 11, 30, 20, tzinfo=datetime.timezone(datetime.timedelta(hours=-8))))
+        self.assertEqual(month, datetime.datetime(2021, 12, 1, tzinfo=datetime.timezone.utc))
+        self.assertEqual(add_months(month, 1), datetime.datetime(2022, 1, 1, tzinfo=datetime.timezone.utc))
+        self.assertEqual(add_months(month, -12), datetime.datetime(2020, 12, 1, tzinfo=datetime.timezone.utc))
+
+        months = list(partition_months(start=add_months(month_start(timezone.now()), -2), months_ahead=3))
+        self.assertEqual(len(months), 2 + 1 + 3)
+        self.assertEqual(months[-1], add_months(month_start(timezone.now()), 3))
+
+    def test_drop_partitions_before(self):
+        connection = MagicMock()
+        cursor = connection.cursor.return_value.__enter__.return_value
+        cursor.fetchall.return_value = [
+            ("log_default",),
+            ("log_y2021m05",),
+            ("log_y2021m06",),
+            ("log_y2021m07",),
+        ]
+        dropped = drop_partitions_before(
+            "log", datetime.datetime(2021, 7, 14, tzinfo=datetime.timezone.utc), connection=connection
+        )
+        # July still has entries newer than the 14th
+        self.assertEqual(dropped, ["log_y2021m05", "log_y2021m06"])
+        self.assertIn('DROP TABLE "log_y2021m06"', [call.args[0] for call in cursor.execute.call_args_list])
+
+
+@skipUnless(connection.vendor == "postgresql", "Partitioning is Postgres only (set TEST_DATABASE_URL)")
+class PostgresPartitionTests(TransactionTestCase):
+    table = PlayoutLogEntry._meta.db_table
+
+    def migrate(self, migration):
+        executor = MigrationExecutor(connection)
+        executor.migrate([("services", migration)])
+        return executor.loader.project_state(("services", migration)).apps
+
+    def get_constraint_names(self):
+        with connection.cursor() as cursor:
+            return sorted(connection.introspection.get_constraints(cursor, self.table))
+
+    def get_descriptions(self, table=None):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT "description" FROM "{table or self.table}" ORDER BY "created"')
+            return [description for (description,) in cursor.fetchall()]
+
+    def drop_table(self, table):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE "{table}"')
+
+    def test_migrate_forward_and_back(self):
+        ((_, latest),) = MigrationExecutor(connection).loader.graph.leaf_nodes("services")
+        self.addCleanup(self.migrate, latest)
+        apps = self.migrate("0002_playoutlogentry_stream_id")
+        self.assertFalse(is_partitioned(self.table))
+        constraint_names = self.get_constraint_names()
+
+        now = timezone.now()
+        model_cls = apps.get_model("services", "PlayoutLogEntry")
+        model_cls.objects.bulk_create(
+            model_cls(description=f"{days} days ago", created=now - datetime.timedelta(days=days))
+            for days in (400, 40, 0)
+        )
+        descriptions = self.get_descriptions()
+
+        apps = self.migrate("0003_partition_playoutlogentry")
+        self.assertTrue(is_partitioned(self.table))
+        self.assertEqual(self.get_descriptions(), descriptions)
+        with connection.cursor() as cursor:
+            partitions = get_partitions(self.table, cursor)
+        oldest_month = month_start(now - datetime.timedelta(days=400))
+        self.assertEqual(self.get_descriptions(partitions[oldest_month]), ["400 days ago"])
+        self.assertEqual(self.get_descriptions(default_partition_name(self.table)), [])
+        # Sequence still owned by (and used for) the id column
+        model_cls = apps.get_model("services", "PlayoutLogEntry")
+        self.assertGreater(model_cls.objects.create(description="new").id, 3)
+
+        self.migrate("0002_playoutlogentry_stream_id")
+        self.assertFalse(is_partitioned(self.table))
+        self.assertEqual(self.get_descriptions(), descriptions + ["new"])
+        self.assertEqual(self.get_constraint_names(), constraint_names)
+
+    def test_ensure_partitions_moves_rows_out_of_default_partition(self):
+        month = add_months(month_start(timezone.now()), PARTITION_MONTHS_AHEAD + 1)
+        PlayoutLogEntry.objects.create(description="far future", created=month + datetime.timedelta(days=1))
+        self.assertEqual(self.get_descriptions(default_partition_name(self.table)), ["far future"])
+
+        created = ensure_partitions(self.table, months_ahead=PARTITION_MONTHS_AHEAD + 1)
+        self.addCleanup(self.drop_table, partition_name(self.table, month))
+        self.assertEqual(created, [partition_name(self.table, month)])
+        self.assertEqual(self.get_descriptions(default_partition_name(self.table)), [])
+        self.assertEqual(self.get_descriptions(partition_name(self.table, month)), ["far future"])
+        self.assertEqual(ensure_partitions(self.table, months_ahead=PARTITION_MONTHS_AHEAD + 1), [])
+
+    @override_config(PLAYOUT_LOG_PURGE_DAYS=14)
+    def test_purge_keeps_purge_days(self):
+        now = timezone.now()
+        PlayoutLogEntry.objects.bulk_create(
+            PlayoutLogEntry(description=f"{days} days old", created=now - datetime.timedelta(days=days))
+            for days in (400, 20, 15, 13, 1)
+        )
+        purge_playout_log_entries.call_local()
+        # Not just whole months
+        self.assertEqual(self.get_descriptions(), ["13 days old", "1 days old"])
+
+
+class PurgePlayoutLogTests(TestCase):
+    @override_config(PLAYOUT_LOG_PURGE_DAYS=14)
+    def test_purge_unpartitioned(self):
+        for days in (1, 13, 15, 100):
+            PlayoutLogEntry.objects.create(
+                description=f"{days} days old", created=timezone.now() - datetime.timedelta(days=days)
+            )
+        purge_playout_log_entries.call_local()
+        self.assertEqual(
+            sorted(PlayoutLogEntry.objects.values_list("description", flat=True)), ["1 days old", "13 days old"]
+        )
+
+
+class PlayoutLogPageTests(TestCase):
+    def test_keyset_pagination(self):
+        created = timezone.now()
+        # Some share a created time, so pages are split on id too
+        for num in range(7):
+            PlayoutLogEntry.objects.create(description=f"{num}", created=created - datetime.timedelta(seconds=num // 2))
+
+        pages, cursor = [], None
+        while True:
+            log_entries, cursor = PlayoutLogEntry.objects.page(cursor=cursor, limit=3)
+            pages.append([log_entry.description for log_entry in log_entries])
+            if cursor is None:
+                break
+        self.assertEqual(pages, [["1", "0", "3"], ["2", "5", "4"], ["6"]])
+
+        log_entries, cursor = PlayoutLogEntry.objects.filter_log(start=created - datetime.timedelta(seconds=1)).page()
+        self.assertEqual(len(log_entries), 4)
+        self.assertIsNone(cursor)
+        for cursor in ("invalid", "99999999999999999999-1", "0-99999999999999999999", "0-0"):
+            with self.assertRaises(ValueError):
+                PlayoutLogEntry.objects.page(cursor=cursor)
+
+
+class HarborCustomConfigTests(TestCase):
+    def setUp(self):
+        cache.delete(constants.CACHE_KEY_HARBOR_CONFIG_CONTEXT)
+        User.objects.create_superuser("admin", "admin@example.com", "password")
+        self.client.login(username="admin", password="password")
+
+    @patch("services.admin.init_services")
+    def test_reports_whether_harbor_restarted(self, init_services):
+        def save(section1, restart):
+            init_services.return_value = {"harbor": ConfChanges(changed=[], removed=[], restart=restart, diff="")}
+            response = self.client.post(reverse("admin:harbor_custom_config"), {"section1": section1}, follow=True)
+            return [str(message) for message in response.context["messages"]]
+
+        self.assertEqual(save("# changed", ["harbor"]), ["Liquidsoap source code changed. Harbor was restarted."])
+        self.assertIn("Harbor was not restarted.", save("# changed again", [])[0])
+        self.assertEqual(init_services.call_count, 2)
+
+
+class PlayoutLogSearchTests(TestCase):
+    def setUp(self):
+        User.objects.create_superuser("admin", "admin@example.com", "password")
+        self.client.login(username="admin", password="password")
+        now = timezone.now()
+        for num, (description, active_source) in enumerate(
+            (
+                ("Rhapsody in Blue - Gershwin", "AutoDJ"),
+                ("Bohemian Rhapsody - Queen", "AutoDJ"),
+                ("Another One Bites the Dust - Queen", "AutoDJ"),
+                ("DJ connected", "Rhapsody"),
+            )
+        ):
+            PlayoutLogEntry.objects.create(
+                description=description, active_source=active_source, created=now - datetime.timedelta(minutes=num)
+            )
+
+    def admin_search(self, query):
+        response = self.client.get(reverse("admin:services_playoutlogentry_changelist"), {"q": query})
+        return [log_entry.description for log_entry in response.context["cl"].result_list]
+
+    def test_admin_search(self):
+        self.assertEqual(
+            self.admin_search("AutoDJ"),
+            ["Rhapsody in Blue - Gershwin", "Bohemian Rhapsody - Queen", "Another One Bites the Dust - Queen"],
+        )
+        self.assertEqual(
+            self.admin_search("Queen"), ["Bohemian Rhapsody - Queen", "Another One Bites the Dust - Queen"]
+        )
+
+    @skipUnless(connection.vendor == "postgresql", "Trigram search is Postgres only (set TEST_DATABASE_URL)")
+    def test_trigram_search(self):
+        queryset = PlayoutLogEntry.objects.search("rhapsody blue")
+        self.assertIn("%>", str(queryset.query))
+        log_entries = list(queryset)
+        self.assertEqual(
+            [log_entry.description for log_entry in log_entries],
+            ["Rhapsody in Blue - Gershwin", "Bohemian Rhapsody - Queen"],
+        )
+        self.assertGreater(log_entries[0].rank, log_entries[1].rank)
+
+        with connection.cursor() as cursor:
+            # Only for this test's transaction, so the planner uses the index even on a tiny table
+            cursor.execute("SET LOCAL enable_seqscan = off")
+        self.assertRegex(queryset.explain(), r"Bitmap Index Scan on \S*description")
+
+        # Best matches first (not the changelist's default ordering), then entries matched by active source
+        self.assertEqual(
+            self.admin_search("rhapsody blue"), ["Rhapsody in Blue - Gershwin", "Bohemian Rhapsody - Queen"]
+        )
+        self.assertEqual(
+            self.admin_search("Rhapsody"), ["Rhapsody in Blue - Gershwin", "Bohemian Rhapsody - Queen", "DJ connected"]
+        )
+
+
+class PlayCountTests(TestCase):
+    def setUp(self):
+        self.asset = AudioAsset.objects.create(title="Song", artist="Band")
+        self.now = timezone.now()
+
+    def write(self, stream_id, **kwargs):
+        kwargs.setdefault("event_type", "track")
+        kwargs.setdefault("created", self.now)
+        write_log_entries([PlayoutLogEntry(stream_id=stream_id, description="played", **kwargs)])
+
+    def test_incremental_and_rebuilt(self):
+        self.write("1-0-0", audio_asset_id=self.asset.id, active_source="AutoDJ")
+        self.write("2-0-0", audio_asset_id=self.asset.id, active_source="AutoDJ")
+        self.write("2-0-0", audio_asset_id=self.asset.id, active_source="AutoDJ")  # Written twice, counted once
+        self.write("3-0-0", active_source="Live DJ")
+        self.write("4-0-0", event_type="dj", active_source="Live DJ")  # Not a play
+        self.write("5-0-0", audio_asset_id=self.asset.id, created=self.now - datetime.timedelta(days=3))
+
+        today, tomorrow = timezone.localdate(self.now), timezone.localdate(self.now) + datetime.timedelta(days=1)
+        week_ago = today - datetime.timedelta(days=7)
+        expected = ({self.asset.id: 3}, {self.asset.id: 2}, [("AutoDJ", 2), ("Live DJ", 1), ("N/A", 1)])
+
+        def counts():
+            return (
+                get_asset_plays(week_ago, tomorrow),
+                get_asset_plays(today, tomorrow),
+                get_source_plays(week_ago, tomorrow),
+            )
+
+        self.assertEqual(counts(), expected)
+        AssetPlayCount.objects.all().delete()
+        SourcePlayCount.objects.all().delete()
+        self.assertEqual(rebuild_play_counts(), (2, 3))
+        self.assertEqual(counts(), expected)
+
+    def test_overlapping_refreshes(self):
+        log_entry = PlayoutLogEntry.objects.create(
+            event_type="track", audio_asset_id=self.asset.id, active_source="AutoDJ", created=self.now
+        )
+        upsert_play_counts, overlapped = play_counts.upsert_play_counts, []
+
+        def overlapping_upsert_play_counts(model, *args):
+            # Another refresh writes the same rollups after this one counted, but before it writes them
+            if model not in overlapped:
+                overlapped.append(model)
+                with patch("services.play_counts.upsert_play_counts", upsert_play_counts):
+                    refresh_play_counts([log_entry])
+            upsert_play_counts(model, *args)
+
+        with patch("services.play_counts.upsert_play_counts", overlapping_upsert_play_counts):
+            refresh_play_counts([log_entry])
+        self.assertEqual(overlapped, [AssetPlayCount, SourcePlayCount])
+        self.assertEqual(list(AssetPlayCount.objects.values_list("asset_id", "plays")), [(self.asset.id, 1)])
+        self.assertEqual(list(SourcePlayCount.objects.values_list("active_source", "plays")), [("AutoDJ", 1)])
+
+    def test_postgres_locks_taken_in_order(self):
+        with patch("services.play_counts.connection") as connection:
+            connection.vendor = "postgresql"
+            play_counts.lock_play_counts(["b", "a", "b"])
+        cursor = connection.cursor.return_value.__enter__.return_value
+        # Sorted and de-duplicated, so two refreshes can't each hold a lock the other is waiting on
+        self.assertEqual([call.args[1] for call in cursor.execute.call_args_list], [["a"], ["b"]])
+
+    @patch("services.playout_log.refresh_play_counts", side_effect=RuntimeError("bad rollup"))
+    def test_one_at_a_time_play_counts_error(self, refresh_play_counts):
+        with self.assertLogs("crazyarms.services.playout_log", "ERROR") as logs:
+            self.assertEqual(
+                write_log_entries([PlayoutLogEntry(stream_id="1-0-0", event_type="track", description="played")]), 1
+            )
+        self.assertEqual(refresh_play_counts.call_count, 2)
+        self.assertIn("Error updating play counts", logs.output[-1])
+        self.assertTrue(PlayoutLogEntry.objects.filter(stream_id="1-0-0").exists())
+
+    @override_config(AUTODJ_ENABLED=True)
+    def test_admin(self):
+        User.objects.create_superuser("admin", "admin@example.com", "password")
+        self.client.login(username="admin", password="password")
+        self.write("1-0-0", audio_asset_id=self.asset.id)
+
+        response = self.client.get(reverse("admin:play_counts"))
+        self.assertEqual(response.context["top_tracks"], [(self.asset.id, self.asset, 1)])
+        self.assertEqual(response.context["top_artists"], [("Band", 1)])
+
+        # Not the changelist itself, since it computes disk usage of the (missing) media directory
+        queryset = admin.site._registry[AudioAsset].get_queryset(Mock())
+        self.assertEqual(queryset.get(id=self.asset.id).plays, 1)
+
+
+@skipUnless(connection.vendor == "postgresql", "Advisory locks are Postgres only (set TEST_DATABASE_URL)")
+class PostgresPlayCountTests(TransactionTestCase):
+    def test_concurrent_refreshes(self):
+        asset = AudioAsset.objects.create(title="Song", artist="Band")
+        now = timezone.now()
+        first_refreshed, errors = threading.Event(), []
+
+        def write(stream_id, hold):
+            try:
+                with transaction.atomic():
+                    log_entry = PlayoutLogEntry.objects.create(
+                        stream_id=stream_id, event_type="track", audio_asset_id=asset.id, created=now
+                    )
+                    refresh_play_counts([log_entry])
+                    if hold:
+                        # Hold the first refresh's locks (uncommitted) while the second one starts
+                        first_refreshed.set()
+                        time.sleep(0.5)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=write, args=("1-0-0", True)),
+            threading.Thread(target=write, args=("2-0-0", False)),
+        ]
+        threads[0].start()
+        first_refreshed.wait(5)
+        threads[1].start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        # The second refresh waited for the first to commit, so it counted both
+        self.assertEqual(AssetPlayCount.objects.get().plays, 2)
+        self.assertEqual(SourcePlayCount.objects.get().plays, 2)
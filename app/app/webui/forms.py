@@ -19,6 +19,7 @@ from django_select2.forms import ModelSelect2Widget
 from autodj.models import AudioAsset, Playlist, Rotator, RotatorAsset, Stopset, StopsetRotator
 from common.models import User, generate_random_string
 from services import init_services
+from services.models import PlayoutLogEntry
 
 NUM_SAMPLE_CCMIXTER_ASSETS = 10 if settings.DEBUG else 75  # Less if running in DEBUG mode, faster testing
 
@@ -162,6 +163,28 @@ class AutoDJRequestsForm(forms.Form):
     )
 
 
+class PlayoutLogFilterForm(forms.Form):
+    q = forms.CharField(label="Search", max_length=100, required=False)
+    event_type = forms.ChoiceField(
+        label="Event Type", choices=(("", "All"),) + tuple(PlayoutLogEntry.EventType.choices), required=False
+    )
+    user = forms.ModelChoiceField(queryset=User.objects.order_by("username"), empty_label="All", required=False)
+    active_source = forms.CharField(label="Active Source", max_length=50, required=False)
+    start = forms.DateField(label="From", required=False, widget=forms.DateInput(attrs={"type": "date"}))
+    end = forms.DateField(label="To", required=False, widget=forms.DateInput(attrs={"type": "date"}))
+
+    def get_filters(self):
+        """Keyword arguments for PlayoutLogEntry.objects.filter_log(), with dates (inclusive) as local datetimes"""
+        filters = dict(self.cleaned_data)
+        del filters["q"]
+        for field, days in (("start", 0), ("end", 1)):
+            if filters[field]:
+                filters[field] = timezone.make_aware(
+                    datetime.datetime.combine(filters[field] + datetime.timedelta(days=days), datetime.time())
+                )
+        return filters
+
+
 class UserProfileForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
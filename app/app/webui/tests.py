@@ -1,3 +1,6 @@
+import csv
+import datetime
+import json
 import os
 import re
 import shutil
@@ -8,14 +11,14 @@ import requests_mock
 
 from django.conf import settings
 from django.contrib.messages import get_messages
-from django.test import TransactionTestCase
+from django.test import TestCase, TransactionTestCase
 from django.urls import reverse
 
 from constance import config
 
 from autodj.models import AudioAsset, Playlist, Rotator, Stopset, StopsetRotator
 from common.models import User
-from services.models import UpstreamServer
+from services.models import PlayoutLogEntry, UpstreamServer
 
 from .forms import CCMIXTER_API_URL, FirstRunForm
 from .views import FirstRunView
@@ -38,7 +41,7 @@ class FirstRunTests(TransactionTestCase):
         self.assertIn(message, messages, f"Message {message} not found in request in {messages}")
 
     @requests_mock.Mocker()
-    @patch("services.services.ServiceBase.supervisorctl")
+    @patch("services.services.ServiceBase.supervisorctl", return_value=None)
     @patch("webui.forms.generate_random_string", lambda *args, **kwargs: "random-pw")
     @patch(
         "common.tasks.asset_download_external_url",
@@ -132,3 +135,104 @@ class FirstRunTests(TransactionTestCase):
         User.objects.create_user("user")
         response = self.client.get(reverse("first_run"))
         self.assertRedirects(response, reverse("status"), fetch_redirect_response=False)
+
+
+class PlayoutLogExportTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser("admin", "admin@example.com", "password")
+        self.asset = AudioAsset.objects.create(
+            title="Song", artist="Band", album="Record", duration=datetime.timedelta(seconds=180.5)
+        )
+        created = datetime.datetime(2021, 3, 1, 12, tzinfo=datetime.timezone.utc)
+        for num, (event_type, asset) in enumerate(
+            (("track", self.asset), ("dj", None), ("track", None), ("general", None))
+        ):
+            PlayoutLogEntry.objects.create(
+                description=f"entry {num}",
+                event_type=event_type,
+                audio_asset=asset,
+                user=self.admin if event_type == "dj" else None,
+                created=created + datetime.timedelta(days=num),
+            )
+
+    def export(self, **params):
+        response = self.client.get(reverse("playout_log_export"), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b"".join(response.streaming_content).decode()
+
+    def test_requires_permission(self):
+        User.objects.create_user("dj", password="password")
+        self.client.login(username="dj", password="password")
+        self.assertEqual(self.client.get(reverse("playout_log_export")).status_code, 403)
+
+    def test_export_csv(self):
+        self.client.login(username="admin", password="password")
+        rows = list(csv.DictReader(self.export(start="2021-03-01", end="2021-03-03").splitlines()))
+        self.assertEqual([row["description"] for row in rows], ["entry 0", "entry 1"])
+        self.assertEqual(
+            {key: rows[0][key] for key in ("asset_type", "artist", "title", "album", "duration", "user")},
+            {
+                "asset_type": "audio",
+                "artist": "Band",
+                "title": "Song",
+                "album": "Record",
+                "duration": "180.5",
+                "user": "",
+            },
+        )
+        self.assertEqual(rows[1]["user"], "admin")
+
+    def test_export_jsonl(self):
+        self.client.login(username="admin", password="password")
+        rows = [json.loads(line) for line in self.export(format="jsonl", event_type=["track", "general"]).splitlines()]
+        self.assertEqual([row["description"] for row in rows], ["entry 0", "entry 2", "entry 3"])
+        self.assertIsNone(rows[1]["asset_type"])
+
+        response = self.client.get(reverse("playout_log_export"), {"format": "xml"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_export_zero_duration(self):
+        # Pending and failed assets keep the default duration of zero
+        AudioAsset.objects.filter(id=self.asset.id).update(duration=datetime.timedelta(0))
+        self.client.login(username="admin", password="password")
+        rows = [json.loads(line) for line in self.export(format="jsonl", event_type="track").splitlines()]
+        self.assertEqual([row["duration"] for row in rows], [0.0, None])
+        rows = list(csv.DictReader(self.export(event_type="track").splitlines()))
+        self.assertEqual([row["duration"] for row in rows], ["0.0", ""])
+
+
+class PlayoutLogViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("dj", password="password")
+        self.client.login(username="dj", password="password")
+        for num in range(5):
+            PlayoutLogEntry.objects.create(
+                description=f"entry {num}", event_type="dj" if num % 2 else "track", user=self.user if num else None
+            )
+
+    @patch("webui.views.PlayoutLogPageMixin.MAX_ENTRIES", 2)
+    def test_pages(self):
+        response = self.client.get(reverse("playout_log"), {"event_type": "track"})
+        self.assertEqual([e.description for e in response.context["object_list"]], ["entry 4", "entry 2"])
+        next_page_query = response.context["next_page_query"]
+        self.assertIn("event_type=track", next_page_query)
+
+        response = self.client.get(f"{reverse('playout_log')}?{next_page_query}")
+        self.assertEqual([e.description for e in response.context["object_list"]], ["entry 0"])
+        self.assertIsNone(response.context["next_page_query"])
+
+    def test_json(self):
+        response = self.client.get(reverse("playout_log_entries"), {"user": self.user.id, "event_type": "dj"})
+        self.assertEqual([e["description"] for e in response.json()["entries"]], ["entry 3", "entry 1"])
+        self.assertIsNone(response.json()["next_cursor"])
+        self.assertEqual(self.client.get(reverse("playout_log_entries"), {"cursor": "bad"}).status_code, 400)
+
+    def test_search(self):
+        PlayoutLogEntry.objects.create(description="Harbor came online")
+        response = self.client.get(reverse("playout_log"), {"q": "HARBOR"})
+        self.assertTrue(response.context["is_search"])
+        self.assertEqual([e.description for e in response.context["object_list"]], ["Harbor came online"])
+
+        response = self.client.get(reverse("playout_log_entries"), {"q": "entry", "event_type": "dj"})
+        self.assertEqual([e["description"] for e in response.json()["entries"]], ["entry 3", "entry 1"])
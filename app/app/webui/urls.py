@@ -30,6 +30,8 @@ urlpatterns = [
         name="password_set_by_email",
     ),
     path("playout-log/", views.PlayoutLogView.as_view(), name="playout_log"),
+    path("playout-log/entries/", views.PlayoutLogEntriesView.as_view(), name="playout_log_entries"),
+    path("playout-log/export/", views.PlayoutLogExportView.as_view(), name="playout_log_export"),
     path("profile/", views.UserProfileView.as_view(), name="profile"),
     path(
         "profile/email/<token>/",
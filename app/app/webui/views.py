@@ -18,14 +18,21 @@ from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMix
 from django.contrib.messages.views import SuccessMessageMixin
 from django.core import signing
 from django.core.cache import cache
-from django.http import HttpResponse, HttpResponseForbidden, HttpResponseNotAllowed, JsonResponse
+from django.http import (
+    HttpResponse,
+    HttpResponseBadRequest,
+    HttpResponseForbidden,
+    HttpResponseNotAllowed,
+    JsonResponse,
+    StreamingHttpResponse,
+)
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse, reverse_lazy
 from django.utils import timezone
 from django.utils.formats import date_format
 from django.utils.functional import cached_property
 from django.views.decorators.csrf import csrf_exempt
-from django.views.generic import FormView, ListView, TemplateView, UpdateView, View
+from django.views.generic import FormView, TemplateView, UpdateView, View
 
 from constance import config
 from django_redis import get_redis_connection
@@ -39,11 +46,12 @@ from common.mail import send_mail
 from common.models import User, filter_inactive_group_queryset
 from crazyarms import constants
 from gcal.models import GCalShow
-from services.liquidsoap import harbor
+from services.export import EXPORT_FORMATS, get_export_queryset, iter_export_lines, parse_date_or_datetime
+from services.liquidsoap import get_harbor_status, harbor
 from services.models import PlayoutLogEntry
 from services.services import ZoomService
 
-from .forms import AutoDJRequestsForm, FirstRunForm, UserProfileForm, ZoomForm, pretty_seconds
+from .forms import AutoDJRequestsForm, FirstRunForm, PlayoutLogFilterForm, UserProfileForm, ZoomForm, pretty_seconds
 from .tasks import stop_zoom_broadcast
 
 logger = logging.getLogger(f"crazyarms.{__name__}")
@@ -181,7 +189,7 @@ class StatusView(LoginRequiredMixin, TemplateView):
         return {
             **super().get_context_data(**kwargs),
             "autodj_requests_form": AutoDJRequestsForm() if self.request.user.has_autodj_request_permission() else None,
-            "liquidsoap_status": harbor.status(safe=True, as_dict=True),
+            "liquidsoap_status": get_harbor_status(),
             "upcoming_status": self.get_upcoming_status_data(),
         }
 
@@ -234,6 +242,7 @@ class BanListView(PermissionRequiredMixin, TemplateView):
         # TODO: simple formview with a model choice field for user?
         user = get_object_or_404(User, id=request.POST.get("user_id"))
         cache.delete(f"{constants.CACHE_KEY_HARBOR_BAN_PREFIX}{user.id}")
+        user.update_harbor_auth_record()
         messages.success(request, f"The ban on {user.get_full_name()} has been lifted.")
         return redirect("banlist")
 
@@ -599,6 +608,7 @@ class BootView(LoginRequiredMixin, View):
                                 True,
                                 timeout=time,
                             )
+                            user.update_harbor_auth_record()
                             harbor.dj_harbor__stop()
                             logger.info(f"{self.request.user} banned {user} for {ban_text}")
                             response = (
@@ -610,7 +620,7 @@ class BootView(LoginRequiredMixin, View):
 
 class SkipView(LoginRequiredMixin, View):
     def post(self, request, *args, **kwargs):
-        status = harbor.status(safe=True, as_dict=True)
+        status = get_harbor_status()
         if status is None:
             response = "Invalid response from harbor"
         else:
@@ -636,11 +646,99 @@ class SkipView(LoginRequiredMixin, View):
         return HttpResponse(response, content_type="text/plain")
 
 
-class PlayoutLogView(LoginRequiredMixin, ListView):
+class PlayoutLogPageMixin(LoginRequiredMixin):
     MAX_ENTRIES = 250
+
+    def get_page(self):
+        """Returns the filter form, then the page of log entries and next page's cursor (or None if invalid). Searches
+        return the best matches, ranked, with no next page."""
+        form = PlayoutLogFilterForm(self.request.GET)
+        if form.is_valid():
+            queryset = PlayoutLogEntry.objects.filter_log(**form.get_filters())
+            if form.cleaned_data["q"]:
+                return form, (list(queryset.search(form.cleaned_data["q"])[: self.MAX_ENTRIES]), None)
+            try:
+                return form, queryset.page(cursor=self.request.GET.get("cursor"), limit=self.MAX_ENTRIES)
+            except ValueError:
+                pass
+        return form, None
+
+
+class PlayoutLogView(PlayoutLogPageMixin, TemplateView):
     template_name = "webui/playout_log.html"
-    queryset = PlayoutLogEntry.objects.order_by("-created")[:MAX_ENTRIES]
-    extra_context = {"title": "Playout Log", "MAX_ENTRIES": MAX_ENTRIES}
+
+    def get_context_data(self, **kwargs):
+        form, page = self.get_page()
+        log_entries, next_cursor = page or ([], None)
+        query = self.request.GET.copy()
+        query.pop("cursor", None)
+        first_page_query = query.urlencode()
+        query["cursor"] = next_cursor
+
+        return super().get_context_data(
+            **kwargs,
+            title="Playout Log",
+            form=form,
+            object_list=log_entries,
+            is_first_page=not self.request.GET.get("cursor"),
+            is_search=bool(form.is_valid() and form.cleaned_data["q"]),
+            first_page_query=first_page_query,
+            next_page_query=next_cursor and query.urlencode(),
+            MAX_ENTRIES=self.MAX_ENTRIES,
+        )
+
+
+class PlayoutLogEntriesView(PlayoutLogPageMixin, View):
+    def get(self, request):
+        form, page = self.get_page()
+        if page is None:
+            return JsonResponse({"errors": form.errors}, status=400)
+
+        log_entries, next_cursor = page
+        return JsonResponse(
+            {
+                "entries": [
+                    {
+                        "id": log_entry.id,
+                        "created": log_entry.created,
+                        "event_type": log_entry.event_type,
+                        "description": log_entry.description,
+                        "active_source": log_entry.active_source,
+                        "audio_asset_id": log_entry.audio_asset_id,
+                        "broadcast_asset_id": log_entry.broadcast_asset_id,
+                        "rotator_asset_id": log_entry.rotator_asset_id,
+                        "user_id": log_entry.user_id,
+                        "rank": getattr(log_entry, "rank", None),  # Searches on Postgres only
+                    }
+                    for log_entry in log_entries
+                ],
+                "next_cursor": next_cursor,
+            }
+        )
+
+
+class PlayoutLogExportView(PermissionRequiredMixin, View):
+    permission_required = "services.view_playoutlogentry"
+
+    def get(self, request):
+        dates = {}
+        for arg in ("start", "end"):
+            value = request.GET.get(arg)
+            dates[arg] = value and parse_date_or_datetime(value)
+            if value and dates[arg] is None:
+                return HttpResponseBadRequest(f"Invalid {arg} date or datetime", content_type="text/plain")
+
+        export_format = request.GET.get("format", "csv")
+        event_types = request.GET.getlist("event_type")
+        if export_format not in EXPORT_FORMATS or not set(event_types) <= set(PlayoutLogEntry.EventType.values):
+            return HttpResponseBadRequest("Invalid format or event type", content_type="text/plain")
+
+        queryset = get_export_queryset(dates["start"], dates["end"], event_types)
+        response = StreamingHttpResponse(
+            iter_export_lines(queryset, export_format), content_type=EXPORT_FORMATS[export_format]
+        )
+        response["Content-Disposition"] = f'attachment; filename="playout-log.{export_format}"'
+        return response
 
 
 class PasswordChangeView(SuccessMessageMixin, FormErrorMessageMixin, auth_views.PasswordChangeView):
@@ -4,6 +4,10 @@ if [ "$RUN_HUEY" ]; then
     __RUN_HUEY=1
 fi
 
+if [ "$RUN_API" ]; then
+    __RUN_API=1
+fi
+
 if [ -f /.env ]; then
     source /.env
 fi
@@ -19,6 +23,24 @@ if [ "$#" = 0 ]; then
         else
             exec $CMD
         fi
+    elif [ "${__RUN_API}" ]; then
+        # Internal API (Liquidsoap, SFTP and RTMP callbacks) runs in its own process group under ASGI, so it's not
+        # stuck behind slow admin/webui requests in the gunicorn workers
+        wait-for-it -t 0 db:5432
+
+        if [ "$DEBUG" -a "$DEBUG" != '0' ]; then
+            exec uvicorn --host 0.0.0.0 --port 8000 --reload crazyarms.asgi:application
+        else
+            if [ -z "$API_WORKERS" ]; then
+                API_WORKERS="$(python -c 'import multiprocessing as m; print(max(m.cpu_count(), 2))')"
+            fi
+            if [ -z "$API_CONCURRENCY" ]; then
+                API_CONCURRENCY=200
+            fi
+
+            exec uvicorn --host 0.0.0.0 --port 8000 --workers $API_WORKERS --limit-concurrency $API_CONCURRENCY \
+                --proxy-headers --forwarded-allow-ips '*' --no-server-header crazyarms.asgi:application
+        fi
     else
         echo "Starting up Crazy Arms Radio Backend version $CRAZYARMS_VERSION"
 
@@ -183,6 +183,7 @@ if [ "$FIRST_RUN" ]; then
     get_bool 'Run Icecast service (kh branch)' ICECAST_ENABLED 1
     get_bool 'Enable Zoom (for DJs to broadcast using a Zoom room)' ZOOM_ENABLED 0
     get_bool 'Enable RTMP (for DJs to broadcast using tools like OBS)' RTMP_ENABLED 0
+    get_bool 'Automatically import audio files placed in the imports/ folder' WATCH_IMPORTS_ENABLED 0
     get_bool 'Enable email notifications (via SMTP, like GMail)' EMAIL_ENABLED 0
     if .env get EMAIL_ENABLED && [ "$REPLY" = 1 ]; then
         get_str 'SMTP server, ie smtp.gmail.com' EMAIL_SMTP_SERVER
@@ -237,7 +238,7 @@ else
     COMPOSE_ARGS="$COMPOSE_ARGS -f docker-compose/base.yml"
 
     # Enable compose files for services
-    for CONF in https icecast zoom harbor-telnet-web rtmp; do
+    for CONF in https icecast zoom harbor-telnet-web rtmp watch-imports; do
         CONF_VAR="$(echo "$CONF" | LC_ALL=C tr '[:lower:]-' '[:upper:]_')_ENABLED"
         CONF_VAL="${!CONF_VAR}"
         if [ "$CONF_VAL" -a "$CONF_VAL" != '0' -o "$ALL_SERVICES" ]; then
@@ -14,7 +14,7 @@ elif [ "$1" = 'rename' ]; then
 fi
 
 if [ "$INFILE" ]; then
-    URL='http://app:8000/api/sftp-upload/'
+    URL='http://api:8000/api/sftp-upload/'
     JSON_IN="$(jq -nc --arg p "$INFILE" '{"path": $p}')"
     curl -d "$JSON_IN" -H "X-Crazyarms-Secret-Key: $SECRET_KEY" "$URL"
 fi